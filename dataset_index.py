@@ -0,0 +1,169 @@
+import os
+import time
+import sqlite3
+
+INDEX_FILENAME = "dataset_index.sqlite" # The index file, saved in the dataset root
+_MTIME_SLACK_NS = 2*10**9 # Directories modified more recently than this are rescanned on the next refresh
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS dirs (path TEXT PRIMARY KEY, mtime_ns INTEGER);
+CREATE TABLE IF NOT EXISTS entries (parent TEXT, name TEXT, is_dir INTEGER, PRIMARY KEY (parent, name));
+CREATE TABLE IF NOT EXISTS stamps (parent TEXT, stamp TEXT, PRIMARY KEY (parent, stamp));
+"""
+
+
+def parse_time_stamps(path, in_order = True):
+    """
+    A util function to list the time stamps of an agent folder from its point cloud files.
+
+    Parameters
+        ----------
+        path : str
+            Path to the agent folder.
+        in_order : bool
+            Whether to sort the time stamps.
+
+        Returns
+        -------
+        stamps : list
+            The time stamps (e.g., "000068") of the agent folder.
+    """
+    stamps = []
+    for filename in os.listdir(path):
+        if filename.endswith(".pcd"):
+            stamps.append(filename.split(".")[0])
+    if in_order:
+        stamps.sort()
+    return stamps
+
+class DatasetIndex():
+    """
+    A persistent index of a dataset root, so the pipeline stages do not walk the tree on every run.
+
+    The root holds scenario folders, which hold agent folders and derived files (e.g., trajectories.npz
+    or comm_sim.json), and the agent folders hold one .pcd file per time stamp. The index records the
+    mtime of every indexed folder and only lists the folders whose mtime changed since the last refresh.
+
+    Parameters
+        ----------
+        root : str
+            Path to the dataset root (e.g., the OPV2V train folder or a comm_sim config folder).
+        refresh : bool
+            Whether to bring the index up to date with the tree when it is opened.
+        index_path : str
+            Path to the index file. Defaults to INDEX_FILENAME in the root. An in-memory index is
+            used when the file cannot be opened (e.g., on a read-only root).
+    """
+    def __init__(self, root, refresh = True, index_path = None) -> None:
+        self.root = root
+        self.index_path = index_path if index_path is not None else os.path.join(root, INDEX_FILENAME)
+        try:
+            self._conn = sqlite3.connect(self.index_path, timeout=60, isolation_level=None)
+            # Keep the journal file around, so writing the index does not change the mtime of the root.
+            self._conn.execute("PRAGMA journal_mode=PERSIST")
+            self._conn.executescript(_SCHEMA)
+        except sqlite3.OperationalError:
+            self._conn = sqlite3.connect(":memory:", isolation_level=None)
+            self._conn.executescript(_SCHEMA)
+        if refresh:
+            self.refresh()
+
+    def close(self):
+        self._conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def _full_path(self, rel_path):
+        return os.path.join(self.root, rel_path) if rel_path else self.root
+
+    def _forget(self, rel_path):
+        # Drop a folder and everything indexed below it.
+        bounds = (rel_path, rel_path + "/", rel_path + "0") # "0" sorts right after "/"
+        self._conn.execute("DELETE FROM dirs WHERE path = ? OR (path >= ? AND path < ?)", bounds)
+        self._conn.execute("DELETE FROM entries WHERE parent = ? OR (parent >= ? AND parent < ?)", bounds)
+        self._conn.execute("DELETE FROM stamps WHERE parent = ? OR (parent >= ? AND parent < ?)", bounds)
+
+    def _refresh_dir(self, rel_path, depth):
+        try:
+            mtime_ns = os.stat(self._full_path(rel_path)).st_mtime_ns
+        except FileNotFoundError:
+            self._forget(rel_path)
+            return False
+        row = self._conn.execute("SELECT mtime_ns FROM dirs WHERE path = ?", (rel_path,)).fetchone()
+        if row is not None and row[0] == mtime_ns:
+            return False
+
+        if depth == 2:
+            stamps = parse_time_stamps(self._full_path(rel_path), in_order=False)
+            self._conn.execute("DELETE FROM stamps WHERE parent = ?", (rel_path,))
+            self._conn.executemany("INSERT INTO stamps VALUES (?, ?)", [(rel_path, stamp) for stamp in stamps])
+        else:
+            with os.scandir(self._full_path(rel_path)) as it:
+                listing = {entry.name: entry.is_dir() for entry in it}
+            old_dirs = [name for name, in self._conn.execute(
+                "SELECT name FROM entries WHERE parent = ? AND is_dir = 1", (rel_path,))]
+            for name in old_dirs:
+                if not listing.get(name, False):
+                    self._forget(rel_path + "/" + name if rel_path else name)
+            self._conn.execute("DELETE FROM entries WHERE parent = ?", (rel_path,))
+            self._conn.executemany("INSERT INTO entries VALUES (?, ?, ?)",
+                                   [(rel_path, name, int(is_dir)) for name, is_dir in listing.items()])
+
+        # A folder changed within the mtime granularity may change again unnoticed, so rescan it next time.
+        if time.time_ns() - mtime_ns < _MTIME_SLACK_NS:
+            mtime_ns = -1
+        self._conn.execute("INSERT OR REPLACE INTO dirs VALUES (?, ?)", (rel_path, mtime_ns))
+        return True
+
+    def refresh(self):
+        """
+        Bring the index up to date with the tree. Only the folders whose mtime changed are listed.
+
+        Returns
+        -------
+        rescanned : int
+            The number of folders that were listed.
+        """
+        rescanned = 0
+        self._conn.execute("BEGIN IMMEDIATE")
+        try:
+            rescanned += self._refresh_dir("", 0)
+            for scenario in self.scenarios():
+                rescanned += self._refresh_dir(scenario, 1)
+                for agent in self.agents(scenario):
+                    rescanned += self._refresh_dir(scenario + "/" + agent, 2)
+            self._conn.execute("COMMIT")
+        except BaseException:
+            self._conn.execute("ROLLBACK")
+            raise
+        return rescanned
+
+    def scenarios(self):
+        """Return the sorted names of the scenario folders."""
+        return [name for name, in self._conn.execute(
+            "SELECT name FROM entries WHERE parent = '' AND is_dir = 1 ORDER BY name")]
+
+    def agents(self, scenario):
+        """Return the sorted names of the agent folders of a scenario."""
+        return [name for name, in self._conn.execute(
+            "SELECT name FROM entries WHERE parent = ? AND is_dir = 1 ORDER BY name", (scenario,))]
+
+    def stamps(self, scenario, agent):
+        """Return the sorted time stamps of an agent folder."""
+        return [stamp for stamp, in self._conn.execute(
+            "SELECT stamp FROM stamps WHERE parent = ? ORDER BY stamp", (scenario + "/" + agent,))]
+
+    def files(self, scenario):
+        """Return the sorted names of the files (e.g., derived outputs) in a scenario folder."""
+        return [name for name, in self._conn.execute(
+            "SELECT name FROM entries WHERE parent = ? AND is_dir = 0 ORDER BY name", (scenario,))]
+
+    def derived_path(self, scenario, filename):
+        """Return the path to a file in a scenario folder, or None if the index has not seen it."""
+        row = self._conn.execute("SELECT 1 FROM entries WHERE parent = ? AND name = ? AND is_dir = 0",
+                                 (scenario, filename)).fetchone()
+        return os.path.join(self.root, scenario, filename) if row is not None else None
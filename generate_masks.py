@@ -1,10 +1,18 @@
-import json
 import os
+import time
+import collections
+import collections.abc
+import multiprocessing
+import resource
 import numpy as np
+import json_backend
+from dataset_index import DatasetIndex
+from packet_mask import PacketMask
 
+COMM_SIM_FILENAME = "comm_sim.json"
 
 
-def read_data(filepath):
+def read_data(filepath, backend=None):
     """
     A util function to load json file.
 
@@ -12,15 +20,15 @@ def read_data(filepath):
         ----------
         filepath : str
             Path to the json file.
+        backend : str
+            The JSON backend, one of json_backend.available_backends(). Defaults to orjson or simdjson when installed.
 
         Returns
         -------
         data : dict
             loaded data from the file specified by the given filepath.
     """
-    with open(filepath, 'r') as fp:
-        data = json.load(fp)
-    return data
+    return json_backend.load(filepath, backend)
 
 def parse_params_from_path(folder_path):
     """
@@ -47,37 +55,226 @@ def parse_params_from_path(folder_path):
     max_time = float(max_time)
     return feature_size, packet_size, max_time
 
-def mask_from_received_packet_num(received_packet_num, feature_size, payload_size):
+def _mask_from_received_packet_num_loop(received_packet_num, feature_size, payload_size, dtype=np.float64):
+    # The former implementation, one slice assignment per received packet, kept as the reference of the benchmark.
+    masks = {}
+    for peer_num in received_packet_num:
+        feature_mask = np.zeros(feature_size, dtype=dtype)
+        for packet_num in received_packet_num[peer_num]:
+            start_index = payload_size*(packet_num)
+            last_index = payload_size*(packet_num+1)
+            if last_index > feature_size:
+                last_index = None
+            feature_mask[start_index:last_index] = 1
+        masks[peer_num] = feature_mask
+    return masks
+
+def mask_from_received_packet_num(received_packet_num, feature_size, payload_size, dtype=np.float64):
     """
     Given the packet numbers of received packets, feature size, and payload size, return 
     correpsonding masks.
 
+    The masks of all peers are built at once: a received vector with one entry per packet is
+    filled for every peer and expanded by payload_size, so no Python loop runs over the packets.
+
     Parameters
         ----------
         received_packet_num : dict
             A dictionary with key equals peer CAV numbers and values of the packet numbers
             of received packets from that peer.
+        feature_size : int
+            The number of elements of the shared feature.
+        payload_size : int
+            The number of feature elements carried by one packet.
+        dtype : numpy dtype
+            The dtype of the masks, e.g., bool or np.uint8 to save memory. Defaults to float64.
 
         Returns
         -------
         masks : dict
             A dictionary with key equals peer CAV numbers and values of the generated boolean masks.
+            The masks are rows of one array shared by all the peers.
     """
-    masks = {}
-    
-    for peer_num in received_packet_num:
-        feature_mask = np.zeros(feature_size)
-        for packet_num in received_packet_num[peer_num]:
-            start_index = payload_size*(packet_num)
-            last_index = payload_size*(packet_num+1)
-            if last_index > feature_size:
-                last_index = None
-            feature_mask[start_index:last_index] = 1.
-        masks[peer_num] = feature_mask
-    
-    return masks
+    peers = list(received_packet_num)
+    n_packets = -(-feature_size//payload_size)
+    received = np.zeros((len(peers), n_packets), dtype=dtype)
+    for row, peer_num in enumerate(peers):
+        packet_nums = np.asarray(received_packet_num[peer_num], dtype=np.int64)
+        received[row, packet_nums[(packet_nums >= 0) & (packet_nums < n_packets)]] = 1
+    feature_masks = np.repeat(received, payload_size, axis=1)[:, :feature_size]
+    return {peer_num: feature_masks[row] for row, peer_num in enumerate(peers)}
+
+def benchmark_mask_construction(feature_size=6000000, payload_size=1000, n_peers=4, loss=0.3, dtype=bool, seed=0):
+    """
+    Compare mask_from_received_packet_num with the former per-packet loop on random losses.
+
+    Parameters
+        ----------
+        feature_size : int
+            The number of elements of the shared feature.
+        payload_size : int
+            The number of feature elements carried by one packet.
+        n_peers : int
+            The number of peer CAVs of the ego.
+        loss : float
+            The probability that a packet is lost.
+        dtype : numpy dtype
+            The dtype of the vectorized masks. The loop is timed with float64, as generate_mask used it.
+        seed : int
+            The seed of the random losses.
+
+        Returns
+        -------
+        timings : dict
+            The seconds spent by each implementation and the bytes of the masks they return.
+    """
+    rng = np.random.default_rng(seed)
+    n_packets = -(-feature_size//payload_size)
+    received_packet_num = {str(peer): np.flatnonzero(rng.random(n_packets) >= loss).tolist() for peer in range(n_peers)}
+
+    start = time.perf_counter()
+    loop_masks = _mask_from_received_packet_num_loop(received_packet_num, feature_size, payload_size)
+    loop_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    masks = mask_from_received_packet_num(received_packet_num, feature_size, payload_size, dtype=dtype)
+    vectorized_time = time.perf_counter() - start
+
+    assert all(np.array_equal(loop_masks[peer], masks[peer]) for peer in received_packet_num), \
+        "The vectorized masks differ from the per-packet loop."
+    loop_bytes = sum(mask.nbytes for mask in loop_masks.values())
+    vectorized_bytes = sum(mask.nbytes for mask in masks.values())
+    print(f"{n_peers} peers, {n_packets} packets of {payload_size}: loop {loop_time*1e3:.1f} ms ({loop_bytes/2**20:.0f} MB), "
+          f"vectorized {np.dtype(dtype).name} {vectorized_time*1e3:.1f} ms ({vectorized_bytes/2**20:.0f} MB), "
+          f"speedup {loop_time/max(vectorized_time, 1e-12):.1f}x")
+    return {"loop": loop_time, "vectorized": vectorized_time, "loop_bytes": loop_bytes, "vectorized_bytes": vectorized_bytes}
+
+def _stamp_packets(stamp_data):
+    # The (duration, received_packet_num) pair of every ego of one time stamp of a comm_sim.json file.
+    packets = {}
+    for cav in stamp_data:
+        times = [float(time[0]) for time in stamp_data[cav]['sent']]
+        received_packet_num = {}
+        for peer_num in stamp_data[cav]['receive']:
+            received_packet_num[peer_num] = []
+            for time, packet_num in stamp_data[cav]['receive'][peer_num]:
+                times.append(float(time))
+                received_packet_num[peer_num].append(int(packet_num))
+        duration = max(times) - min(times) if times else None
+        packets[cav] = (duration, received_packet_num)
+    return packets
+
+def iter_scenario_packets(filepath, backend=None):
+    """
+    Read the received packet numbers and the durations of a comm_sim.json file, one time stamp after the other.
+
+    Parameters
+        ----------
+        filepath : str
+            Path to the comm_sim.json file of a scenario.
+        backend : str
+            The JSON backend. With "stream", the file is parsed one time stamp at a time, so only the text and
+            the parsed records of one time stamp are held in memory. The other backends load the whole file first.
+
+        Yields
+        -------
+        time_stamp : str
+            The time stamp.
+        packets : dict
+            A dictionary with ego CAV numbers as keys and values of (duration, received_packet_num), as in read_scenario_packets.
+    """
+    if backend == "stream":
+        items = json_backend.iter_items(filepath)
+    else:
+        items = read_data(filepath, backend).items()
+    for time_stamp, stamp_data in items:
+        yield time_stamp, _stamp_packets(stamp_data)
+
+def read_scenario_packets(filepath, backend=None):
+    """
+    Read the received packet numbers and the durations of a comm_sim.json file.
+
+    Parameters
+        ----------
+        filepath : str
+            Path to the comm_sim.json file of a scenario.
+        backend : str
+            The JSON backend, as in iter_scenario_packets.
 
-def generate_mask(sub_folder_path):
+        Returns
+        -------
+        packets : dict
+            A nested dictionary with keys of time stamp and ego CAV number, and values of (duration, received_packet_num),
+            where received_packet_num maps the peer CAV numbers to the packet numbers received from them. The duration
+            spans the first sent or received packet of the ego to the last one, and is None if it has none.
+    """
+    return dict(iter_scenario_packets(filepath, backend))
+
+def _measure_json_backend(filepath, backend):
+    # Run in a new process, so the peak resident memory only covers this backend.
+    baseline = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    start = time.perf_counter()
+    packets = read_scenario_packets(filepath, backend)
+    seconds = time.perf_counter() - start
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return seconds, baseline, peak, len(packets)
+
+def benchmark_json_backends(filepath, backends=None):
+    """
+    Compare the JSON backends on reading the packets of a comm_sim.json file.
+
+    Each backend runs in a new process, and its peak resident memory is reported above the memory of that
+    process before the file was read.
+
+    Parameters
+        ----------
+        filepath : str
+            Path to the comm_sim.json file of a scenario.
+        backends : list
+            The backends to compare. Defaults to json_backend.available_backends().
+
+        Returns
+        -------
+        results : dict
+            A dictionary with backend names as keys and values of dictionaries with the seconds spent, the
+            throughput in MB/s and the peak resident memory in MB above the baseline.
+    """
+    backends = json_backend.available_backends() if backends is None else backends
+    size_mb = os.path.getsize(filepath)/2**20
+    context = multiprocessing.get_context("spawn")
+    results = {}
+    for backend in backends:
+        with context.Pool(1) as pool:
+            seconds, baseline, peak, n_stamps = pool.apply(_measure_json_backend, (filepath, backend))
+        results[backend] = {"seconds": seconds, "throughput_mb_s": size_mb/max(seconds, 1e-12),
+                            "peak_rss_mb": (peak - baseline)/1024} # ru_maxrss is in kB on Linux
+        print(f"{backend}: {n_stamps} time stamps of {size_mb:.1f} MB in {seconds:.2f} s, "
+              f"{results[backend]['throughput_mb_s']:.1f} MB/s, peak RSS +{results[backend]['peak_rss_mb']:.0f} MB")
+    return results
+
+def _masks_from_packets(received_packet_num, feature_size, packet_size, dtype, compact):
+    if compact:
+        return {peer_num: PacketMask(packet_nums, feature_size, packet_size) for peer_num, packet_nums in received_packet_num.items()}
+    return mask_from_received_packet_num(received_packet_num, feature_size, packet_size, dtype=dtype)
+
+
+class EgoMasks(tuple):
+    """
+    The (duration, masks) pair of an ego CAV at a time stamp, where masks maps the peer CAV numbers to their masks.
+    Indexing it with a peer CAV number returns the (duration, mask) pair of that peer.
+    """
+    __slots__ = ()
+
+    def __new__(cls, duration, masks):
+        return super().__new__(cls, (duration, masks))
+
+    def __getitem__(self, key):
+        if isinstance(key, str):
+            return self[0], self[1][key]
+        return super().__getitem__(key)
+
+
+def generate_mask(sub_folder_path, dtype=np.float64, compact=False, backend=None):
     """
     Given the folder path to config folders, return the generated masks.
 
@@ -85,77 +282,166 @@ def generate_mask(sub_folder_path):
         ----------
         sub_folder_path : str
             The path to config folders. (e.g., 1e+02_1e+02_1e-01).
+        dtype : numpy dtype
+            The dtype of the masks. bool takes one byte per feature element instead of eight.
+        compact : bool
+            Return PacketMask objects, which hold the received packet numbers and materialize the mask
+            with to_dense() or apply it with apply(feature_array), instead of dense arrays.
+        backend : str
+            The JSON backend, as in iter_scenario_packets. With "stream", the masks of a time stamp are built
+            as soon as it is parsed, and the text of the file is never held in memory as a whole.
 
         Returns
         -------
         mask_by_scenario : dict
             A nasted dictionary with keys of name of scenarios folders, time stamp, ego CAV number, and peer CAV number.
-            The values are duration and masks. 
+            The values are EgoMasks pairs of duration and masks, which also return the duration and the mask of one peer.
             e.g., 
             from generate_masks import generate_mask
             loaded_mask = generate_mask(comm_sim_folder_name)
             duration, mask = loaded_mask[scenario_folder_name][time_stamp][ego_CAV_Number][peer_CAV_Number]
     """
-    filename = "comm_sim.json"
     mask_by_scenario = {}
     if os.path.isdir(sub_folder_path):
         feature_size, packet_size, max_time = parse_params_from_path(sub_folder_path)
-        for scenario_folder_name in os.listdir(sub_folder_path):
-            scenario_folder_path = os.path.join(sub_folder_path, scenario_folder_name)
-            if os.path.isdir(scenario_folder_path):
+        with DatasetIndex(sub_folder_path) as index:
+            paths = {scenario_folder_name: index.derived_path(scenario_folder_name, COMM_SIM_FILENAME)
+                     for scenario_folder_name in index.scenarios()}
+        for scenario_folder_name, filepath in paths.items():
+            if filepath is not None:
                 mask_by_scenario[scenario_folder_name] = {}
-                filepath = os.path.join(scenario_folder_path, filename)
-                data = read_data(filepath)
-                for time_stamp in data:
+                for time_stamp, packets in iter_scenario_packets(filepath, backend):
                     mask_by_scenario[scenario_folder_name][time_stamp] = {}
-                    
-                    for cav in data[time_stamp]:
-                        min_time, max_time = None, None
-                        sent_times = [float(time[0]) for time in data[time_stamp][cav]['sent']]
-                        receive_times = []
-                        received_packet_num = {}
-                        for peer_num in data[time_stamp][cav]['receive']:
-                            received_packet_num[peer_num] = []
-                            for time, packet_num in data[time_stamp][cav]['receive'][peer_num]:
-                                receive_times.append(float(time))
-                                received_packet_num[peer_num].append(int(packet_num))
-                        masks = mask_from_received_packet_num(received_packet_num, int(feature_size), int(packet_size))
-                        this_min_sent_time = min(sent_times) if sent_times else None
-                        this_max_sent_time = max(sent_times) if sent_times else None
-                        this_min_receive_time = min(receive_times) if receive_times else None
-                        this_max_receive_time = max(receive_times) if receive_times else None
-                        if min_time is None:
-                            if this_min_sent_time is None and not this_min_receive_time is None:
-                                min_time = this_min_receive_time
-                            elif not this_min_sent_time is None and this_min_receive_time is None:
-                                min_time  = this_min_sent_time
-                            else:
-                                min_time = min(this_min_sent_time, this_min_receive_time)
-                        else:
-                            if this_min_sent_time is None and not this_min_receive_time is None:
-                                min_time = min(this_min_receive_time, min_time)
-                            elif not this_min_sent_time is None and this_min_receive_time is None:
-                                min_time  = min(this_min_sent_time, min_time)
-                            else:
-                                min_time = min(this_min_sent_time, this_min_receive_time, min_time)
-                        if max_time is None:
-                            if this_max_sent_time is None and not this_max_receive_time is None:
-                                max_time = this_max_receive_time
-                            elif not this_max_sent_time is None and this_max_receive_time is None:
-                                max_time  = this_max_sent_time
-                            else:
-                                max_time = max(this_max_sent_time, this_max_receive_time)
-                        else:
-                            if this_max_sent_time is None and not this_max_receive_time is None:
-                                max_time = max(this_max_receive_time, max_time)
-                            elif not this_max_sent_time is None and this_max_receive_time is None:
-                                max_time  = min(this_max_sent_time, max_time)
-                            else:
-                                max_time = max(this_max_sent_time, this_max_receive_time, max_time)
-                        if not min_time is None and not max_time is None:
-                            duration = max_time - min_time
-                        else:
-                            duration = None
-                        mask_by_scenario[scenario_folder_name][time_stamp][cav] = (duration, masks)
+                    for cav, (duration, received_packet_num) in packets.items():
+                        masks = _masks_from_packets(received_packet_num, int(feature_size), int(packet_size), dtype, compact)
+                        mask_by_scenario[scenario_folder_name][time_stamp][cav] = EgoMasks(duration, masks)
     return mask_by_scenario
 
+
+class _LazyMapping(collections.abc.Mapping):
+    # A read-only view of the scenarios or of the time stamps of one scenario, resolved through a MaskStore.
+    def __init__(self, keys, getter) -> None:
+        self._keys = keys
+        self._getter = getter
+
+    def __getitem__(self, key):
+        if key not in self._keys:
+            raise KeyError(key)
+        return self._getter(key)
+
+    def __iter__(self):
+        return iter(self._keys)
+
+    def __len__(self):
+        return len(self._keys)
+
+
+class MaskStore(collections.abc.Mapping):
+    """
+    A lazy replacement of generate_mask with the same lookups,
+    store[scenario_folder_name][time_stamp][ego_CAV_Number][peer_CAV_Number] -> (duration, mask).
+
+    A comm_sim.json file is only read when one of its time stamps is first accessed, and only its received
+    packet numbers are kept, for the last max_scenarios scenarios. The masks of an ego are built when they are
+    accessed and kept in a least recently used cache of at most max_bytes bytes of masks.
+
+    Parameters
+        ----------
+        sub_folder_path : str
+            The path to config folders. (e.g., 1e+02_1e+02_1e-01).
+        max_bytes : int
+            The memory budget of the cached masks.
+        max_scenarios : int
+            The number of scenarios whose received packet numbers are kept.
+        dtype : numpy dtype
+            The dtype of the masks, as in generate_mask.
+        compact : bool
+            Return PacketMask objects instead of dense arrays, as in generate_mask.
+        backend : str
+            The JSON backend, as in iter_scenario_packets.
+
+    Attributes
+        ----------
+        hits, misses, evictions : int
+            The number of accesses served from the cache, of accesses that built the masks of an ego,
+            and of egos dropped from the cache to fit in max_bytes.
+        parses : int
+            The number of comm_sim.json files read.
+    """
+    def __init__(self, sub_folder_path, max_bytes = 2**30, max_scenarios = 2, dtype = np.float64, compact = False, backend = None) -> None:
+        self.feature_size, self.packet_size, _ = (int(ele) for ele in parse_params_from_path(sub_folder_path))
+        self.max_bytes = max_bytes
+        self.max_scenarios = max_scenarios
+        self.dtype = dtype
+        self.compact = compact
+        self.backend = backend
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.parses = 0
+        self.nbytes = 0
+        self._paths = {}
+        if os.path.isdir(sub_folder_path):
+            with DatasetIndex(sub_folder_path) as index:
+                for scenario_folder_name in index.scenarios():
+                    filepath = index.derived_path(scenario_folder_name, COMM_SIM_FILENAME)
+                    if filepath is not None:
+                        self._paths[scenario_folder_name] = filepath
+        self._packets = collections.OrderedDict()
+        self._cache = collections.OrderedDict()
+
+    def _scenario_packets(self, scenario):
+        if scenario in self._packets:
+            self._packets.move_to_end(scenario)
+        else:
+            self._packets[scenario] = read_scenario_packets(self._paths[scenario], self.backend)
+            self.parses += 1
+            while len(self._packets) > max(self.max_scenarios, 1):
+                self._packets.popitem(last=False)
+        return self._packets[scenario]
+
+    def _ego_masks(self, scenario, time_stamp, cav):
+        key = (scenario, time_stamp, cav)
+        if key in self._cache:
+            self.hits += 1
+            self._cache.move_to_end(key)
+            return self._cache[key][0]
+        self.misses += 1
+        duration, received_packet_num = self._scenario_packets(scenario)[time_stamp][cav]
+        masks = _masks_from_packets(received_packet_num, self.feature_size, self.packet_size, self.dtype, self.compact)
+        ego_masks = EgoMasks(duration, masks)
+        nbytes = sum(mask.nbytes for mask in masks.values())
+        self._cache[key] = (ego_masks, nbytes)
+        self.nbytes += nbytes
+        while self.nbytes > self.max_bytes and len(self._cache) > 1:
+            _, (_, evicted_bytes) = self._cache.popitem(last=False)
+            self.nbytes -= evicted_bytes
+            self.evictions += 1
+        return ego_masks
+
+    def _stamps(self, scenario):
+        packets = self._scenario_packets(scenario)
+        return _LazyMapping(packets.keys(), lambda time_stamp: _LazyMapping(
+            packets[time_stamp].keys(), lambda cav: self._ego_masks(scenario, time_stamp, cav)))
+
+    def __getitem__(self, scenario):
+        if scenario not in self._paths:
+            raise KeyError(scenario)
+        return self._stamps(scenario)
+
+    def __iter__(self):
+        return iter(self._paths)
+
+    def __len__(self):
+        return len(self._paths)
+
+    def stats(self):
+        """Return the cache counters and the bytes of the cached masks."""
+        return {"hits": self.hits, "misses": self.misses, "evictions": self.evictions,
+                "parses": self.parses, "nbytes": self.nbytes, "entries": len(self._cache)}
+
+    def clear(self):
+        """Drop the cached masks and packet numbers."""
+        self._packets.clear()
+        self._cache.clear()
+        self.nbytes = 0
@@ -1,53 +1,198 @@
+import io
 import os
 import yaml
 import re
+import time
 import json
+import multiprocessing
+import collections
+import functools
+import hashlib
+import numpy as np
+from yaml.composer import Composer
+from yaml.constructor import Constructor
+from yaml.resolver import Resolver
+import trajectory_store
+from dataset_index import DatasetIndex, parse_time_stamps
 
 DELTA_TIME = 0.05 # The time difference in second between two adjacent time stamp
+MANIFEST_FILENAME = "trajectories.manifest.json" # The inputs the trajectory store of a scenario was generated from
 
-def _parse_time_stamps(path:str, in_order = True) -> list:
-    stamps = []
-    for filename in os.listdir(path):
-        if filename.endswith(".pcd"):
-            stamps.append(filename.split(".")[0])
-
-    if in_order:
-        stamps.sort()
-
-    return stamps
-
-def _get_yaml_loader():
-    loader = yaml.Loader
-    loader.add_implicit_resolver(
-        u'tag:yaml.org,2002:float',
-        re.compile(u'''^(?:
+_YAML_FLOAT_PATTERN = re.compile(u'''^(?:
          [-+]?(?:[0-9][0-9_]*)\\.[0-9_]*(?:[eE][-+]?[0-9]+)?
         |[-+]?(?:[0-9][0-9_]*)(?:[eE][-+]?[0-9]+)
         |\\.[0-9_]+(?:[eE][-+][0-9]+)?
         |[-+]?[0-9][0-9_]*(?::[0-5]?[0-9])+\\.[0-9_]*
         |[-+]?\\.(?:inf|Inf|INF)
-        |\\.(?:nan|NaN|NAN))$''', re.X),
-        list(u'-+0123456789.'))
+        |\\.(?:nan|NaN|NAN))$''', re.X)
+
+_TOP_LEVEL_LINE = re.compile(r'^[^\s#-].*$', re.M) # Lines starting at column 0 that are neither comments nor sequence entries
+_TOP_LEVEL_KEY = re.compile(r'([A-Za-z_][\w.]*):(?:[ \t]|$)')
+
+def _get_yaml_loader():
+    loader = yaml.Loader
+    loader.add_implicit_resolver(u'tag:yaml.org,2002:float', _YAML_FLOAT_PATTERN, list(u'-+0123456789.'))
     
     return loader
 
-def _read_yaml_files(path:str, stamps:list, fields:list) -> list:
+class _BlockLoader(getattr(yaml, "CLoader", yaml.Loader)):
+    """Loads the sliced top-level blocks, with LibYAML when it is available."""
+
+_BlockLoader.add_implicit_resolver(u'tag:yaml.org,2002:float', _YAML_FLOAT_PATTERN, list(u'-+0123456789.'))
+
+if yaml.__with_libyaml__:
+    class _EventLoader(yaml.cyaml.CParser, Composer, Constructor, Resolver):
+        """Composes Python nodes on top of the LibYAML event stream."""
+        def __init__(self, stream):
+            yaml.cyaml.CParser.__init__(self, stream)
+            Composer.__init__(self)
+            Constructor.__init__(self)
+            Resolver.__init__(self)
+else:
+    class _EventLoader(yaml.Loader):
+        """Composes Python nodes on top of the pure-Python event stream."""
+
+_EventLoader.add_implicit_resolver(u'tag:yaml.org,2002:float', _YAML_FLOAT_PATTERN, list(u'-+0123456789.'))
+
+def _load_yaml_file(yaml_path:str) -> dict:
+    with open(yaml_path, 'r') as fp:
+        yaml_file = yaml.load(fp, Loader=_get_yaml_loader())
+        if "yaml_parser" in yaml_file:
+            yaml_file = eval(yaml_file["yaml_parser"])(yaml_file)
+    return yaml_file
+
+def _slice_top_level_blocks(text:str, fields:list):
+    # Returns None when the document is not a plain block mapping that can be sliced by lines.
+    starts = []
+    for match in _TOP_LEVEL_LINE.finditer(text):
+        key_match = _TOP_LEVEL_KEY.match(match.group())
+        if key_match is None:
+            return None
+        starts.append((match.start(), key_match.group(1)))
+
+    keys = [key for _, key in starts]
+    if "yaml_parser" in keys or not all(field in keys for field in fields):
+        return None
+
+    blocks = []
+    for i, (start, key) in enumerate(starts):
+        if key in fields:
+            end = starts[i+1][0] if i+1 < len(starts) else len(text)
+            blocks.append(text[start:end].rstrip("\n") + "\n")
+    return "".join(blocks)
+
+def _skip_node(loader) -> None:
+    depth = 0
+    while True:
+        event = loader.get_event()
+        if isinstance(event, (yaml.MappingStartEvent, yaml.SequenceStartEvent)):
+            depth += 1
+        elif isinstance(event, (yaml.MappingEndEvent, yaml.SequenceEndEvent)):
+            depth -= 1
+        if depth == 0:
+            return
+
+def _scan_top_level_fields(stream, fields:list):
+    # Streams the events of the document and only composes the values of the requested top-level keys.
+    # Returns None when the document needs a full load (e.g., it defines a yaml_parser).
+    wanted = set(fields) | {"yaml_parser"}
+    loader = _EventLoader(stream)
+    try:
+        loader.get_event() # StreamStartEvent
+        loader.get_event() # DocumentStartEvent
+        if not loader.check_event(yaml.MappingStartEvent):
+            return None
+        loader.get_event()
+        pairs = []
+        while not loader.check_event(yaml.MappingEndEvent):
+            key_node = loader.compose_node(None, None)
+            if isinstance(key_node, yaml.ScalarNode) and key_node.value in wanted:
+                if key_node.value == "yaml_parser":
+                    return None
+                pairs.append((key_node, loader.compose_node(None, None)))
+            else:
+                _skip_node(loader)
+        return loader.construct_document(yaml.MappingNode(u'tag:yaml.org,2002:map', pairs))
+    finally:
+        loader.dispose()
+
+def _read_yaml_text(yaml_path:str):
+    # Read a yaml file once: its text as open(yaml_path, 'r') decodes it, and its [size, mtime, hash] signature.
+    with open(yaml_path, 'rb') as fp:
+        data = fp.read()
+        stat = os.fstat(fp.fileno())
+    text = io.TextIOWrapper(io.BytesIO(data)).read()
+    return text, [stat.st_size, stat.st_mtime_ns, hashlib.sha1(data).hexdigest()]
+
+def _extract_yaml_fields(yaml_path:str, fields:list, text = None) -> dict:
+    '''
+    Read the given top-level fields of a yaml file without building the rest of the document.
+    \param str yaml_path: the path to the yaml file.
+           list fields: the top-level keys to read.
+           str text: the content of the file, if it was already read.
+    return dict: the values of the requested fields, identical to the values of a full load.
+    '''
+    if text is None:
+        with open(yaml_path, 'r') as fp:
+            text = fp.read()
+
+    partial = None
+    blocks = _slice_top_level_blocks(text, fields)
+    if blocks is not None:
+        try:
+            partial = yaml.load(blocks, Loader=_BlockLoader)
+        except yaml.YAMLError:
+            partial = None
+    if partial is None:
+        try:
+            partial = _scan_top_level_fields(text, fields)
+        except yaml.YAMLError:
+            partial = None
+    if partial is None:
+        partial = _load_yaml_file(yaml_path)
+
+    return {field: partial[field] for field in fields}
+
+def _read_yaml_files(path:str, stamps:list, fields:list, full_load = False, files = None) -> list:
+    # files, if given, is filled with the signature of each yaml file read by the field extraction (see _read_yaml_text).
     results = []
-    loader = _get_yaml_loader()
     for stamp in stamps:
         yaml_path = os.path.join(path, stamp+".yaml")
-        with open(yaml_path, 'r') as fp:
-            yaml_file = yaml.load(fp, Loader=loader)
-            if "yaml_parser" in yaml_file:
-                yaml_file = eval(yaml_file["yaml_parser"])(yaml_file)
-        temp_dict = {}
-
-        for field in fields:
-            temp_dict[field] = yaml_file[field]
-        results.append(temp_dict)
+        if full_load:
+            yaml_file = _load_yaml_file(yaml_path)
+            results.append({field: yaml_file[field] for field in fields})
+        elif files is not None:
+            text, files[stamp+".yaml"] = _read_yaml_text(yaml_path)
+            results.append(_extract_yaml_fields(yaml_path, fields, text))
+        else:
+            results.append(_extract_yaml_fields(yaml_path, fields))
     
     return results
 
+def benchmark_yaml_extraction(path:str, fields = ["true_ego_pos"]) -> dict:
+    '''
+    Compare the targeted field extraction with the full yaml load on one agent folder.
+    \param str path: the directory of an agent folder.
+           list fields: the top-level keys to read.
+    return dict: the seconds spent per file by each loader.
+    '''
+    stamps = parse_time_stamps(path)
+
+    start = time.perf_counter()
+    full_results = _read_yaml_files(path, stamps, fields, full_load=True)
+    full_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    extracted_results = _read_yaml_files(path, stamps, fields)
+    extracted_time = time.perf_counter() - start
+
+    assert full_results == extracted_results, "The extracted fields differ from the full yaml load."
+    n_files = max(len(stamps), 1)
+    print(f"{len(stamps)} files, libyaml {'enabled' if yaml.__with_libyaml__ else 'disabled'}: "
+          f"full load {full_time/n_files*1e3:.2f} ms/file, extraction {extracted_time/n_files*1e3:.2f} ms/file, "
+          f"speedup {full_time/max(extracted_time, 1e-12):.1f}x")
+    return {"full_load": full_time/n_files, "extraction": extracted_time/n_files}
+
 def _post_process(stamps:list, yaml_files:list, fields:list) -> list:
     result = []
     int_stamps = [int(ele) for ele in stamps]
@@ -68,24 +213,158 @@ def _save_to_json(content, path:str) -> None:
     with open(os.path.join(path, filename), "w+") as fp:
         json.dump(content, fp)
     
-def parse_one_agent(path):
+def parse_one_agent(path, save_json = False, stamps = None, files = None):
     print(f"Parsing Folder {path}")
-    stamps = _parse_time_stamps(path)
+    if stamps is None:
+        stamps = parse_time_stamps(path)
     fields = ["true_ego_pos"]
-    yaml_files = _read_yaml_files(path, stamps, fields)
+    yaml_files = _read_yaml_files(path, stamps, fields, files=files)
     processed = _post_process(stamps, yaml_files, fields)
-    _save_to_json(processed, path)
+    if save_json:
+        _save_to_json(processed, path)
+    return trajectory_store.rows_to_array(processed)
+
+
+def _hash_file(path:str) -> str:
+    digest = hashlib.sha1()
+    with open(path, "rb") as fp:
+        for chunk in iter(lambda: fp.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def _refresh_agent_signature(path:str, stamps:list, signature):
+    # Returns the signature with refreshed mtimes if the inputs are unchanged, otherwise None.
+    # Files are only hashed when their mtime moved but their size did not.
+    if signature is None:
+        return None
+    if stamps != signature["stamps"]:
+        return None
+    files = {}
+    for stamp in stamps:
+        filename = stamp+".yaml"
+        yaml_path = os.path.join(path, filename)
+        if filename not in signature["files"] or not os.path.exists(yaml_path):
+            return None
+        size, mtime_ns, digest = signature["files"][filename]
+        stat = os.stat(yaml_path)
+        if stat.st_size != size:
+            return None
+        if stat.st_mtime_ns != mtime_ns and _hash_file(yaml_path) != digest:
+            return None
+        files[filename] = [size, stat.st_mtime_ns, digest]
+    return {"stamps": stamps, "files": files}
+
+def _read_manifest(index:DatasetIndex, scenario:str) -> dict:
+    manifest_path = index.derived_path(scenario, MANIFEST_FILENAME)
+    if manifest_path is None or index.derived_path(scenario, trajectory_store.STORE_FILENAME) is None:
+        return {}
+    with open(manifest_path, "r") as fp:
+        return json.load(fp)
+
+def _save_manifest(scenario_path:str, manifest:dict) -> None:
+    manifest_path = os.path.join(scenario_path, MANIFEST_FILENAME)
+    with open(manifest_path+".tmp", "w") as fp:
+        json.dump(manifest, fp)
+    os.replace(manifest_path+".tmp", manifest_path)
+
+def _parse_one_agent_isolated(unit, save_json = False):
+    # Runs in the worker processes, so a corrupt YAML only fails its own agent folder.
+    # The signature of the agent folder, i.e. its stamps and the size, mtime and hash of their yaml files,
+    # is taken from the same reads as the trajectory.
+    path, stamps = unit
+    try:
+        files = {}
+        trajectory = parse_one_agent(path, save_json, stamps, files)
+        signature = {"stamps": stamps, "files": files}
+    except Exception as e:
+        return path, None, None, f"{type(e).__name__}: {e}"
+    return path, trajectory, signature, None
+
+def main(path, num_workers = 1, save_json = False, incremental = False, index = None):
+    '''
+    Extract the waypoints of every agent folder under the given dataset split, and save them
+    as one trajectory store per scenario folder (see trajectory_store.py).
+    \param str path: the directory of the dataset split (e.g., the OPV2V train folder).
+           int num_workers: the number of worker processes. Each (scenario, agent) folder is one work unit.
+                            1 parses the folders in the current process.
+           bool save_json: also save the waypoints of each agent as <agent>.json in its folder.
+           bool incremental: only parse the agent folders whose inputs changed since the manifest of their
+                             scenario was written, and reuse the stored trajectories of the others.
+           DatasetIndex index: the index of the dataset split. Opened (and refreshed) from path if not given.
+    return dict: the agent folders that failed to parse, with their error messages as values.
+    '''
+    if index is None:
+        index = DatasetIndex(path)
+    scenarios = index.scenarios()
+
+    agent_folders = []
+    trajectories = collections.defaultdict(dict)
+    manifests = collections.defaultdict(dict)
+    n_agents, n_reused, n_unchanged_scenarios = 0, 0, 0
+    for scenario in scenarios:
+        scenario_path = os.path.join(path, scenario)
+        manifest = _read_manifest(index, scenario) if incremental else {}
+        stored = trajectory_store.load_trajectories(scenario_path) if manifest else {}
+        agent_ids = index.agents(scenario)
+        stale = []
+        for agent_id in agent_ids:
+            agent_path = os.path.join(scenario_path, agent_id)
+            stamps = index.stamps(scenario, agent_id)
+            signature = _refresh_agent_signature(agent_path, stamps, manifest.get(agent_id)) if agent_id in stored else None
+            if signature is None:
+                stale.append((agent_path, stamps))
+            else:
+                trajectories[scenario_path][agent_id] = np.array(stored[agent_id])
+                manifests[scenario_path][agent_id] = signature
+        n_agents += len(agent_ids)
+        n_reused += len(agent_ids) - len(stale)
+        agent_folders.extend(stale)
+        if not stale:
+            n_unchanged_scenarios += 1
+            if set(trajectories[scenario_path]) != set(stored):
+                # Agent folders were removed since the last run.
+                trajectory_store.save_trajectories(scenario_path, trajectories[scenario_path])
+            if manifests[scenario_path] != manifest:
+                _save_manifest(scenario_path, manifests[scenario_path])
+            trajectories.pop(scenario_path)
+            manifests.pop(scenario_path)
+
+    remaining = collections.Counter(os.path.dirname(agent_path) for agent_path, _ in agent_folders)
+    failures = {}
+
+    def _collect(outcomes):
+        for agent_path, trajectory, signature, error in outcomes:
+            scenario_path = os.path.dirname(agent_path)
+            if error is None:
+                trajectories[scenario_path][_parse_agent_id(agent_path)] = trajectory
+                manifests[scenario_path][_parse_agent_id(agent_path)] = signature
+            else:
+                failures[agent_path] = error
+            remaining[scenario_path] -= 1
+            if remaining[scenario_path] == 0:
+                # Only complete scenarios are saved, so the simulator never sees a partial vehicle set.
+                scenario_trajectories = trajectories.pop(scenario_path, {})
+                scenario_manifest = manifests.pop(scenario_path, {})
+                if not any(os.path.dirname(failed) == scenario_path for failed in failures):
+                    trajectory_store.save_trajectories(scenario_path, scenario_trajectories)
+                    _save_manifest(scenario_path, scenario_manifest)
 
+    parse_fn = functools.partial(_parse_one_agent_isolated, save_json=save_json)
+    if num_workers <= 1:
+        _collect(map(parse_fn, agent_folders))
+    else:
+        with multiprocessing.Pool(processes=min(num_workers, max(len(agent_folders), 1))) as pool:
+            _collect(pool.imap(parse_fn, agent_folders, chunksize=1))
 
-def main(path):
-    for sub_folder in os.listdir(path):
-        sub_folder_dir = os.path.join(path, sub_folder)
-        if os.path.isdir(sub_folder_dir):
-            for agent_folder in os.listdir(sub_folder_dir):
-                agent_folder_path = os.path.join(sub_folder_dir, agent_folder)
-                if os.path.isdir(agent_folder_path):
-                    parse_one_agent(agent_folder_path)
+    if incremental:
+        print(f"Skipped {n_reused}/{n_agents} unchanged agent folders ({n_unchanged_scenarios}/{len(scenarios)} scenarios skipped)")
+    print(f"Parsed {len(agent_folders) - len(failures)}/{len(agent_folders)} agent folders")
+    for agent_path, error in failures.items():
+        print(f"Failed to parse {agent_path}: {error}")
+    return failures
 
 if __name__ == "__main__":
     path = "/home/cps-tingcong/Downloads/opencood_test/test/"
-    main(path)
\ No newline at end of file
+    num_workers = os.cpu_count() # The number of processes used to parse the agent folders
+    incremental = True # Only re-parse the agent folders whose yaml files changed since the last run
+    main(path, num_workers=num_workers, incremental=incremental)
@@ -0,0 +1,173 @@
+import json
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+try:
+    import simdjson
+except ImportError:
+    simdjson = None
+
+BACKENDS = ["orjson", "simdjson", "json", "stream"]
+_WHITESPACE = " \t\n\r"
+_DELIMITERS = _WHITESPACE + ",:}]" # The characters that can follow a complete value or key
+
+
+def available_backends():
+    """Return the backends that can be used here, the fastest first."""
+    installed = {"orjson": orjson is not None, "simdjson": simdjson is not None}
+    return [backend for backend in BACKENDS if installed.get(backend, True)]
+
+def default_backend():
+    """Return the fastest installed backend that loads a whole file: orjson, then simdjson, then json."""
+    return available_backends()[0]
+
+def _check_backend(backend):
+    if backend is None:
+        return default_backend()
+    if backend not in available_backends():
+        raise ValueError(f"The JSON backend {backend} is not available, expected one of {available_backends()}.")
+    return backend
+
+
+class _ItemReader():
+    # Decode the members of the top-level object of a JSON file one after the other, from a buffer
+    # that only holds the text of the member being decoded.
+    def __init__(self, fp, chunk_size) -> None:
+        self.fp = fp
+        self.chunk_size = chunk_size
+        self.buffer = ""
+        self.pos = 0
+        self.decoder = json.JSONDecoder()
+
+    def read(self, size):
+        chunk = self.fp.read(size)
+        if not chunk:
+            return False
+        self.buffer = self.buffer[self.pos:] + chunk
+        self.pos = 0
+        return True
+
+    def peek(self, skip):
+        # The next character that is not in skip, or "" at the end of the file.
+        while True:
+            while self.pos < len(self.buffer) and self.buffer[self.pos] in skip:
+                self.pos += 1
+            if self.pos < len(self.buffer):
+                return self.buffer[self.pos]
+            if not self.read(self.chunk_size):
+                return ""
+
+    def decode(self):
+        # Read twice as much text after every failed attempt, so a large member is decoded in linear time.
+        # A value is only complete when a delimiter follows it, as a number cut by the end of the buffer,
+        # e.g. "1." of "1.5", is still decoded.
+        size = self.chunk_size
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buffer, self.pos)
+                error = None
+            except json.JSONDecodeError as e:
+                end, error = None, e
+            if end is not None and end < len(self.buffer) and self.buffer[end] in _DELIMITERS:
+                self.pos = end
+                return value
+            if not self.read(size):
+                if error is not None:
+                    raise error
+                self.pos = end
+                return value
+            size *= 2
+
+def iter_items(path, chunk_size = 1 << 20):
+    """
+    Parse the members of the top-level object of a JSON file one after the other.
+
+    Parameters
+        ----------
+        path : str
+            Path to a JSON file holding an object, e.g., a comm_sim.json file.
+        chunk_size : int
+            The number of characters read at once.
+
+        Yields
+        -------
+        key : str
+            The key of a member, e.g., a time stamp.
+        value : object
+            The parsed value of the member. Only one member is held in memory at a time.
+    """
+    with open(path, "r") as fp:
+        reader = _ItemReader(fp, chunk_size)
+        if reader.peek(_WHITESPACE) != "{":
+            raise ValueError(f"{path} does not hold a JSON object.")
+        reader.pos += 1
+        if reader.peek(_WHITESPACE) == "}":
+            return
+        while True:
+            if reader.peek(_WHITESPACE) != '"':
+                raise ValueError(f"Expected a key in the JSON object of {path}.")
+            key = reader.decode()
+            if reader.peek(_WHITESPACE) != ":":
+                raise ValueError(f"Expected ':' after the key {key} in {path}.")
+            reader.pos += 1
+            reader.peek(_WHITESPACE)
+            yield key, reader.decode()
+            char = reader.peek(_WHITESPACE)
+            if char == "}":
+                return
+            if char == "":
+                raise ValueError(f"{path} ends in the middle of its JSON object.")
+            if char != ",":
+                raise ValueError(f"Expected ',' or '}}' after the value of {key} in {path}.")
+            reader.pos += 1
+
+def load(path, backend = None):
+    """
+    Load a JSON file.
+
+    Parameters
+        ----------
+        path : str
+            Path to the JSON file.
+        backend : str
+            One of available_backends(). Defaults to default_backend(). The stream backend builds
+            the object from iter_items, which only pays off when the caller consumes the members itself.
+
+        Returns
+        -------
+        data : object
+            The loaded data.
+    """
+    backend = _check_backend(backend)
+    if backend == "stream":
+        return dict(iter_items(path))
+    if backend == "json":
+        with open(path, "r") as fp:
+            return json.load(fp)
+    with open(path, "rb") as fp:
+        data = fp.read()
+    if backend == "orjson":
+        return orjson.loads(data)
+    return simdjson.loads(data)
+
+def dump(data, path, backend = None):
+    """
+    Write data into a JSON file, with orjson when it is installed and requested, or json otherwise.
+
+    Parameters
+        ----------
+        data : object
+            The data to write. Non-string keys are written as strings, as json does.
+        path : str
+            Path to the JSON file.
+        backend : str
+            One of available_backends(). Defaults to default_backend().
+    """
+    if _check_backend(backend) == "orjson":
+        with open(path, "wb") as fp:
+            fp.write(orjson.dumps(data, option=orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY))
+    else:
+        with open(path, "w") as fp:
+            json.dump(data, fp)
@@ -0,0 +1,228 @@
+import os
+import json
+import shutil
+import struct
+import numpy as np
+from dataset_index import DatasetIndex
+from generate_masks import COMM_SIM_FILENAME, EgoMasks, iter_scenario_packets, parse_params_from_path
+from packet_mask import PacketMask
+
+INDEX_FILENAME = "comm_sim_masks.bin" # The compiled masks of a config folder, saved in that folder
+MAGIC = b"CSMASKS1"
+_ALIGNMENT = 64
+EGO_DTYPE = np.dtype([("scenario", "<u4"), ("stamp", "<u4"), ("ego", "<u4"), ("n_peers", "<u4"),
+                      ("first", "<u8"), ("duration", "<f8")])
+
+
+def index_path(sub_folder_path):
+    """
+    A util function to get the path of the compiled mask index of a config folder.
+
+    Parameters
+        ----------
+        sub_folder_path : str
+            The path to config folders. (e.g., 1e+02_1e+02_1e-01).
+
+        Returns
+        -------
+        path : str
+            Path to the mask index.
+    """
+    return os.path.join(sub_folder_path, INDEX_FILENAME)
+
+def _align(offset):
+    return -(-offset//_ALIGNMENT)*_ALIGNMENT
+
+def _ego_keys(scenario_ids, stamp_ids, ego_ids):
+    # Combine the ids of the egos into one sortable key.
+    return (np.asarray(scenario_ids, dtype=np.uint64) << np.uint64(42)) \
+        | (np.asarray(stamp_ids, dtype=np.uint64) << np.uint64(21)) | np.asarray(ego_ids, dtype=np.uint64)
+
+def compile_mask_index(sub_folder_path, path = None, backend = None):
+    """
+    Compile the comm_sim.json files of a config folder into one binary file that MaskIndex memory maps.
+
+    The file holds a JSON header with the config and the names of the scenarios, time stamps and CAVs,
+    followed by three tables, each aligned to 64 bytes:
+        egos  : one EGO_DTYPE row per (scenario, time stamp, ego), sorted by their ids, with the duration (NaN if None)
+                and the range [first, first + n_peers) of its rows in the two next tables.
+        peers : the CAV id of each peer, as uint32.
+        bits  : the received packets of each peer, as bitsets of n_packets bits packed by np.packbits.
+
+    Parameters
+        ----------
+        sub_folder_path : str
+            The path to config folders. (e.g., 1e+02_1e+02_1e-01).
+        path : str
+            Where to write the index. Defaults to index_path(sub_folder_path).
+        backend : str
+            The JSON backend used to read the comm_sim.json files, as in generate_masks.iter_scenario_packets.
+
+        Returns
+        -------
+        path : str
+            Path to the written index.
+    """
+    path = index_path(sub_folder_path) if path is None else path
+    feature_size, packet_size, _ = (int(ele) for ele in parse_params_from_path(sub_folder_path))
+    n_packets = -(-feature_size//packet_size)
+    mask_bytes = -(-n_packets//8)
+
+    scenarios, stamps, cavs = [], {}, {}
+    egos, peers = [], []
+    bits_path = path + ".bits.tmp"
+    with DatasetIndex(sub_folder_path) as index, open(bits_path, "wb") as bits_fp:
+        for scenario_folder_name in sorted(index.scenarios()):
+            filepath = index.derived_path(scenario_folder_name, COMM_SIM_FILENAME)
+            if filepath is None:
+                continue
+            scenarios.append(scenario_folder_name)
+            for time_stamp, packets in iter_scenario_packets(filepath, backend):
+                stamp_id = stamps.setdefault(time_stamp, len(stamps))
+                for cav in sorted(packets):
+                    duration, received_packet_num = packets[cav]
+                    egos.append((len(scenarios) - 1, stamp_id, cavs.setdefault(cav, len(cavs)), len(received_packet_num),
+                                 len(peers), np.nan if duration is None else duration))
+                    for peer_num in sorted(received_packet_num):
+                        peers.append(cavs.setdefault(peer_num, len(cavs)))
+                        bits_fp.write(PacketMask(received_packet_num[peer_num], feature_size, packet_size).to_packbits().tobytes())
+
+    egos = np.array(egos, dtype=EGO_DTYPE)
+    egos = egos[np.argsort(_ego_keys(egos["scenario"], egos["stamp"], egos["ego"]), kind="stable")]
+    peers = np.array(peers, dtype="<u4")
+    header = {"feature_size": feature_size, "packet_size": packet_size, "n_packets": n_packets, "mask_bytes": mask_bytes,
+              "scenarios": scenarios, "stamps": list(stamps), "cavs": list(cavs), "n_egos": len(egos), "n_records": len(peers)}
+    header_bytes = json.dumps(header).encode()
+    egos_offset = _align(len(MAGIC) + 8 + len(header_bytes))
+    peers_offset = _align(egos_offset + egos.nbytes)
+    bits_offset = _align(peers_offset + peers.nbytes)
+
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as fp:
+        fp.write(MAGIC + struct.pack("<Q", len(header_bytes)) + header_bytes)
+        for offset, table in ((egos_offset, egos), (peers_offset, peers)):
+            fp.write(b"\0"*(offset - fp.tell()))
+            fp.write(table.tobytes())
+        fp.write(b"\0"*(bits_offset - fp.tell()))
+        with open(bits_path, "rb") as bits_fp:
+            shutil.copyfileobj(bits_fp, fp)
+    os.remove(bits_path)
+    os.replace(tmp_path, path)
+    return path
+
+
+class MaskIndex():
+    """
+    Read the masks of a file written by compile_mask_index through a read-only memory map.
+
+    Nothing but the header is parsed: the masks are views of the mapped bitsets, so DataLoader workers
+    that open the same index, or that inherit it by fork, share its pages through the page cache.
+    A MaskIndex is pickled as its path, and opens the file again in the process that unpickles it.
+
+    Parameters
+        ----------
+        path : str
+            Path to the index file, or to the config folder holding it.
+    """
+    def __init__(self, path) -> None:
+        if os.path.isdir(path):
+            path = index_path(path)
+        self.path = path
+        self._open()
+
+    def _open(self):
+        self._buffer = np.memmap(self.path, dtype=np.uint8, mode="r")
+        if bytes(self._buffer[:len(MAGIC)]) != MAGIC:
+            raise ValueError(f"{self.path} is not a mask index.")
+        header_length, = struct.unpack("<Q", bytes(self._buffer[len(MAGIC):len(MAGIC) + 8]))
+        header_end = len(MAGIC) + 8 + header_length
+        header = json.loads(bytes(self._buffer[len(MAGIC) + 8:header_end]))
+        self.feature_size = header["feature_size"]
+        self.packet_size = header["packet_size"]
+        self.n_packets = header["n_packets"]
+        self.mask_bytes = header["mask_bytes"]
+        self._scenarios = {name: i for i, name in enumerate(header["scenarios"])}
+        self._stamps = {name: i for i, name in enumerate(header["stamps"])}
+        self._cavs = {name: i for i, name in enumerate(header["cavs"])}
+        self._cav_names = header["cavs"]
+
+        egos_offset = _align(header_end)
+        peers_offset = _align(egos_offset + header["n_egos"]*EGO_DTYPE.itemsize)
+        bits_offset = _align(peers_offset + header["n_records"]*4)
+        self.egos = np.ndarray((header["n_egos"],), dtype=EGO_DTYPE, buffer=self._buffer, offset=egos_offset)
+        self.peers = np.ndarray((header["n_records"],), dtype="<u4", buffer=self._buffer, offset=peers_offset)
+        self.bits = np.ndarray((header["n_records"], self.mask_bytes), dtype=np.uint8, buffer=self._buffer, offset=bits_offset)
+        self._keys = None # The sorted keys of the egos, searched by _row
+
+    def __getstate__(self):
+        return {"path": self.path}
+
+    def __setstate__(self, state):
+        self.path = state["path"]
+        self._open()
+
+    def __len__(self):
+        return len(self.egos)
+
+    def scenarios(self):
+        """Return the names of the indexed scenarios."""
+        return list(self._scenarios)
+
+    def _row(self, scenario, time_stamp, ego):
+        if self._keys is None:
+            self._keys = _ego_keys(self.egos["scenario"], self.egos["stamp"], self.egos["ego"])
+        try:
+            key = _ego_keys(self._scenarios[scenario], self._stamps[str(time_stamp)], self._cavs[str(ego)])
+        except KeyError:
+            raise KeyError((scenario, time_stamp, ego)) from None
+        row = int(np.searchsorted(self._keys, key))
+        if row == len(self._keys) or self._keys[row] != key:
+            raise KeyError((scenario, time_stamp, ego))
+        return row
+
+    def duration(self, scenario, time_stamp, ego):
+        """Return the duration of an ego at a time stamp, or None if it sent and received nothing."""
+        duration = float(self.egos[self._row(scenario, time_stamp, ego)]["duration"])
+        return None if np.isnan(duration) else duration
+
+    def packbits(self, scenario, time_stamp, ego):
+        """
+        Return the received packet bitsets of the peers of an ego at a time stamp.
+
+        Returns
+        -------
+        bits : dict
+            A dictionary with peer CAV numbers as keys and read-only uint8 views of the mapped bitsets as values.
+        """
+        ego_row = self.egos[self._row(scenario, time_stamp, ego)]
+        first, n_peers = int(ego_row["first"]), int(ego_row["n_peers"])
+        return {self._cav_names[peer]: self.bits[first + i] for i, peer in enumerate(self.peers[first:first + n_peers])}
+
+    def get(self, scenario, time_stamp, ego, dtype = None):
+        """
+        Return the masks of an ego at a time stamp, as generate_mask does.
+
+        Parameters
+            ----------
+            scenario : str
+                The name of the scenario folder.
+            time_stamp : str
+                The time stamp.
+            ego : str
+                The ego CAV number.
+            dtype : numpy dtype
+                The dtype of dense masks. If None, the masks are PacketMask objects.
+
+            Returns
+            -------
+            ego_masks : EgoMasks
+                The duration and the masks of the peers.
+        """
+        masks = {}
+        for peer_num, bits in self.packbits(scenario, time_stamp, ego).items():
+            if dtype is None:
+                masks[peer_num] = PacketMask.from_packbits(bits, self.feature_size, self.packet_size)
+            else:
+                received = np.unpackbits(bits, count=self.n_packets).astype(dtype, copy=False)
+                masks[peer_num] = np.repeat(received, self.packet_size)[:self.feature_size]
+        return EgoMasks(self.duration(scenario, time_stamp, ego), masks)
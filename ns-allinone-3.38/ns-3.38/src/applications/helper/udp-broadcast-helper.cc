@@ -22,10 +22,269 @@
 #include "ns3/udp-broadcast-application.h"
 #include "ns3/inet-socket-address.h"
 #include "ns3/names.h"
+#include "ns3/net-device.h"
+#include "ns3/node.h"
+#include "ns3/pointer.h"
+#include "ns3/simulator.h"
+#include "ns3/traffic-control-layer.h"
 
 namespace ns3
 {
 
+UdpBroadcastAutoStop::UdpBroadcastAutoStop(Time drainTime)
+    : m_nTxOnAir(0),
+      m_drainTime(drainTime),
+      m_lastEvent(Seconds(0)),
+      m_stopTime(Seconds(0)),
+      m_stopped(false)
+{
+}
+
+void
+UdpBroadcastAutoStop::Watch(Ptr<UdpBroadCastApplication> app)
+{
+    // The callbacks keep this object alive as long as the applications, which must not be kept in turn.
+    Ptr<UdpBroadcastAutoStop> self(this);
+    m_apps.push_back(PeekPointer(app));
+    app->TraceConnectWithoutContext("Tx", MakeCallback(&UdpBroadcastAutoStop::NotifyTx, self));
+    app->TraceConnectWithoutContext("Rx", MakeCallback(&UdpBroadcastAutoStop::NotifyRx, self));
+    app->TraceConnectWithoutContext("Finished", MakeCallback(&UdpBroadcastAutoStop::NotifyFinished, self));
+    Ptr<Node> node = app->GetNode();
+    if (!m_nodes.insert(node->GetId()).second)
+    {
+        return;
+    }
+    for (uint32_t i = 0; i < node->GetNDevices(); i++)
+    {
+        WatchDevice(node, node->GetDevice(i));
+    }
+}
+
+void
+UdpBroadcastAutoStop::WatchDevice(Ptr<Node> node, Ptr<NetDevice> device)
+{
+    Ptr<TrafficControlLayer> tc = node->GetObject<TrafficControlLayer>();
+    if (tc && tc->GetRootQueueDiscOnDevice(device))
+    {
+        m_queueDiscs.push_back(tc->GetRootQueueDiscOnDevice(device));
+    }
+    PointerValue pointer;
+    if (device->GetAttributeFailSafe("TxQueue", pointer) && pointer.Get<QueueBase>())
+    {
+        m_queues.push_back(pointer.Get<QueueBase>());
+    }
+    // A WifiNetDevice, whose frames wait in the queues of the Txops of its MAC.
+    if (device->GetAttributeFailSafe("Mac", pointer) && pointer.Get<Object>())
+    {
+        Ptr<Object> mac = pointer.Get<Object>();
+        for (const char* txop : {"Txop", "VO_Txop", "VI_Txop", "BE_Txop", "BK_Txop"})
+        {
+            PointerValue queue;
+            if (mac->GetAttributeFailSafe(txop, pointer) && pointer.Get<Object>() &&
+                pointer.Get<Object>()->GetAttributeFailSafe("Queue", queue) && queue.Get<QueueBase>())
+            {
+                m_queues.push_back(queue.Get<QueueBase>());
+            }
+        }
+    }
+    if (device->GetAttributeFailSafe("Phy", pointer) && pointer.Get<Object>())
+    {
+        Ptr<UdpBroadcastAutoStop> self(this);
+        Ptr<Object> phy = pointer.Get<Object>();
+        phy->TraceConnectWithoutContext("PhyTxBegin",
+                                        MakeCallback(&UdpBroadcastAutoStop::NotifyPhyTxBegin, self));
+        phy->TraceConnectWithoutContext("PhyTxEnd",
+                                        MakeCallback(&UdpBroadcastAutoStop::NotifyPhyTxEnd, self));
+    }
+}
+
+bool
+UdpBroadcastAutoStop::IsStopped() const
+{
+    return m_stopped;
+}
+
+Time
+UdpBroadcastAutoStop::GetStopTime() const
+{
+    return m_stopTime;
+}
+
+void
+UdpBroadcastAutoStop::Reset(Time timeout)
+{
+    Simulator::Cancel(m_checkEvent);
+    Simulator::Cancel(m_timeoutEvent);
+    m_lastEvent = Simulator::Now();
+    m_stopped = false;
+    m_timeoutEvent = Simulator::Schedule(timeout, &UdpBroadcastAutoStop::Timeout, this);
+}
+
+void
+UdpBroadcastAutoStop::NotifyTx(Ptr<const Packet> packet)
+{
+    m_lastEvent = Simulator::Now();
+}
+
+void
+UdpBroadcastAutoStop::NotifyRx(Ptr<const Packet> packet, const Address& from)
+{
+    m_lastEvent = Simulator::Now();
+}
+
+void
+UdpBroadcastAutoStop::NotifyFinished()
+{
+    m_lastEvent = Simulator::Now();
+    if (AllFinished() && !m_checkEvent.IsRunning())
+    {
+        m_checkEvent = Simulator::Schedule(m_drainTime, &UdpBroadcastAutoStop::Check, this);
+    }
+}
+
+void
+UdpBroadcastAutoStop::NotifyPhyTxBegin(Ptr<const Packet> packet, double txPowerW)
+{
+    m_lastEvent = Simulator::Now();
+    m_nTxOnAir++;
+}
+
+void
+UdpBroadcastAutoStop::NotifyPhyTxEnd(Ptr<const Packet> packet)
+{
+    m_lastEvent = Simulator::Now();
+    if (m_nTxOnAir > 0)
+    {
+        m_nTxOnAir--;
+    }
+}
+
+bool
+UdpBroadcastAutoStop::AllFinished() const
+{
+    for (const UdpBroadCastApplication* app : m_apps)
+    {
+        if (!app->IsFinished())
+        {
+            return false;
+        }
+    }
+    return true;
+}
+
+bool
+UdpBroadcastAutoStop::HasFramesInFlight() const
+{
+    if (m_nTxOnAir > 0)
+    {
+        return true;
+    }
+    for (const auto& queueDisc : m_queueDiscs)
+    {
+        if (queueDisc->GetNPackets() > 0)
+        {
+            return true;
+        }
+    }
+    for (const auto& queue : m_queues)
+    {
+        if (!queue->IsEmpty())
+        {
+            return true;
+        }
+    }
+    return false;
+}
+
+void
+UdpBroadcastAutoStop::Check()
+{
+    Time quiet = Simulator::Now() - m_lastEvent;
+    if (quiet >= m_drainTime && HasFramesInFlight())
+    {
+        // The frames in flight end with a PHY or application event, so wait for a quiet drain time again.
+        m_checkEvent = Simulator::Schedule(m_drainTime, &UdpBroadcastAutoStop::Check, this);
+    }
+    else if (quiet >= m_drainTime)
+    {
+        m_stopped = true;
+        m_stopTime = Simulator::Now();
+        Simulator::Cancel(m_timeoutEvent);
+        Simulator::Stop();
+    }
+    else
+    {
+        m_checkEvent = Simulator::Schedule(m_drainTime - quiet, &UdpBroadcastAutoStop::Check, this);
+    }
+}
+
+void
+UdpBroadcastAutoStop::Timeout()
+{
+    Simulator::Cancel(m_checkEvent);
+    m_stopTime = Simulator::Now();
+    Simulator::Stop();
+}
+
+static_assert(sizeof(UdpBroadcastEventSink::Record) == 32, "The event records must stay 32 bytes long");
+
+UdpBroadcastEventSink::UdpBroadcastEventSink(std::string filename, uint32_t runId)
+    : m_file(filename, std::ios::binary | std::ios::app),
+      m_runId(runId),
+      m_nRecords(0)
+{
+    NS_ABORT_MSG_IF(!m_file.is_open(), "Can't open the event file " << filename);
+}
+
+UdpBroadcastEventSink::~UdpBroadcastEventSink()
+{
+    Close();
+}
+
+uint64_t
+UdpBroadcastEventSink::GetNRecords() const
+{
+    return m_nRecords;
+}
+
+void
+UdpBroadcastEventSink::SetRunId(uint32_t runId)
+{
+    m_runId = runId;
+}
+
+void
+UdpBroadcastEventSink::Close()
+{
+    if (m_file.is_open())
+    {
+        m_file.close();
+    }
+}
+
+void
+UdpBroadcastEventSink::NotifyEvent(uint8_t type, int64_t timeNs, uint32_t src, uint32_t dst, uint32_t seq)
+{
+    NotifyRunEvent(m_runId, type, timeNs, src, dst, seq);
+}
+
+void
+UdpBroadcastEventSink::NotifyRunEvent(uint32_t runId,
+                                      uint8_t type,
+                                      int64_t timeNs,
+                                      uint32_t src,
+                                      uint32_t dst,
+                                      uint32_t seq)
+{
+    if (!m_file.is_open())
+    {
+        return;
+    }
+    Record record{timeNs, runId, src, dst, seq, type, {0}};
+    m_file.write(reinterpret_cast<const char*>(&record), sizeof(record));
+    m_nRecords++;
+}
+
 UdpBroadcastHelper::UdpBroadcastHelper(Address remote)
 {
     m_factory.SetTypeId("ns3::UdpBroadCastApplication");
@@ -113,6 +372,75 @@ ApplicationContainer UdpBroadcastHelper::Install(std::string nodeName) const
     return apps;
 }
 
+Ptr<UdpBroadcastAutoStop>
+UdpBroadcastHelper::EnableAutoStop(ApplicationContainer apps, Time drainTime) const
+{
+    Ptr<UdpBroadcastAutoStop> autoStop = Create<UdpBroadcastAutoStop>(drainTime);
+    for (ApplicationContainer::Iterator i = apps.Begin(); i != apps.End(); ++i)
+    {
+        Ptr<UdpBroadCastApplication> app = DynamicCast<UdpBroadCastApplication>(*i);
+        NS_ABORT_MSG_IF(!app, "EnableAutoStop only watches UdpBroadCastApplications");
+        autoStop->Watch(app);
+    }
+    return autoStop;
+}
+
+Ptr<UdpBroadcastEventSink>
+UdpBroadcastHelper::EnableEventSink(ApplicationContainer apps, std::string filename, uint32_t runId) const
+{
+    Ptr<UdpBroadcastEventSink> sink = Create<UdpBroadcastEventSink>(filename, runId);
+    for (ApplicationContainer::Iterator i = apps.Begin(); i != apps.End(); ++i)
+    {
+        (*i)->TraceConnectWithoutContext("Event", MakeCallback(&UdpBroadcastEventSink::NotifyEvent, sink));
+    }
+    return sink;
+}
+
+/// Forward an Event of the applications of a run to the sink they share.
+static void
+NotifySinkOfRun(Ptr<UdpBroadcastEventSink> sink,
+                uint32_t runId,
+                uint8_t type,
+                int64_t timeNs,
+                uint32_t src,
+                uint32_t dst,
+                uint32_t seq)
+{
+    sink->NotifyRunEvent(runId, type, timeNs, src, dst, seq);
+}
+
+void
+UdpBroadcastHelper::EnableEventSink(ApplicationContainer apps,
+                                    Ptr<UdpBroadcastEventSink> sink,
+                                    uint32_t runId) const
+{
+    for (ApplicationContainer::Iterator i = apps.Begin(); i != apps.End(); ++i)
+    {
+        (*i)->TraceConnectWithoutContext("Event", MakeBoundCallback(&NotifySinkOfRun, sink, runId));
+    }
+}
+
+int64_t
+UdpBroadcastHelper::AssignStreams(NodeContainer c, int64_t stream)
+{
+    int64_t currentStream = stream;
+    Ptr<Node> node;
+    for (NodeContainer::Iterator i = c.Begin(); i != c.End(); ++i)
+    {
+        node = (*i);
+        for (uint32_t j = 0; j < node->GetNApplications(); j++)
+        {
+            Ptr<UdpBroadCastApplication> app =
+                DynamicCast<UdpBroadCastApplication>(node->GetApplication(j));
+            if (app)
+            {
+                currentStream += app->AssignStreams(currentStream);
+            }
+        }
+    }
+    return (currentStream - stream);
+}
+
 
 
 
@@ -20,13 +20,172 @@
 #define UDP_BROADCAST_HELPER_H
 
 #include "ns3/application-container.h"
+#include "ns3/event-id.h"
 #include "ns3/ipv4-address.h"
 #include "ns3/node-container.h"
+#include "ns3/nstime.h"
 #include "ns3/object-factory.h"
+#include "ns3/queue-disc.h"
+#include "ns3/queue.h"
+#include "ns3/simple-ref-count.h"
+#include "ns3/udp-broadcast-application.h"
+
+#include <fstream>
+#include <set>
+#include <vector>
 
 namespace ns3
 {
 
+class Packet;
+
+/**
+ * Stop the simulator once every UdpBroadCastApplication it watches has sent all its attempts,
+ * no frame is in flight, and nothing was sent or received for the drain time.
+ *
+ * A frame is in flight while it waits in the root queue disc or the transmit queue of a device
+ * of a watched node (the TxQueue of the device, or the Txop queues of a wifi MAC) or while a
+ * watched wifi PHY transmits it. The queues and the PHY are found through their attributes and trace sources,
+ * so any device works. Receptions end a propagation delay after the transmissions, which the
+ * drain time must exceed, so the results are the same as running until the scheduled stop time.
+ * Other devices do not report the frame they are transmitting, e.g., a SimpleNetDevice holds it
+ * out of its queue for its transmission time, which the drain time must then exceed as well.
+ */
+class UdpBroadcastAutoStop : public SimpleRefCount<UdpBroadcastAutoStop>
+{
+  public:
+    /**
+     * \param drainTime the time without any Tx or Rx event after which the simulator is stopped
+     */
+    UdpBroadcastAutoStop(Time drainTime);
+
+    /**
+     * \brief Watch an application, and the queues and PHYs of the devices of its node.
+     * \param app the application to watch
+     */
+    void Watch(Ptr<UdpBroadCastApplication> app);
+
+    /**
+     * \return true if the simulator was stopped by this object
+     */
+    bool IsStopped() const;
+
+    /**
+     * \return the simulation time at which the simulator was stopped
+     */
+    Time GetStopTime() const;
+
+    /**
+     * \brief Watch a new round of the applications, e.g., after UdpBroadCastApplication::Restart.
+     *
+     * A pending stop of a previous round is cancelled, so the simulator can be run again.
+     *
+     * \param timeout the time from now after which the simulator is stopped even if the
+     * applications are not done, without setting IsStopped
+     */
+    void Reset(Time timeout);
+
+    /// Notify that a watched application sent a packet.
+    void NotifyTx(Ptr<const Packet> packet);
+    /// Notify that a watched application received a packet.
+    void NotifyRx(Ptr<const Packet> packet, const Address& from);
+    /// Notify that a watched application made all its attempts.
+    void NotifyFinished();
+    /// Notify that a watched wifi PHY started to transmit a frame.
+    void NotifyPhyTxBegin(Ptr<const Packet> packet, double txPowerW);
+    /// Notify that a watched wifi PHY transmitted a frame.
+    void NotifyPhyTxEnd(Ptr<const Packet> packet);
+
+  private:
+    /// \return true if all the watched applications made their attempts
+    bool AllFinished() const;
+    /// \return true if a frame waits in a watched queue or is transmitted by a watched PHY
+    bool HasFramesInFlight() const;
+    /**
+     * \brief Watch the queue disc, the transmit queues and the wifi PHY of a device, whichever it has.
+     * \param node the node of the device
+     * \param device the device
+     */
+    void WatchDevice(Ptr<Node> node, Ptr<NetDevice> device);
+    /// Stop the simulator if the drain time passed since the last event and no frame is in
+    /// flight, otherwise check again later.
+    void Check();
+    /// Stop the simulator at the timeout of the round.
+    void Timeout();
+
+    std::vector<UdpBroadCastApplication*> m_apps; //!< Applications watched, which keep this object
+    std::vector<Ptr<QueueBase>> m_queues;          //!< Transmit queues of the watched nodes
+    std::vector<Ptr<QueueDisc>> m_queueDiscs;      //!< Root queue discs of the watched nodes
+    std::set<uint32_t> m_nodes;                    //!< Ids of the watched nodes
+    uint32_t m_nTxOnAir;    //!< Number of frames being transmitted by the watched PHYs
+    Time m_drainTime;       //!< Time without Tx or Rx events before stopping
+    Time m_lastEvent;       //!< Time of the last Tx or Rx event
+    Time m_stopTime;        //!< Time at which the simulator was stopped
+    bool m_stopped;         //!< True once the simulator was stopped
+    EventId m_checkEvent;   //!< Pending check
+    EventId m_timeoutEvent; //!< Pending timeout of the round
+};
+
+/**
+ * Append the Event records of UdpBroadCastApplications to a binary file while the simulation runs.
+ *
+ * Each event is written as one fixed-size Record, so memory does not grow with the number
+ * of events and the file can be read back as an array (e.g., with numpy.memmap).
+ */
+class UdpBroadcastEventSink : public SimpleRefCount<UdpBroadcastEventSink>
+{
+  public:
+    /// The record of one event, as written to the file in the host byte order.
+    struct Record
+    {
+        int64_t timeNs;      //!< Simulation time in nanoseconds
+        uint32_t runId;      //!< Id of the run that produced the event
+        uint32_t src;        //!< Id of the sending node
+        uint32_t dst;        //!< Id of the receiving node, or UdpBroadcastEventLog::BROADCAST
+        uint32_t seq;        //!< Attempt number
+        uint8_t type;        //!< UdpBroadcastEventLog::EventType
+        uint8_t reserved[7]; //!< Padding, set to zero
+    };
+
+    /**
+     * \param filename the file the records are appended to
+     * \param runId the id written in every record, to tell runs sharing a file apart
+     */
+    UdpBroadcastEventSink(std::string filename, uint32_t runId);
+    ~UdpBroadcastEventSink();
+
+    /**
+     * \return the number of records written by this sink
+     */
+    uint64_t GetNRecords() const;
+
+    /**
+     * \param runId the id written in the records of the next events
+     */
+    void SetRunId(uint32_t runId);
+
+    /**
+     * \brief Flush and close the file. Later events are dropped.
+     */
+    void Close();
+
+    /// Append the record of a sent or received packet.
+    void NotifyEvent(uint8_t type, int64_t timeNs, uint32_t src, uint32_t dst, uint32_t seq);
+
+    /// Append the record of a sent or received packet with the given run id.
+    void NotifyRunEvent(uint32_t runId,
+                        uint8_t type,
+                        int64_t timeNs,
+                        uint32_t src,
+                        uint32_t dst,
+                        uint32_t seq);
+
+  private:
+    std::ofstream m_file; //!< Output file
+    uint32_t m_runId;     //!< Run id written in the records
+    uint64_t m_nRecords;  //!< Number of records written
+};
+
 class UdpBroadcastHelper
 {
   public:
@@ -91,6 +250,55 @@ class UdpBroadcastHelper
      */
     ApplicationContainer Install(std::string nodeName) const;
 
+    /**
+     * Stop the simulator once all the given applications made their attempts, no frame is
+     * queued or transmitted by the devices of their nodes, and no packet was sent or received
+     * for the drain time.
+     *
+     * \param apps the UdpBroadCastApplications to watch
+     * \param drainTime the time without any Tx or Rx event after which the simulator is stopped
+     * \returns the object that stops the simulator, to query when it stopped.
+     */
+    Ptr<UdpBroadcastAutoStop> EnableAutoStop(ApplicationContainer apps, Time drainTime) const;
+
+    /**
+     * Append the sent and received packets of the given applications to a binary file
+     * as they happen. The applications still keep their own records unless their
+     * LogResultStrings and KeepEvents attributes are set to false.
+     *
+     * \param apps the UdpBroadCastApplications to record
+     * \param filename the file the records are appended to
+     * \param runId the id written in every record
+     * \returns the sink, to close once the simulation ran.
+     */
+    Ptr<UdpBroadcastEventSink> EnableEventSink(ApplicationContainer apps,
+                                               std::string filename,
+                                               uint32_t runId) const;
+
+    /**
+     * Append the sent and received packets of the given applications to an existing sink,
+     * with their own run id. Several sets of applications, e.g., independent copies of a
+     * scenario simulated side by side, can share one sink this way.
+     *
+     * \param apps the UdpBroadCastApplications to record
+     * \param sink the sink returned by another call to EnableEventSink
+     * \param runId the id written in the records of these applications
+     */
+    void EnableEventSink(ApplicationContainer apps,
+                         Ptr<UdpBroadcastEventSink> sink,
+                         uint32_t runId) const;
+
+    /**
+     * Assign a fixed random variable stream number to the random variables used by the
+     * UdpBroadCastApplications installed on the given nodes.
+     *
+     * \param c NodeContainer of the set of nodes for which the UdpBroadCastApplications
+     * should be modified to use a fixed stream
+     * \param stream first stream index to use
+     * \return the number of stream indices assigned by this helper
+     */
+    int64_t AssignStreams(NodeContainer c, int64_t stream);
+
   private:
     ObjectFactory m_factory; //!< Object factory.
     std::vector<std::string> buffers; //!<Vector of buffers for each application
@@ -22,6 +22,9 @@
 // Adapted from ApplicationOnOff in GTNetS.
 
 #include "udp-broadcast-application.h"
+
+#include "udp-broadcast-header.h"
+
 #include "ns3/uinteger.h"
 #include "ns3/address.h"
 #include "ns3/boolean.h"
@@ -44,6 +47,8 @@
 #include "ns3/uinteger.h"
 #include "ns3/double.h"
 
+#include <algorithm>
+
 namespace ns3
 {
 
@@ -87,6 +92,30 @@ UdpBroadCastApplication::GetTypeId()
                           BooleanValue(false),
                           MakeBooleanAccessor(&UdpBroadCastApplication::m_enableSeqTsSizeHeader),
                           MakeBooleanChecker())
+            .AddAttribute("EnableBroadcastHeader",
+                          "Send a UdpBroadcastHeader (sender node id, attempt number and tx time) "
+                          "in front of a zero-filled payload instead of the Buffer content. The "
+                          "packets keep the size of the Buffer plus one byte.",
+                          BooleanValue(false),
+                          MakeBooleanAccessor(&UdpBroadCastApplication::m_enableBroadcastHeader),
+                          MakeBooleanChecker())
+            .AddAttribute("LogResultStrings",
+                          "Keep the text records returned by GetResult.",
+                          BooleanValue(true),
+                          MakeBooleanAccessor(&UdpBroadCastApplication::m_logResultStrings),
+                          MakeBooleanChecker())
+            .AddAttribute("KeepEvents",
+                          "Keep the typed records returned by GetEvents. The Event trace source "
+                          "is fired either way.",
+                          BooleanValue(true),
+                          MakeBooleanAccessor(&UdpBroadCastApplication::m_keepEvents),
+                          MakeBooleanChecker())
+            .AddAttribute("TimeOffset",
+                          "The time subtracted from the simulation time of the records and of "
+                          "the Event trace source.",
+                          TimeValue(Seconds(0)),
+                          MakeTimeAccessor(&UdpBroadCastApplication::m_timeOffset),
+                          MakeTimeChecker())
             .AddTraceSource("Tx",
                             "A new packet is created and is sent",
                             MakeTraceSourceAccessor(&UdpBroadCastApplication::m_txTrace),
@@ -99,6 +128,22 @@ UdpBroadCastApplication::GetTypeId()
                             "A new packet is created with SeqTsSizeHeader",
                             MakeTraceSourceAccessor(&UdpBroadCastApplication::m_txTraceWithSeqTsSize),
                             "ns3::PacketSink::SeqTsSizeCallback")
+            .AddTraceSource("Rx",
+                            "A packet has been received",
+                            MakeTraceSourceAccessor(&UdpBroadCastApplication::m_rxTrace),
+                            "ns3::Packet::AddressTracedCallback")
+            .AddTraceSource("RxWithBroadcastHeader",
+                            "A packet with a UdpBroadcastHeader has been received",
+                            MakeTraceSourceAccessor(&UdpBroadCastApplication::m_rxTraceWithHeader),
+                            "ns3::UdpBroadCastApplication::RxWithHeaderCallback")
+            .AddTraceSource("Event",
+                            "A packet has been sent or received, as a typed record of the event log",
+                            MakeTraceSourceAccessor(&UdpBroadCastApplication::m_eventTrace),
+                            "ns3::UdpBroadCastApplication::EventCallback")
+            .AddTraceSource("Finished",
+                            "All attempts of sending packets have been made",
+                            MakeTraceSourceAccessor(&UdpBroadCastApplication::m_finishedTrace),
+                            "ns3::UdpBroadCastApplication::FinishedCallback")
             .AddAttribute("OffTime",
                           "A RandomVariableStream used to pick the duration of the 'Off' state.",
                           StringValue("ns3::UniformRandomVariable[Min=0.0|Max=0.1]"),
@@ -263,6 +308,26 @@ UdpBroadCastApplication::StopApplication() // Called at time specified by Stop
     }
 }
 
+void
+UdpBroadCastApplication::Restart(Time delay)
+{
+    NS_LOG_FUNCTION(this << delay);
+
+    CancelEvents();
+    m_result.Clear();
+    m_events.Clear();
+    m_current_attempts = 0;
+    m_startStopEvent = Simulator::Schedule(delay, &UdpBroadCastApplication::StartApplication, this);
+}
+
+int64_t
+UdpBroadCastApplication::AssignStreams(int64_t stream)
+{
+    NS_LOG_FUNCTION(this << stream);
+    m_startTime->SetStream(stream);
+    return 1;
+}
+
 void
 UdpBroadCastApplication::CancelEvents()
 {
@@ -318,9 +383,19 @@ UdpBroadCastApplication::SendPacket()
     NS_LOG_FUNCTION(this);
 
     NS_ASSERT(m_sendEvent.IsExpired());
-    if(!m_buffer.empty()){
+    if(m_enableBroadcastHeader || !m_buffer.empty()){
         Ptr<Packet> packet;
-        if (m_enableSeqTsSizeHeader)
+        if (m_enableBroadcastHeader)
+        {
+            UdpBroadcastHeader header;
+            header.SetNodeId(GetNode()->GetId());
+            header.SetSeq(m_current_attempts);
+            NS_ABORT_MSG_IF(m_buffer.size()+1 < header.GetSerializedSize(),
+                            "The packets are too small for the UdpBroadcastHeader");
+            packet = Create<Packet>(m_buffer.size()+1 - header.GetSerializedSize());
+            packet->AddHeader(header);
+        }
+        else if (m_enableSeqTsSizeHeader)
         {
             Address from;
             Address to;
@@ -351,11 +426,15 @@ UdpBroadCastApplication::SendPacket()
         if ((uint32_t)actual == m_buffer.size()+1)
         {
             
-            std::stringstream ss;
-            ss << Simulator::Now().As(Time::S);
-            std::string time_stamp = ss.str();
-            std::string data_string = time_stamp + " packet " + std::to_string(m_current_attempts) + " sent.";
-            UpdateResult(GetNode()->GetId(), data_string);
+            LogEvent(UdpBroadcastEventLog::SENT, GetNode()->GetId(), UdpBroadcastEventLog::BROADCAST, m_current_attempts);
+            if (m_logResultStrings)
+            {
+                std::stringstream ss;
+                ss << (Simulator::Now() - m_timeOffset).As(Time::S);
+                std::string time_stamp = ss.str();
+                std::string data_string = time_stamp + " packet " + std::to_string(m_current_attempts) + " sent.";
+                UpdateResult(GetNode()->GetId(), data_string);
+            }
             m_current_attempts += 1;
             m_txTrace(packet);
             m_totBytes += m_buffer.size()+1;
@@ -384,6 +463,10 @@ UdpBroadCastApplication::SendPacket()
             {
                 ScheduleNextTx();
             }
+            else
+            {
+                m_finishedTrace();
+            }
         }
         else
         {
@@ -416,35 +499,99 @@ UdpBroadCastApplication::ConnectionFailed(Ptr<Socket> socket)
 void UdpBroadCastApplication::DefaultOnReceived(Ptr<Socket> receivedData){
         // uint32_t size = 0;
         Ptr<Packet> packet;
-        while((packet = receivedData->Recv())){
+        Address from;
+        while((packet = receivedData->RecvFrom(from))){
             
             if(packet->GetSize () == 0){
                 break;
             }
-            uint32_t packet_size = packet->GetSize();
-            uint8_t* byte_buffer = (uint8_t *)calloc(packet_size, sizeof(uint8_t));
-            uint32_t copied_size = packet->CopyData(byte_buffer, packet_size);
-            std::string data_string(byte_buffer, byte_buffer+copied_size);
-            std::stringstream ss;
-            ss << Simulator::Now().As(Time::S);
-            std::string time_stamp = ss.str();
-            UpdateResult(GetNode()->GetId(), time_stamp + " received " + data_string);
+            m_rxTrace(packet, from);
+            uint32_t sender = 0;
+            uint32_t attempt = 0;
+            if (m_enableBroadcastHeader)
+            {
+                UdpBroadcastHeader header;
+                packet->PeekHeader(header);
+                m_rxTraceWithHeader(packet, from, header);
+                sender = header.GetNodeId();
+                attempt = header.GetSeq();
+            }
+            else
+            {
+                DecodeSenderAndAttempt(packet, sender, attempt);
+            }
+            LogEvent(UdpBroadcastEventLog::RECEIVED, sender, GetNode()->GetId(), attempt);
+            if (m_logResultStrings)
+            {
+                std::stringstream ss;
+                ss << (Simulator::Now() - m_timeOffset).As(Time::S);
+                std::string time_stamp = ss.str();
+                UpdateResult(GetNode()->GetId(), time_stamp + " received " + std::to_string(sender) +
+                                                     " " + std::to_string(attempt));
+            }
             // std::cout << "UdpBroadCastApplication::DefaultOnReceived:: Node "<<GetNode()->GetId()<<": "<< data_string<< std::endl; 
         }   
 }
+
+/// Parse the decimal digits in [begin, end), stopping at the first other character.
+static uint32_t
+ParseDecimal(const uint8_t* begin, const uint8_t* end)
+{
+    uint32_t value = 0;
+    for (const uint8_t* it = begin; it != end && *it >= '0' && *it <= '9'; ++it)
+    {
+        value = value * 10 + (*it - '0');
+    }
+    return value;
+}
+
 void
-UdpBroadCastApplication::UpdateResult(int id, std::string data){
-  std::map<int, std::vector<std::string>>::iterator it = m_result.find(id);
-  if(it != m_result.end()) {
-    std::vector<std::string>::iterator it_vecotor = std::find(it->second.begin(), it->second.end(), data);
-    if (!(it_vecotor != it->second.end())){
-      
-      it->second.push_back(data);
+UdpBroadCastApplication::DecodeSenderAndAttempt(Ptr<const Packet> packet, uint32_t& sender, uint32_t& attempt) const
+{
+    // The payload is "<sender id> <padding> <attempt number>\0", so only its first and last bytes
+    // are copied out of the packet, whatever its size.
+    const uint32_t maxFieldSize = 24;
+    uint32_t size = packet->GetSize();
+    uint8_t head[maxFieldSize];
+    uint32_t headSize = packet->CopyData(head, std::min(size, maxFieldSize));
+    const uint8_t* senderEnd = std::find(head, head + headSize, ' ');
+
+    uint8_t tail[maxFieldSize];
+    uint32_t tailSize = std::min(size, maxFieldSize);
+    tailSize = packet->CreateFragment(size - tailSize, tailSize)->CopyData(tail, tailSize);
+    while (tailSize > 0 && tail[tailSize - 1] == '\0')
+    {
+        tailSize--;
     }
-  }else{
-    std::vector<std::string> string_container = {data};
-    m_result[id] = string_container;
-  }
+    const uint8_t* attemptBegin = tail + tailSize;
+    while (attemptBegin > tail && *(attemptBegin - 1) != ' ')
+    {
+        attemptBegin--;
+    }
+    sender = ParseDecimal(head, senderEnd);
+    attempt = ParseDecimal(attemptBegin, tail + tailSize);
+}
+
+void
+UdpBroadCastApplication::LogEvent(uint8_t type, uint32_t src, uint32_t dst, uint32_t seq)
+{
+    int64_t timeNs = (Simulator::Now() - m_timeOffset).GetNanoSeconds();
+    if (m_keepEvents)
+    {
+        m_events.Add(type, timeNs, src, dst, seq);
+    }
+    m_eventTrace(type, timeNs, src, dst, seq);
+}
+
+void
+UdpBroadCastApplication::UpdateResult(int id, std::string data){
+  m_result.Add(id, data);
+}
+
+bool
+UdpBroadCastApplication::IsFinished() const
+{
+    return m_current_attempts >= m_total_send;
 }
 
 std::map<int, std::vector<std::string>> 
@@ -456,7 +603,109 @@ UdpBroadCastApplication::GetResult(void)
 //         for (const auto &piece : elem.second) s += ", " + piece;
 //    std::cout << elem.first << " " << s << "\n";
 //     }
-  return std::map<int, std::vector<std::string>>(m_result);
+  return m_result.Get();
+}
+
+const UdpBroadcastEventLog&
+UdpBroadCastApplication::GetEvents() const
+{
+    return m_events;
+}
+
+void
+UdpBroadcastEventLog::Add(uint8_t type, int64_t timeNs, uint32_t src, uint32_t dst, uint32_t seq)
+{
+    m_types.push_back(type);
+    m_times.push_back(timeNs);
+    m_sources.push_back(src);
+    m_destinations.push_back(dst);
+    m_seqs.push_back(seq);
+}
+
+std::size_t
+UdpBroadcastEventLog::GetSize() const
+{
+    return m_types.size();
+}
+
+const std::vector<uint8_t>&
+UdpBroadcastEventLog::GetTypes() const
+{
+    return m_types;
+}
+
+const std::vector<int64_t>&
+UdpBroadcastEventLog::GetTimes() const
+{
+    return m_times;
+}
+
+const std::vector<uint32_t>&
+UdpBroadcastEventLog::GetSources() const
+{
+    return m_sources;
+}
+
+const std::vector<uint32_t>&
+UdpBroadcastEventLog::GetDestinations() const
+{
+    return m_destinations;
+}
+
+const std::vector<uint32_t>&
+UdpBroadcastEventLog::GetSeqs() const
+{
+    return m_seqs;
+}
+
+void
+UdpBroadcastEventLog::Clear()
+{
+    m_types.clear();
+    m_times.clear();
+    m_sources.clear();
+    m_destinations.clear();
+    m_seqs.clear();
+}
+
+bool
+UdpBroadcastResultLog::Add(int id, const std::string& data)
+{
+    std::unordered_set<std::string_view>& seen = m_seen[id];
+    if (seen.count(data))
+    {
+        return false;
+    }
+    std::deque<std::string>& entries = m_entries[id];
+    entries.push_back(data);
+    seen.insert(entries.back());
+    m_size++;
+    return true;
+}
+
+std::size_t
+UdpBroadcastResultLog::GetSize() const
+{
+    return m_size;
+}
+
+std::map<int, std::vector<std::string>>
+UdpBroadcastResultLog::Get() const
+{
+    std::map<int, std::vector<std::string>> entries;
+    for (const auto& node : m_entries)
+    {
+        entries[node.first].assign(node.second.begin(), node.second.end());
+    }
+    return entries;
+}
+
+void
+UdpBroadcastResultLog::Clear()
+{
+    m_seen.clear();
+    m_entries.clear();
+    m_size = 0;
 }
 
 } // Namespace ns3
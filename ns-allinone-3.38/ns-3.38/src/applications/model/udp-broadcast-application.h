@@ -28,10 +28,17 @@
 #include "ns3/application.h"
 #include "ns3/data-rate.h"
 #include "ns3/event-id.h"
+#include "ns3/nstime.h"
 #include "ns3/random-variable-stream.h"
 #include "ns3/ptr.h"
 #include "ns3/seq-ts-size-header.h"
 #include "ns3/traced-callback.h"
+
+#include <deque>
+#include <map>
+#include <string>
+#include <string_view>
+#include <unordered_set>
 #include <vector>
 
 namespace ns3
@@ -40,7 +47,110 @@ namespace ns3
 class Address;
 class RandomVariableStream;
 class Socket;
+class UdpBroadcastHeader;
+
+/**
+ * \brief The deduplicated result strings of a UdpBroadCastApplication, keyed by node id.
+ *
+ * These are the text records returned by GetResult, e.g. "+1.5s packet 3 sent.", which are
+ * only logged while the LogResultStrings attribute is true; the typed records are kept by
+ * UdpBroadcastEventLog.
+ *
+ * Entries are kept in insertion order and duplicates are dropped. Each node id keeps
+ * a hash set of views of its entries next to the ordered list, so an insertion costs
+ * constant time on average instead of a scan over the previous entries, and each entry
+ * is stored once. The entries are kept in a deque, which never moves them, so the views
+ * stay valid.
+ */
+class UdpBroadcastResultLog
+{
+  public:
+    /**
+     * \brief Add an entry unless the node already logged the same one.
+     * \param id the node id
+     * \param data the entry
+     * \return true if the entry was added
+     */
+    bool Add(int id, const std::string& data);
+
+    /**
+     * \return the number of entries of all node ids
+     */
+    std::size_t GetSize() const;
 
+    /**
+     * \return the entries of each node id, in insertion order
+     */
+    std::map<int, std::vector<std::string>> Get() const;
+
+    /**
+     * \brief Remove all entries.
+     */
+    void Clear();
+
+  private:
+    std::map<int, std::deque<std::string>> m_entries;           //!< The entries of each node id, in order
+    std::map<int, std::unordered_set<std::string_view>> m_seen; //!< Views of m_entries, for lookups
+    std::size_t m_size{0};                                      //!< The number of entries
+};
+
+/**
+ * \brief The sent and received packets of a UdpBroadCastApplication, as one array per field.
+ *
+ * The arrays are contiguous, so the Python bindings can copy each of them into a NumPy
+ * array at once instead of converting the records one by one.
+ */
+class UdpBroadcastEventLog
+{
+  public:
+    /// The type of an event.
+    enum EventType : uint8_t
+    {
+        SENT = 0,    //!< The node sent a packet
+        RECEIVED = 1 //!< The node received a packet
+    };
+
+    /// The destination of sent packets.
+    static constexpr uint32_t BROADCAST = 0xffffffff;
+
+    /**
+     * \brief Append an event.
+     * \param type the EventType
+     * \param timeNs the simulation time in nanoseconds
+     * \param src the id of the sending node
+     * \param dst the id of the receiving node, or BROADCAST for sent packets
+     * \param seq the attempt number of the packet
+     */
+    void Add(uint8_t type, int64_t timeNs, uint32_t src, uint32_t dst, uint32_t seq);
+
+    /**
+     * \return the number of events
+     */
+    std::size_t GetSize() const;
+
+    /// \return the EventType of each event
+    const std::vector<uint8_t>& GetTypes() const;
+    /// \return the simulation time in nanoseconds of each event
+    const std::vector<int64_t>& GetTimes() const;
+    /// \return the id of the sending node of each event
+    const std::vector<uint32_t>& GetSources() const;
+    /// \return the id of the receiving node of each event, BROADCAST for sent packets
+    const std::vector<uint32_t>& GetDestinations() const;
+    /// \return the attempt number of each event
+    const std::vector<uint32_t>& GetSeqs() const;
+
+    /**
+     * \brief Remove all events.
+     */
+    void Clear();
+
+  private:
+    std::vector<uint8_t> m_types;         //!< EventType of each event
+    std::vector<int64_t> m_times;         //!< Time in nanoseconds of each event
+    std::vector<uint32_t> m_sources;      //!< Sender of each event
+    std::vector<uint32_t> m_destinations; //!< Receiver of each event
+    std::vector<uint32_t> m_seqs;         //!< Attempt number of each event
+};
 
 class UdpBroadCastApplication : public Application
 {
@@ -67,6 +177,65 @@ class UdpBroadCastApplication : public Application
     
     std::map<int, std::vector<std::string>> GetResult(void);
 
+    /**
+     * \brief Get the typed records of the sent and received packets.
+     * \return the event log, kept until the application is destroyed
+     */
+    const UdpBroadcastEventLog& GetEvents() const;
+
+    /**
+     * \brief Check whether all attempts of sending packets have been made.
+     * \return true if TotalAttempt packets have been sent
+     */
+    bool IsFinished() const;
+
+    /**
+     * \brief Clear the records and start a new round of TotalAttempt transmissions after the delay.
+     *
+     * The socket is kept open, so the nodes, devices and stacks of a finished simulation can be
+     * reused for another round on the same timeline. Use the TimeOffset attribute to report the
+     * times of the new round relative to its own origin.
+     *
+     * \param delay the time from now at which the first transmission of the round is scheduled
+     */
+    void Restart(Time delay);
+
+    /**
+     * \brief Assign a fixed random variable stream number to the random variables
+     * used by this model.
+     *
+     * \param stream first stream index to use
+     * \return the number of stream indices assigned by this model
+     */
+    int64_t AssignStreams(int64_t stream);
+
+    /**
+     * TracedCallback signature for the end of the transmissions.
+     */
+    typedef void (*FinishedCallback)();
+
+    /**
+     * TracedCallback signature for sent and received packets, with the fields of UdpBroadcastEventLog.
+     *
+     * \param [in] type The UdpBroadcastEventLog::EventType.
+     * \param [in] timeNs The simulation time in nanoseconds.
+     * \param [in] src The id of the sending node.
+     * \param [in] dst The id of the receiving node, or UdpBroadcastEventLog::BROADCAST.
+     * \param [in] seq The attempt number.
+     */
+    typedef void (*EventCallback)(uint8_t type, int64_t timeNs, uint32_t src, uint32_t dst, uint32_t seq);
+
+    /**
+     * TracedCallback signature for received packets with a UdpBroadcastHeader.
+     *
+     * \param [in] packet The received packet, header included.
+     * \param [in] from The source address.
+     * \param [in] header The header, with the sender id, attempt number and tx time.
+     */
+    typedef void (*RxWithHeaderCallback)(Ptr<const Packet> packet,
+                                         const Address& from,
+                                         const UdpBroadcastHeader& header);
+
   protected:
     void DoDispose() override;
 
@@ -98,10 +267,15 @@ class UdpBroadCastApplication : public Application
     uint64_t m_current_attempts;          //!< The counter of number of attempts made to send packet
     double m_send_rate;                  //!< The rate of sending packets.
     bool m_enableSeqTsSizeHeader{false}; //!< Enable or disable the use of SeqTsSizeHeader
+    bool m_enableBroadcastHeader{false}; //!< Enable or disable the use of UdpBroadcastHeader
     std::string m_buffer;                //!< The buffer of data to send
     uint16_t m_port;                       //!< The port be using for client and remote to send and listen traffic
     Ptr<RandomVariableStream> m_startTime;  //!< rng for Start Time
-    std::map<int, std::vector<std::string>> m_result;
+    UdpBroadcastResultLog m_result;       //!< The result strings of the sent and received packets
+    UdpBroadcastEventLog m_events;        //!< The sent and received packets, as typed arrays
+    bool m_logResultStrings{true};        //!< Keep the text records of m_result
+    bool m_keepEvents{true};              //!< Keep the typed records of m_events
+    Time m_timeOffset;                    //!< Subtracted from the simulation time of the records
     
     
     /// Traced Callback: transmitted packets.
@@ -115,6 +289,18 @@ class UdpBroadCastApplication : public Application
     TracedCallback<Ptr<const Packet>, const Address&, const Address&, const SeqTsSizeHeader&>
         m_txTraceWithSeqTsSize;
 
+    /// Traced Callback: received packets, source address.
+    TracedCallback<Ptr<const Packet>, const Address&> m_rxTrace;
+
+    /// Traced Callback: received packets with a UdpBroadcastHeader, source address, header.
+    TracedCallback<Ptr<const Packet>, const Address&, const UdpBroadcastHeader&> m_rxTraceWithHeader;
+
+    /// Traced Callback: sent and received packets, as typed records.
+    TracedCallback<uint8_t, int64_t, uint32_t, uint32_t, uint32_t> m_eventTrace;
+
+    /// Traced Callback: all attempts of sending packets have been made.
+    TracedCallback<> m_finishedTrace;
+
   private:
     /**
      * \brief Schedule the next packet transmission
@@ -135,7 +321,24 @@ class UdpBroadCastApplication : public Application
 
     void DefaultOnReceived(Ptr<Socket> receivedData);
 
+    /**
+     * \brief Decode the sender id and the attempt number of a received payload.
+     * \param packet the received packet
+     * \param sender the decoded sender id
+     * \param attempt the decoded attempt number
+     */
+    void DecodeSenderAndAttempt(Ptr<const Packet> packet, uint32_t& sender, uint32_t& attempt) const;
+
     void UpdateResult(int id, std::string data);
+
+    /**
+     * \brief Record a sent or received packet in the event log and the Event trace source.
+     * \param type the UdpBroadcastEventLog::EventType
+     * \param src the id of the sending node
+     * \param dst the id of the receiving node, or UdpBroadcastEventLog::BROADCAST
+     * \param seq the attempt number
+     */
+    void LogEvent(uint8_t type, uint32_t src, uint32_t dst, uint32_t seq);
 };
 
 } // namespace ns3
@@ -0,0 +1,123 @@
+/*
+ * This program is free software; you can redistribute it and/or modify
+ * it under the terms of the GNU General Public License version 2 as
+ * published by the Free Software Foundation;
+ *
+ * This program is distributed in the hope that it will be useful,
+ * but WITHOUT ANY WARRANTY; without even the implied warranty of
+ * MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ * GNU General Public License for more details.
+ *
+ * You should have received a copy of the GNU General Public License
+ * along with this program; if not, write to the Free Software
+ * Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+ */
+
+#include "udp-broadcast-header.h"
+
+#include "ns3/log.h"
+#include "ns3/simulator.h"
+
+namespace ns3
+{
+
+NS_LOG_COMPONENT_DEFINE("UdpBroadcastHeader");
+
+NS_OBJECT_ENSURE_REGISTERED(UdpBroadcastHeader);
+
+UdpBroadcastHeader::UdpBroadcastHeader()
+    : m_nodeId(0),
+      m_seq(0),
+      m_ts(Simulator::Now().GetTimeStep())
+{
+    NS_LOG_FUNCTION(this);
+}
+
+void
+UdpBroadcastHeader::SetNodeId(uint32_t nodeId)
+{
+    NS_LOG_FUNCTION(this << nodeId);
+    m_nodeId = nodeId;
+}
+
+uint32_t
+UdpBroadcastHeader::GetNodeId() const
+{
+    NS_LOG_FUNCTION(this);
+    return m_nodeId;
+}
+
+void
+UdpBroadcastHeader::SetSeq(uint32_t seq)
+{
+    NS_LOG_FUNCTION(this << seq);
+    m_seq = seq;
+}
+
+uint32_t
+UdpBroadcastHeader::GetSeq() const
+{
+    NS_LOG_FUNCTION(this);
+    return m_seq;
+}
+
+Time
+UdpBroadcastHeader::GetTs() const
+{
+    NS_LOG_FUNCTION(this);
+    return TimeStep(m_ts);
+}
+
+TypeId
+UdpBroadcastHeader::GetTypeId()
+{
+    static TypeId tid = TypeId("ns3::UdpBroadcastHeader")
+                            .SetParent<Header>()
+                            .SetGroupName("Applications")
+                            .AddConstructor<UdpBroadcastHeader>();
+    return tid;
+}
+
+TypeId
+UdpBroadcastHeader::GetInstanceTypeId() const
+{
+    return GetTypeId();
+}
+
+void
+UdpBroadcastHeader::Print(std::ostream& os) const
+{
+    NS_LOG_FUNCTION(this << &os);
+    os << "(node=" << m_nodeId << " seq=" << m_seq << " time=" << TimeStep(m_ts).As(Time::S)
+       << ")";
+}
+
+uint32_t
+UdpBroadcastHeader::GetSerializedSize() const
+{
+    NS_LOG_FUNCTION(this);
+    return 4 + 4 + 8;
+}
+
+void
+UdpBroadcastHeader::Serialize(Buffer::Iterator start) const
+{
+    NS_LOG_FUNCTION(this << &start);
+    Buffer::Iterator i = start;
+    i.WriteHtonU32(m_nodeId);
+    i.WriteHtonU32(m_seq);
+    i.WriteHtonU64(m_ts);
+}
+
+uint32_t
+UdpBroadcastHeader::Deserialize(Buffer::Iterator start)
+{
+    NS_LOG_FUNCTION(this << &start);
+    Buffer::Iterator i = start;
+    m_nodeId = i.ReadNtohU32();
+    m_seq = i.ReadNtohU32();
+    m_ts = i.ReadNtohU64();
+    return GetSerializedSize();
+}
+
+} // namespace ns3
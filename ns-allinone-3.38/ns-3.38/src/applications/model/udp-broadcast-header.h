@@ -0,0 +1,79 @@
+/*
+ * This program is free software; you can redistribute it and/or modify
+ * it under the terms of the GNU General Public License version 2 as
+ * published by the Free Software Foundation;
+ *
+ * This program is distributed in the hope that it will be useful,
+ * but WITHOUT ANY WARRANTY; without even the implied warranty of
+ * MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ * GNU General Public License for more details.
+ *
+ * You should have received a copy of the GNU General Public License
+ * along with this program; if not, write to the Free Software
+ * Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+ */
+
+#ifndef UDP_BROADCAST_HEADER_H
+#define UDP_BROADCAST_HEADER_H
+
+#include "ns3/header.h"
+#include "ns3/nstime.h"
+
+namespace ns3
+{
+/**
+ * \ingroup applications
+ *
+ * \brief Packet header of UdpBroadCastApplication, carrying the sender node id,
+ * the attempt number and the transmission time.
+ *
+ * The header is sent in front of a zero-filled payload, so the packet size is
+ * chosen without building the payload content.
+ */
+class UdpBroadcastHeader : public Header
+{
+  public:
+    UdpBroadcastHeader();
+
+    /**
+     * \param nodeId the id of the sending node
+     */
+    void SetNodeId(uint32_t nodeId);
+    /**
+     * \return the id of the sending node
+     */
+    uint32_t GetNodeId() const;
+    /**
+     * \param seq the attempt number
+     */
+    void SetSeq(uint32_t seq);
+    /**
+     * \return the attempt number
+     */
+    uint32_t GetSeq() const;
+    /**
+     * \return the time at which the header was created by the sender
+     */
+    Time GetTs() const;
+
+    /**
+     * \brief Get the type ID.
+     * \return the object TypeId
+     */
+    static TypeId GetTypeId();
+
+    TypeId GetInstanceTypeId() const override;
+    void Print(std::ostream& os) const override;
+    uint32_t GetSerializedSize() const override;
+    void Serialize(Buffer::Iterator start) const override;
+    uint32_t Deserialize(Buffer::Iterator start) override;
+
+  private:
+    uint32_t m_nodeId; //!< Sender node id
+    uint32_t m_seq;    //!< Attempt number
+    uint64_t m_ts;     //!< Transmission timestamp
+};
+
+} // namespace ns3
+
+#endif /* UDP_BROADCAST_HEADER_H */
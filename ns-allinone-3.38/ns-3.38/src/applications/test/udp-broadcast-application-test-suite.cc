@@ -0,0 +1,600 @@
+/*
+ * This program is free software; you can redistribute it and/or modify
+ * it under the terms of the GNU General Public License version 2 as
+ * published by the Free Software Foundation;
+ *
+ * This program is distributed in the hope that it will be useful,
+ * but WITHOUT ANY WARRANTY; without even the implied warranty of
+ * MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ * GNU General Public License for more details.
+ *
+ * You should have received a copy of the GNU General Public License
+ * along with this program; if not, write to the Free Software
+ * Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+ *
+ */
+
+#include "ns3/data-rate.h"
+#include "ns3/double.h"
+#include "ns3/error-model.h"
+#include "ns3/inet-socket-address.h"
+#include "ns3/internet-stack-helper.h"
+#include "ns3/ipv4-address-helper.h"
+#include "ns3/packet.h"
+#include "ns3/pointer.h"
+#include "ns3/simple-net-device-helper.h"
+#include "ns3/simulator.h"
+#include "ns3/test.h"
+#include "ns3/udp-broadcast-application.h"
+#include "ns3/udp-broadcast-header.h"
+#include "ns3/udp-broadcast-helper.h"
+#include "ns3/uinteger.h"
+
+#include <algorithm>
+#include <chrono>
+#include <fstream>
+#include <map>
+#include <string>
+#include <tuple>
+
+using namespace ns3;
+
+/**
+ * \ingroup applications-test
+ * \ingroup tests
+ *
+ * Check that the result log keeps the insertion order and drops duplicate entries.
+ */
+class UdpBroadcastResultLogTestCase : public TestCase
+{
+  public:
+    UdpBroadcastResultLogTestCase();
+
+  private:
+    void DoRun() override;
+};
+
+UdpBroadcastResultLogTestCase::UdpBroadcastResultLogTestCase()
+    : TestCase("Check the order and duplicate suppression of the result log")
+{
+}
+
+void
+UdpBroadcastResultLogTestCase::DoRun()
+{
+    UdpBroadcastResultLog resultLog;
+    NS_TEST_ASSERT_MSG_EQ(resultLog.Add(0, "+0s packet 0 sent."), true, "A new entry is added");
+    NS_TEST_ASSERT_MSG_EQ(resultLog.Add(0, "+0.1s received 1 0"), true, "A new entry is added");
+    NS_TEST_ASSERT_MSG_EQ(resultLog.Add(0, "+0s packet 0 sent."), false, "A duplicate entry is dropped");
+    NS_TEST_ASSERT_MSG_EQ(resultLog.Add(1, "+0s packet 0 sent."), true, "Node ids are deduplicated separately");
+    NS_TEST_ASSERT_MSG_EQ(resultLog.GetSize(), 3u, "Three entries were added");
+
+    std::map<int, std::vector<std::string>> entries = resultLog.Get();
+    NS_TEST_ASSERT_MSG_EQ(entries.size(), 2u, "Two node ids were logged");
+    NS_TEST_ASSERT_MSG_EQ(entries[0].size(), 2u, "Node 0 logged two entries");
+    NS_TEST_ASSERT_MSG_EQ(entries[0][0], "+0s packet 0 sent.", "Entries keep their insertion order");
+    NS_TEST_ASSERT_MSG_EQ(entries[0][1], "+0.1s received 1 0", "Entries keep their insertion order");
+
+    resultLog.Clear();
+    NS_TEST_ASSERT_MSG_EQ(resultLog.GetSize(), 0u, "The log is empty after Clear");
+    NS_TEST_ASSERT_MSG_EQ(resultLog.Add(0, "+0s packet 0 sent."), true, "Cleared entries can be added again");
+}
+
+/**
+ * \ingroup applications-test
+ * \ingroup tests
+ *
+ * Check that the event log keeps one entry per field array for every event.
+ */
+class UdpBroadcastEventLogTestCase : public TestCase
+{
+  public:
+    UdpBroadcastEventLogTestCase();
+
+  private:
+    void DoRun() override;
+};
+
+UdpBroadcastEventLogTestCase::UdpBroadcastEventLogTestCase()
+    : TestCase("Check the field arrays of the event log")
+{
+}
+
+void
+UdpBroadcastEventLogTestCase::DoRun()
+{
+    UdpBroadcastEventLog events;
+    events.Add(UdpBroadcastEventLog::SENT, 1000, 0, UdpBroadcastEventLog::BROADCAST, 0);
+    events.Add(UdpBroadcastEventLog::RECEIVED, 2500, 1, 0, 3);
+    NS_TEST_ASSERT_MSG_EQ(events.GetSize(), 2u, "Two events were added");
+    NS_TEST_ASSERT_MSG_EQ(events.GetTimes().size(), 2u, "Every field has one entry per event");
+    NS_TEST_ASSERT_MSG_EQ(events.GetSeqs().size(), 2u, "Every field has one entry per event");
+    NS_TEST_ASSERT_MSG_EQ(events.GetTypes()[1], UdpBroadcastEventLog::RECEIVED, "The type is kept");
+    NS_TEST_ASSERT_MSG_EQ(events.GetTimes()[1], 2500, "The time is kept");
+    NS_TEST_ASSERT_MSG_EQ(events.GetSources()[1], 1u, "The sender is kept");
+    NS_TEST_ASSERT_MSG_EQ(events.GetDestinations()[0], UdpBroadcastEventLog::BROADCAST, "Sent packets are broadcast");
+    NS_TEST_ASSERT_MSG_EQ(events.GetSeqs()[1], 3u, "The attempt number is kept");
+
+    events.Clear();
+    NS_TEST_ASSERT_MSG_EQ(events.GetSize(), 0u, "The log is empty after Clear");
+}
+
+/**
+ * \ingroup applications-test
+ * \ingroup tests
+ *
+ * Check that the event sink appends one fixed-size record per event.
+ */
+class UdpBroadcastEventSinkTestCase : public TestCase
+{
+  public:
+    UdpBroadcastEventSinkTestCase();
+
+  private:
+    void DoRun() override;
+};
+
+UdpBroadcastEventSinkTestCase::UdpBroadcastEventSinkTestCase()
+    : TestCase("Check the records written by the event sink")
+{
+}
+
+void
+UdpBroadcastEventSinkTestCase::DoRun()
+{
+    std::string filename = CreateTempDirFilename("udp-broadcast-events.bin");
+    for (uint32_t runId = 0; runId < 2; runId++)
+    {
+        Ptr<UdpBroadcastEventSink> sink = Create<UdpBroadcastEventSink>(filename, runId);
+        sink->NotifyEvent(UdpBroadcastEventLog::SENT, 1000, 2, UdpBroadcastEventLog::BROADCAST, 5);
+        sink->NotifyEvent(UdpBroadcastEventLog::RECEIVED, 2000, 2, 1, 5);
+        sink->Close();
+        sink->NotifyEvent(UdpBroadcastEventLog::RECEIVED, 3000, 2, 0, 5);
+        NS_TEST_ASSERT_MSG_EQ(sink->GetNRecords(), 2u, "Events after Close are dropped");
+    }
+
+    std::ifstream file(filename, std::ios::binary);
+    std::vector<UdpBroadcastEventSink::Record> records(4);
+    file.read(reinterpret_cast<char*>(records.data()), 4 * sizeof(UdpBroadcastEventSink::Record));
+    NS_TEST_ASSERT_MSG_EQ(file.gcount(), 4 * 32, "Each run appended two records of 32 bytes");
+    NS_TEST_ASSERT_MSG_EQ(records[3].runId, 1u, "The run id is written");
+    NS_TEST_ASSERT_MSG_EQ(records[3].timeNs, 2000, "The time is written");
+    NS_TEST_ASSERT_MSG_EQ(records[3].dst, 1u, "The receiver is written");
+    NS_TEST_ASSERT_MSG_EQ(records[3].seq, 5u, "The attempt number is written");
+    NS_TEST_ASSERT_MSG_EQ(records[2].type, UdpBroadcastEventLog::SENT, "The type is written");
+
+    // Runs simulated side by side share a sink with their own run ids.
+    std::string sharedFilename = CreateTempDirFilename("udp-broadcast-shared-events.bin");
+    Ptr<UdpBroadcastEventSink> sink = Create<UdpBroadcastEventSink>(sharedFilename, 7);
+    sink->NotifyRunEvent(8, UdpBroadcastEventLog::SENT, 1000, 5, UdpBroadcastEventLog::BROADCAST, 0);
+    sink->NotifyEvent(UdpBroadcastEventLog::SENT, 1000, 0, UdpBroadcastEventLog::BROADCAST, 0);
+    sink->Close();
+    std::ifstream sharedFile(sharedFilename, std::ios::binary);
+    sharedFile.read(reinterpret_cast<char*>(records.data()), 2 * sizeof(UdpBroadcastEventSink::Record));
+    NS_TEST_ASSERT_MSG_EQ(records[0].runId, 8u, "The given run id is written");
+    NS_TEST_ASSERT_MSG_EQ(records[1].runId, 7u, "The run id of the sink is written by default");
+}
+
+/**
+ * \ingroup applications-test
+ * \ingroup tests
+ *
+ * Check that the UdpBroadcastHeader fields survive a round trip through a packet.
+ */
+class UdpBroadcastHeaderTestCase : public TestCase
+{
+  public:
+    UdpBroadcastHeaderTestCase();
+
+  private:
+    void DoRun() override;
+};
+
+UdpBroadcastHeaderTestCase::UdpBroadcastHeaderTestCase()
+    : TestCase("Check the serialization of the UdpBroadcastHeader")
+{
+}
+
+void
+UdpBroadcastHeaderTestCase::DoRun()
+{
+    UdpBroadcastHeader header;
+    header.SetNodeId(7);
+    header.SetSeq(42);
+    Ptr<Packet> packet = Create<Packet>(100 - header.GetSerializedSize());
+    packet->AddHeader(header);
+    NS_TEST_ASSERT_MSG_EQ(packet->GetSize(), 100u, "The header is part of the packet size");
+
+    UdpBroadcastHeader received;
+    packet->PeekHeader(received);
+    NS_TEST_ASSERT_MSG_EQ(received.GetNodeId(), 7u, "The node id is kept");
+    NS_TEST_ASSERT_MSG_EQ(received.GetSeq(), 42u, "The attempt number is kept");
+    NS_TEST_ASSERT_MSG_EQ(received.GetTs(), header.GetTs(), "The tx time is kept");
+}
+
+/**
+ * \ingroup applications-test
+ * \ingroup tests
+ *
+ * Check that the auto stop can be reset for several rounds on the same timeline, and that
+ * the timeout of a round does not stop a later one.
+ */
+class UdpBroadcastAutoStopResetTestCase : public TestCase
+{
+  public:
+    UdpBroadcastAutoStopResetTestCase();
+
+  private:
+    void DoRun() override;
+};
+
+UdpBroadcastAutoStopResetTestCase::UdpBroadcastAutoStopResetTestCase()
+    : TestCase("Check the rounds of a reset auto stop")
+{
+}
+
+void
+UdpBroadcastAutoStopResetTestCase::DoRun()
+{
+    Ptr<UdpBroadcastAutoStop> autoStop = Create<UdpBroadcastAutoStop>(Seconds(1));
+
+    // The application never finishes, so the round ends at its timeout.
+    autoStop->Reset(Seconds(5));
+    Simulator::Run();
+    NS_TEST_ASSERT_MSG_EQ(autoStop->IsStopped(), false, "The timeout does not count as stopped");
+    NS_TEST_ASSERT_MSG_EQ(Simulator::Now(), Seconds(5), "The round ends at its timeout");
+
+    // The application finishes after 1 s, so the round ends after the drain time.
+    for (uint32_t round = 0; round < 2; round++)
+    {
+        Time start = Simulator::Now();
+        autoStop->Reset(Seconds(5));
+        Simulator::Schedule(Seconds(1), &UdpBroadcastAutoStop::NotifyFinished, autoStop);
+        Simulator::Run();
+        NS_TEST_ASSERT_MSG_EQ(autoStop->IsStopped(), true, "The round is stopped by the drain time");
+        NS_TEST_ASSERT_MSG_EQ(Simulator::Now() - start,
+                              Seconds(2),
+                              "The timeout of a previous round does not stop this one");
+    }
+    Simulator::Destroy();
+}
+
+/**
+ * \ingroup applications-test
+ * \ingroup tests
+ *
+ * Check that the auto stop waits for the frames queued in the devices, even when the applications
+ * are quiet for longer than the drain time, so it receives as many packets as a run to the stop time.
+ * The receivers drop their first packets, so no application event happens while the slow devices
+ * drain their queues.
+ */
+class UdpBroadcastAutoStopQueueTestCase : public TestCase
+{
+  public:
+    UdpBroadcastAutoStopQueueTestCase();
+
+  private:
+    void DoRun() override;
+
+    /**
+     * Simulate nodes whose slow devices queue the packets of their applications for seconds.
+     * \param drainTime the drain time of the auto stop, or zero to run to the stop time
+     * \param stopped set to whether the auto stop stopped the simulator
+     * \return the number of received packets
+     */
+    uint32_t CountReceived(Time drainTime, bool& stopped);
+
+    /// Count a received packet.
+    static void NotifyRx(uint32_t* nReceived, Ptr<const Packet> packet, const Address& from);
+};
+
+UdpBroadcastAutoStopQueueTestCase::UdpBroadcastAutoStopQueueTestCase()
+    : TestCase("Check that the auto stop waits for the queued frames")
+{
+}
+
+void
+UdpBroadcastAutoStopQueueTestCase::NotifyRx(uint32_t* nReceived,
+                                            Ptr<const Packet> packet,
+                                            const Address& from)
+{
+    (*nReceived)++;
+}
+
+uint32_t
+UdpBroadcastAutoStopQueueTestCase::CountReceived(Time drainTime, bool& stopped)
+{
+    NodeContainer nodes;
+    nodes.Create(3);
+    SimpleNetDeviceHelper devices;
+    devices.SetDeviceAttribute("DataRate", DataRateValue(DataRate("800bps")));
+    NetDeviceContainer nodeDevices = devices.Install(nodes);
+    for (uint32_t i = 0; i < nodeDevices.GetN(); i++)
+    {
+        Ptr<ReceiveListErrorModel> errorModel = CreateObject<ReceiveListErrorModel>();
+        errorModel->SetList({0, 1, 2, 3, 4, 5});
+        nodeDevices.Get(i)->SetAttribute("ReceiveErrorModel", PointerValue(errorModel));
+    }
+    InternetStackHelper internet;
+    internet.Install(nodes);
+    Ipv4AddressHelper address("10.1.0.0", "255.255.255.0");
+    address.Assign(nodeDevices);
+
+    UdpBroadcastHelper helper(InetSocketAddress(Ipv4Address::GetBroadcast(), 100));
+    helper.SetAttribute("TotalAttempt", UintegerValue(5));
+    helper.SetAttribute("SendRate", DoubleValue(50));
+    helper.SetAttribute("Port", UintegerValue(100));
+    ApplicationContainer apps = helper.Install(nodes);
+    apps.Start(Seconds(0));
+    apps.Stop(Seconds(100));
+    uint32_t nReceived = 0;
+    for (uint32_t i = 0; i < apps.GetN(); i++)
+    {
+        apps.Get(i)->TraceConnectWithoutContext("Rx", MakeBoundCallback(&NotifyRx, &nReceived));
+    }
+    Ptr<UdpBroadcastAutoStop> autoStop;
+    if (drainTime.IsStrictlyPositive())
+    {
+        autoStop = helper.EnableAutoStop(apps, drainTime);
+    }
+    Simulator::Stop(Seconds(100));
+    Simulator::Run();
+    stopped = autoStop && autoStop->IsStopped();
+    Simulator::Destroy();
+    return nReceived;
+}
+
+void
+UdpBroadcastAutoStopQueueTestCase::DoRun()
+{
+    bool stopped;
+    uint32_t nFull = CountReceived(Seconds(0), stopped);
+    NS_TEST_ASSERT_MSG_GT(nFull, 0u, "The nodes received packets");
+    uint32_t nDrained = CountReceived(MilliSeconds(500), stopped);
+    NS_TEST_ASSERT_MSG_EQ(stopped, true, "The auto stop stopped the simulator");
+    NS_TEST_ASSERT_MSG_EQ(nDrained, nFull, "The queued frames are received before the auto stop");
+}
+
+/**
+ * \ingroup applications-test
+ * \ingroup tests
+ *
+ * Check that copies of a scenario simulated side by side in one run, each on its own
+ * channel and with streams fixed by its run id, record the same events as the copies
+ * simulated one by one.
+ */
+class UdpBroadcastBatchedRunsTestCase : public TestCase
+{
+  public:
+    UdpBroadcastBatchedRunsTestCase();
+
+  private:
+    void DoRun() override;
+
+    /// The events of one run, with the node ids made relative to their copy.
+    using Events = std::vector<std::tuple<int64_t, uint8_t, uint32_t, uint32_t, uint32_t>>;
+
+    /**
+     * Build one copy of the scenario on its own channel and subnet.
+     * \param address the helper of the subnets, moved to the next subnet
+     * \param sink the sink the events of the copy are appended to
+     * \param start the start time of the applications
+     * \param runId the run id of the copy, which also fixes its random streams
+     */
+    void AddCopy(Ipv4AddressHelper& address,
+                 Ptr<UdpBroadcastEventSink> sink,
+                 Time start,
+                 uint32_t runId);
+
+    /**
+     * \param filename the file written by the sink
+     * \returns the events of each run id, sorted
+     */
+    std::map<uint32_t, Events> ReadEvents(std::string filename);
+
+    static const uint32_t N_NODES = 3; //!< Number of nodes of a copy
+};
+
+UdpBroadcastBatchedRunsTestCase::UdpBroadcastBatchedRunsTestCase()
+    : TestCase("Check that batched runs with fixed streams match single runs")
+{
+}
+
+void
+UdpBroadcastBatchedRunsTestCase::AddCopy(Ipv4AddressHelper& address,
+                                         Ptr<UdpBroadcastEventSink> sink,
+                                         Time start,
+                                         uint32_t runId)
+{
+    NodeContainer nodes;
+    nodes.Create(N_NODES);
+    SimpleNetDeviceHelper devices;
+    NetDeviceContainer copyDevices = devices.Install(nodes); // a new channel for each copy
+    InternetStackHelper internet;
+    internet.Install(nodes);
+    internet.AssignStreams(nodes, runId * 1000 + 100);
+    address.Assign(copyDevices);
+    address.NewNetwork();
+
+    UdpBroadcastHelper helper(InetSocketAddress(Ipv4Address::GetBroadcast(), 100));
+    helper.SetAttribute("TotalAttempt", UintegerValue(5));
+    helper.SetAttribute("SendRate", DoubleValue(50));
+    helper.SetAttribute("Port", UintegerValue(100));
+    ApplicationContainer apps = helper.Install(nodes);
+    apps.Start(start);
+    apps.Stop(Seconds(5));
+    helper.AssignStreams(nodes, runId * 1000);
+    helper.EnableEventSink(apps, sink, runId);
+}
+
+std::map<uint32_t, UdpBroadcastBatchedRunsTestCase::Events>
+UdpBroadcastBatchedRunsTestCase::ReadEvents(std::string filename)
+{
+    std::map<uint32_t, Events> events;
+    std::ifstream file(filename, std::ios::binary);
+    UdpBroadcastEventSink::Record record;
+    while (file.read(reinterpret_cast<char*>(&record), sizeof(record)))
+    {
+        uint32_t dst = record.dst == UdpBroadcastEventLog::BROADCAST ? record.dst : record.dst % N_NODES;
+        events[record.runId].emplace_back(record.timeNs,
+                                          record.type,
+                                          record.src % N_NODES,
+                                          dst,
+                                          record.seq);
+    }
+    for (auto& run : events)
+    {
+        std::sort(run.second.begin(), run.second.end());
+    }
+    return events;
+}
+
+void
+UdpBroadcastBatchedRunsTestCase::DoRun()
+{
+    const std::vector<Time> starts = {Seconds(0), MilliSeconds(50), MilliSeconds(100)};
+
+    std::string batchedFilename = CreateTempDirFilename("udp-broadcast-batched.bin");
+    Ptr<UdpBroadcastEventSink> batchedSink = Create<UdpBroadcastEventSink>(batchedFilename, 0);
+    Ipv4AddressHelper address("10.1.0.0", "255.255.255.0");
+    for (uint32_t runId = 0; runId < starts.size(); runId++)
+    {
+        AddCopy(address, batchedSink, starts[runId], runId);
+    }
+    Simulator::Run();
+    Simulator::Destroy();
+    batchedSink->Close();
+
+    std::string singleFilename = CreateTempDirFilename("udp-broadcast-single.bin");
+    Ptr<UdpBroadcastEventSink> singleSink = Create<UdpBroadcastEventSink>(singleFilename, 0);
+    for (uint32_t runId = 0; runId < starts.size(); runId++)
+    {
+        Ipv4AddressHelper singleAddress("10.1.0.0", "255.255.255.0");
+        AddCopy(singleAddress, singleSink, starts[runId], runId);
+        Simulator::Run();
+        Simulator::Destroy();
+    }
+    singleSink->Close();
+
+    std::map<uint32_t, Events> batched = ReadEvents(batchedFilename);
+    std::map<uint32_t, Events> single = ReadEvents(singleFilename);
+    NS_TEST_ASSERT_MSG_EQ(batched.size(), starts.size(), "Every copy recorded events");
+    for (uint32_t runId = 0; runId < starts.size(); runId++)
+    {
+        NS_TEST_ASSERT_MSG_EQ(batched[runId].empty(), false, "Run " << runId << " recorded events");
+        NS_TEST_ASSERT_MSG_EQ((batched[runId] == single[runId]),
+                              true,
+                              "Run " << runId << " recorded the same events alone and in the batch");
+    }
+}
+
+/**
+ * \ingroup applications-test
+ * \ingroup tests
+ *
+ * Micro-benchmark of the result log: logging four times more events should take about
+ * four times longer. A log that scans its previous entries on every insertion takes
+ * about sixteen times longer.
+ */
+class UdpBroadcastResultLogScalingTestCase : public TestCase
+{
+  public:
+    UdpBroadcastResultLogScalingTestCase();
+
+  private:
+    void DoRun() override;
+    /**
+     * Log the tx and rx events of a stamp, with one duplicate per received packet.
+     * \param nEvents the number of distinct events
+     * \return the wall time of the insertions, in seconds
+     */
+    double LogEvents(uint32_t nEvents);
+};
+
+UdpBroadcastResultLogScalingTestCase::UdpBroadcastResultLogScalingTestCase()
+    : TestCase("Check that the result log scales linearly with the number of events")
+{
+}
+
+double
+UdpBroadcastResultLogScalingTestCase::LogEvents(uint32_t nEvents)
+{
+    std::vector<std::string> events;
+    events.reserve(nEvents);
+    for (uint32_t i = 0; i < nEvents; i++)
+    {
+        events.push_back("+" + std::to_string(i * 1e-4) + "s received " + std::to_string(i % 5) +
+                         " " + std::to_string(i));
+    }
+
+    UdpBroadcastResultLog resultLog;
+    auto start = std::chrono::steady_clock::now();
+    for (const auto& event : events)
+    {
+        resultLog.Add(0, event);
+        resultLog.Add(0, event);
+    }
+    auto end = std::chrono::steady_clock::now();
+    NS_TEST_EXPECT_MSG_EQ(resultLog.GetSize(), nEvents, "Duplicate events are dropped");
+    return std::chrono::duration<double>(end - start).count();
+}
+
+void
+UdpBroadcastResultLogScalingTestCase::DoRun()
+{
+    const uint32_t nEvents = 50000;
+    LogEvents(nEvents); // warm up the allocator
+    double small = LogEvents(nEvents);
+    double large = LogEvents(4 * nEvents);
+    NS_TEST_ASSERT_MSG_LT(large / small,
+                          8.0,
+                          "Logging " << nEvents << " events took " << small << " s and logging "
+                                     << 4 * nEvents << " events took " << large << " s");
+}
+
+/**
+ * \ingroup applications-test
+ * \ingroup tests
+ *
+ * \brief UdpBroadCastApplication TestSuite
+ */
+class UdpBroadcastApplicationTestSuite : public TestSuite
+{
+  public:
+    UdpBroadcastApplicationTestSuite();
+};
+
+UdpBroadcastApplicationTestSuite::UdpBroadcastApplicationTestSuite()
+    : TestSuite("udp-broadcast-application", UNIT)
+{
+    AddTestCase(new UdpBroadcastResultLogTestCase, TestCase::QUICK);
+    AddTestCase(new UdpBroadcastHeaderTestCase, TestCase::QUICK);
+    AddTestCase(new UdpBroadcastEventLogTestCase, TestCase::QUICK);
+    AddTestCase(new UdpBroadcastEventSinkTestCase, TestCase::QUICK);
+    AddTestCase(new UdpBroadcastAutoStopResetTestCase, TestCase::QUICK);
+    AddTestCase(new UdpBroadcastAutoStopQueueTestCase, TestCase::QUICK);
+    AddTestCase(new UdpBroadcastBatchedRunsTestCase, TestCase::QUICK);
+}
+
+/**
+ * \ingroup applications-test
+ * \ingroup tests
+ *
+ * \brief UdpBroadCastApplication performance TestSuite
+ */
+class UdpBroadcastApplicationPerformanceTestSuite : public TestSuite
+{
+  public:
+    UdpBroadcastApplicationPerformanceTestSuite();
+};
+
+UdpBroadcastApplicationPerformanceTestSuite::UdpBroadcastApplicationPerformanceTestSuite()
+    : TestSuite("udp-broadcast-application-performance", PERFORMANCE)
+{
+    AddTestCase(new UdpBroadcastResultLogScalingTestCase, TestCase::QUICK);
+}
+
+static UdpBroadcastApplicationTestSuite
+    g_udpBroadcastApplicationTestSuite; //!< Static variable for test initialization
+static UdpBroadcastApplicationPerformanceTestSuite
+    g_udpBroadcastApplicationPerformanceTestSuite; //!< Static variable for test initialization
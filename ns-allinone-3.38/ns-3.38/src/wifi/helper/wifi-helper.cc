@@ -564,6 +564,16 @@ WifiPhyHelper::GetPcapDataLinkType() const
     return m_pcapDlt;
 }
 
+void
+WifiPhyHelper::ClosePcapFiles()
+{
+    for (auto& file : m_pcapFiles)
+    {
+        file->Close();
+    }
+    m_pcapFiles.clear();
+}
+
 void
 WifiPhyHelper::EnablePcapInternal(std::string prefix,
                                   Ptr<NetDevice> nd,
@@ -613,6 +623,7 @@ WifiPhyHelper::EnablePcapInternal(std::string prefix,
             tmp.insert(pos, "-" + std::to_string(linkId++));
         }
         auto file = pcapHelper.CreateFile(tmp, std::ios::out, m_pcapDlt);
+        m_pcapFiles.push_back(file);
         phy->TraceConnectWithoutContext("MonitorSnifferTx",
                                         MakeBoundCallback(&WifiPhyHelper::PcapSniffTxEvent, file));
         phy->TraceConnectWithoutContext("MonitorSnifferRx",
@@ -200,6 +200,14 @@ class WifiPhyHelper : public PcapHelperForDevice, public AsciiTraceHelperForDevi
      */
     PcapHelper::DataLinkType GetPcapDataLinkType() const;
 
+    /**
+     * Flush and close the pcap files opened by the EnablePcap methods of this helper.
+     *
+     * The files are otherwise closed when the PHYs they trace are destroyed. Packets
+     * traced after this call are not written.
+     */
+    void ClosePcapFiles();
+
   protected:
     /**
      * \param file the pcap file wrapper
@@ -311,7 +319,8 @@ class WifiPhyHelper : public PcapHelperForDevice, public AsciiTraceHelperForDevi
                              Ptr<NetDevice> nd,
                              bool explicitFilename) override;
 
-    PcapHelper::DataLinkType m_pcapDlt; ///< PCAP data link type
+    PcapHelper::DataLinkType m_pcapDlt;              ///< PCAP data link type
+    std::vector<Ptr<PcapFileWrapper>> m_pcapFiles; ///< PCAP files opened by this helper
 };
 
 /**
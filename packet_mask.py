@@ -0,0 +1,137 @@
+import numpy as np
+
+
+class PacketMask():
+    """
+    The mask of a shared feature, stored as the numbers of the received packets instead of one value per
+    feature element. Packet i carries the elements [i*payload_size, (i+1)*payload_size) of the feature,
+    the last packet being cut at feature_size.
+
+    Parameters
+        ----------
+        received : array_like
+            The packet numbers of the received packets. Duplicates and packet numbers outside the feature are ignored.
+        feature_size : int
+            The number of elements of the shared feature.
+        payload_size : int
+            The number of feature elements carried by one packet.
+    """
+    __slots__ = ("received", "feature_size", "payload_size")
+
+    def __init__(self, received, feature_size, payload_size) -> None:
+        self.feature_size = int(feature_size)
+        self.payload_size = int(payload_size)
+        received = np.unique(np.asarray(received, dtype=np.int64))
+        received = received[(received >= 0) & (received < self.n_packets)]
+        self.received = received.astype(np.uint32 if self.n_packets <= np.iinfo(np.uint32).max else np.int64)
+
+    @classmethod
+    def from_packbits(cls, bits, feature_size, payload_size):
+        """Build a mask from the packet bitset returned by to_packbits()."""
+        n_packets = -(-int(feature_size)//int(payload_size))
+        received = np.flatnonzero(np.unpackbits(np.asarray(bits, dtype=np.uint8), count=n_packets))
+        return cls(received, feature_size, payload_size)
+
+    @property
+    def n_packets(self):
+        """The number of packets the feature is split into."""
+        return -(-self.feature_size//self.payload_size)
+
+    @property
+    def nbytes(self):
+        """The bytes held by the received packet numbers."""
+        return self.received.nbytes
+
+    def __len__(self):
+        return self.feature_size
+
+    def __repr__(self):
+        return f"PacketMask({len(self.received)}/{self.n_packets} packets, feature_size={self.feature_size}, payload_size={self.payload_size})"
+
+    def __eq__(self, other):
+        if not isinstance(other, PacketMask):
+            return NotImplemented
+        return (self.feature_size, self.payload_size) == (other.feature_size, other.payload_size) \
+            and np.array_equal(self.received, other.received)
+
+    def __array__(self, dtype=None, copy=None):
+        # Lets numpy code written for the dense masks, e.g. feature*mask, keep working.
+        return self.to_dense(np.float64 if dtype is None else dtype)
+
+    def _intervals(self, packets):
+        # Merge consecutive packet numbers into [start, stop) runs of feature elements.
+        if len(packets) == 0:
+            return np.empty((0, 2), dtype=np.int64)
+        packets = packets.astype(np.int64)
+        breaks = np.flatnonzero(np.diff(packets) != 1)
+        starts = packets[np.concatenate(([0], breaks + 1))]
+        stops = packets[np.concatenate((breaks, [len(packets) - 1]))] + 1
+        intervals = np.stack((starts, stops), axis=1)*self.payload_size
+        np.minimum(intervals, self.feature_size, out=intervals)
+        return intervals
+
+    def intervals(self):
+        """
+        Return the received parts of the feature as run-length intervals.
+
+        Returns
+        -------
+        intervals : np.ndarray
+            An (n, 2) array of the [start, stop) element ranges that were received, in increasing order.
+        """
+        return self._intervals(self.received)
+
+    def lost_intervals(self):
+        """Return the [start, stop) element ranges that were lost, as an (n, 2) array."""
+        lost = np.ones(self.n_packets, dtype=bool)
+        lost[self.received] = False
+        return self._intervals(np.flatnonzero(lost))
+
+    def to_dense(self, dtype=bool):
+        """
+        Materialize the mask.
+
+        Parameters
+            ----------
+            dtype : numpy dtype
+                The dtype of the returned array.
+
+            Returns
+            -------
+            mask : np.ndarray
+                An array of length feature_size, 1 at the elements of the received packets and 0 elsewhere.
+        """
+        received = np.zeros(self.n_packets, dtype=dtype)
+        received[self.received] = 1
+        return np.repeat(received, self.payload_size)[:self.feature_size]
+
+    def to_packbits(self):
+        """Return the received packets as a bitset of n_packets bits, packed by np.packbits."""
+        received = np.zeros(self.n_packets, dtype=bool)
+        received[self.received] = True
+        return np.packbits(received)
+
+    def apply(self, feature_array):
+        """
+        Zero the lost parts of a feature in place.
+
+        Parameters
+            ----------
+            feature_array : np.ndarray
+                Either an array whose last axis has feature_size elements, e.g. a batch of flattened features,
+                or a C-contiguous array of feature_size elements of any shape.
+
+            Returns
+            -------
+            feature_array : np.ndarray
+                The same array, with the elements of the lost packets set to 0.
+        """
+        if feature_array.ndim > 0 and feature_array.shape[-1] == self.feature_size:
+            view = feature_array
+        elif feature_array.size == self.feature_size and feature_array.flags.c_contiguous:
+            view = feature_array.reshape(-1)
+        else:
+            raise ValueError(f"Cannot apply a mask of {self.feature_size} elements to an array of shape {feature_array.shape}.")
+        for start, stop in self.lost_intervals():
+            view[..., start:stop] = 0
+        return feature_array
@@ -1,25 +1,55 @@
 import os
 import json
+import time
+import threading
+import heapq
+import collections
 import tqdm
+import numpy as np
+import json_backend
+import trajectory_store
+from dataset_index import DatasetIndex
+from trace_policy import TracePolicy, CONSOLIDATED_FILENAME, merge_consolidated
 
 DELTA_TIME = 0.05 # The time difference in second between two adjacent time stamp
+MAX_OFF_TIME = 0.1 # The default max random delay UdpBroadCastApplication adds before each transmission (the Max of its OffTime attribute)
+SEND_MARGIN = 1. # The time in second added to the active window for the failed sends, which are rescheduled without counting as attempts
+DRAIN_TIME = 1. # The time in second kept after the last possible transmission for queued frames to be delivered
+EVENT_SENT = 0 # UdpBroadcastEventLog::SENT
+BROADCAST = 0xffffffff # UdpBroadcastEventLog::BROADCAST, the receiver of sent packets
+STREAMS_PER_RUN = 10000 # The random stream indices reserved for each run id when the streams are fixed
+EVENT_FIELDS = [("type", "GetTypes", np.uint8), ("time_ns", "GetTimes", np.int64), ("src", "GetSources", np.uint32),
+                ("dst", "GetDestinations", np.uint32), ("seq", "GetSeqs", np.uint32)] # The typed records of UdpBroadCastApplication
+EVENT_RECORD_DTYPE = np.dtype({"names": ["time_ns", "run", "src", "dst", "seq", "type"],
+                               "formats": [np.int64, np.uint32, np.uint32, np.uint32, np.uint32, np.uint8],
+                               "offsets": [0, 8, 12, 16, 20, 24], "itemsize": 32}) # UdpBroadcastEventSink::Record
+EVENTS_FILENAME = "comm_sim_events.bin" # The event records of a scenario, when they are streamed
+STATS_FILENAME = "comm_sim_stats.json" # The wall time and simulated end time of each time stamp of a scenario
+COMM_SIM_FILENAME = "comm_sim.json" # The results of a scenario
+PARTS_DIRNAME = "comm_sim_parts" # The results of the work units of a scenario, until merge_parts adds them to its results files
 
 
 
 
 
-def _read_payloads_waypoints(root):
+def _read_payloads_waypoints(index, scenario):
     payloads = {}
     time_stamps = {}
-    for sub_dir_name in os.listdir(root):
+    stamps = []
+    root = os.path.join(index.root, scenario)
+    # Prefer the per-scenario trajectory store, which is memory mapped instead of parsed.
+    use_store = index.derived_path(scenario, trajectory_store.STORE_FILENAME) is not None
+    for sub_dir_name in index.agents(scenario):
         sub_dir_path = os.path.join(root, sub_dir_name)
-        if os.path.isdir(sub_dir_path):
-            stamps = _parse_time_stamps(sub_dir_path)
-            time_stamps[sub_dir_name] = stamps
+        stamps = index.stamps(scenario, sub_dir_name)
+        time_stamps[sub_dir_name] = stamps
+        if not use_store:
             waypoints_json_path = os.path.join(sub_dir_path, sub_dir_name+".json")
             with open(waypoints_json_path, "r") as fp:
                 waypoints_json = json.load(fp)
             payloads[sub_dir_name] = waypoints_json
+    if use_store:
+        payloads = trajectory_store.load_trajectories(root)
 
     payloads = _process_payload(payloads)
 
@@ -29,10 +59,80 @@ def _process_payload(payloads):
     new_payloads = {}
     for key in payloads:
         old_payload = payloads[key]
-        new_payload = [[ele[0], ele[1][:3]] for ele in old_payload] # remove roll pitch yaw
+        if isinstance(old_payload, np.ndarray):
+            new_payload = old_payload[:, :4] # remove roll yaw pitch, a view of the stored array
+        else:
+            new_payload = [[ele[0], ele[1][:3]] for ele in old_payload] # remove roll pitch yaw
         new_payloads[key] = new_payload
     return new_payloads
 
+def _waypoints_to_array(waypoints):
+    if isinstance(waypoints, np.ndarray):
+        return waypoints
+    return np.array([[time_stamp, *position] for time_stamp, position in waypoints], dtype=np.float64)
+
+def simplify_waypoints(waypoints, max_error):
+    '''
+    Drop the waypoints that the linear interpolation of WaypointMobilityModel can reproduce within max_error.
+    This is Douglas-Peucker on the synchronized euclidean distance: the error of a dropped waypoint is its
+    distance to the position interpolated at the same time between the kept waypoints around it.
+    \param waypoints: the waypoints of one node, either [time, [x, y, z]] rows or an (n, 4) array.
+           float max_error: the max position error in metres.
+    return tuple: the kept waypoints in the same format as the given ones, and the max position error introduced.
+    '''
+    array = _waypoints_to_array(waypoints)
+    n_waypoints = len(array)
+    if n_waypoints < 3:
+        return waypoints, 0.
+    times, positions = array[:, 0], array[:, 1:4]
+    keep = np.zeros(n_waypoints, dtype=bool)
+    keep[[0, -1]] = True
+    max_dropped_error = 0.
+    segments = [(0, n_waypoints-1)]
+    while segments:
+        first, last = segments.pop()
+        if last - first < 2:
+            continue
+        duration = times[last] - times[first]
+        fraction = (times[first+1:last] - times[first])/duration if duration > 0 else np.zeros(last-first-1)
+        interpolated = positions[first] + fraction[:, None]*(positions[last] - positions[first])
+        errors = np.linalg.norm(positions[first+1:last] - interpolated, axis=1)
+        worst = int(np.argmax(errors))
+        if errors[worst] > max_error:
+            keep[first+1+worst] = True
+            segments.append((first, first+1+worst))
+            segments.append((first+1+worst, last))
+        else:
+            max_dropped_error = max(max_dropped_error, float(errors[worst]))
+
+    if isinstance(waypoints, np.ndarray):
+        return waypoints[keep], max_dropped_error
+    return [waypoint for waypoint, kept in zip(waypoints, keep) if kept], max_dropped_error
+
+def _active_window(start_time, rate, total_attempt, drain_time, max_off_time = MAX_OFF_TIME):
+    # From the start of the applications to the last possible transmission plus the drain time. Each attempt waits at most
+    # 1/rate plus the max OffTime given to _create_broadcast_helper, and SEND_MARGIN covers the sends that failed.
+    last_transmission = start_time + total_attempt*(1/rate + max_off_time) + SEND_MARGIN
+    return start_time, last_transmission + drain_time
+
+def _window_waypoints(waypoints, begin, end):
+    '''
+    Keep the waypoints that bracket [begin, end], so the interpolated positions within the window are unchanged.
+    \param waypoints: the waypoints of one node, either [time, [x, y, z]] rows or an (n, 4) array.
+           float begin: the start of the window in seconds.
+           float end: the end of the window in seconds.
+    return: the kept waypoints in the same format as the given ones.
+    '''
+    if isinstance(waypoints, np.ndarray):
+        times = waypoints[:, 0]
+    else:
+        times = [waypoint[0] for waypoint in waypoints]
+    if len(times) == 0:
+        return waypoints
+    first = max(int(np.searchsorted(times, begin, side="right")) - 1, 0) # the last waypoint at or before begin
+    last = min(int(np.searchsorted(times, end, side="left")), len(times) - 1) # the first waypoint at or after end
+    return waypoints[first:last+1]
+
 def _create_payloads_config(total_size, packet_size, maxtime, n_nodes):
     assert total_size%packet_size == 0
     total_attempt = int(total_size/packet_size) # The number of packets needed to carry the full payloads
@@ -41,20 +141,13 @@ def _create_payloads_config(total_size, packet_size, maxtime, n_nodes):
     return [payload]*n_nodes, rate, total_attempt
 
 
-def main(root, total_size, packet_size, maxtime, save_dir):
+def main(root, total_size, packet_size, maxtime, save_dir, max_waypoint_error = None, trace_policy = None, stream_events = False,
+         reuse_topology = False, batch_size = 1):
     from ns import ns
-    _run_exp(root, total_size, packet_size, maxtime, save_dir, ns)
+    _run_exp(root, total_size, packet_size, maxtime, save_dir, ns, max_waypoint_error=max_waypoint_error, trace_policy=trace_policy,
+             stream_events=stream_events, reuse_topology=reuse_topology, batch_size=batch_size)
     return 1
 
-def _parse_time_stamps(path:str, in_order = True) -> list:
-    stamps = []
-    for filename in os.listdir(path):
-        if filename.endswith(".pcd"):
-            stamps.append(filename.split(".")[0])
-    if in_order:
-        stamps.sort()
-    return stamps
-
 def parse_results(original_result:dict, index_to_name):
     parsed_results = {}
     for key in original_result:
@@ -81,90 +174,275 @@ def parse_results(original_result:dict, index_to_name):
     # pprint.pprint(parsed_results)
     return parsed_results
 
+def parse_events(events:dict, index_to_name):
+    '''
+    Build the same structure as parse_results from the typed records returned by simulate(return_events=True).
+    The times are formatted like the text records of UdpBroadCastApplication (6 significant digits, in seconds).
+    \param dict events: a dictionary with the EVENT_FIELDS names as keys and numpy arrays as values.
+           dict index_to_name: a dictionary with node ids as keys and agent names as values.
+    return dict: A dictionary with agent names as keys and their sent and received packets as values.
+    '''
+    time_stamps = np.char.mod("%g", events["time_ns"]/1e9).tolist()
+    is_sent = (events["type"] == EVENT_SENT).tolist()
+    owners = np.where(events["type"] == EVENT_SENT, events["src"], events["dst"]).tolist()
+    parsed_results = {}
+    seen = set()
+    for time_stamp, sent, owner, src, seq in zip(time_stamps, is_sent, owners, events["src"].tolist(), events["seq"].tolist()):
+        key = (owner, sent, time_stamp, src, seq)
+        if key in seen:
+            continue # UdpBroadCastApplication drops duplicate text records
+        seen.add(key)
+        name_key = index_to_name[owner]
+        if name_key not in parsed_results:
+            parsed_results[name_key] = {"sent":[], "receive":{}}
+        if sent:
+            parsed_results[name_key]["sent"].append((time_stamp, seq))
+        else:
+            parsed_results[name_key]["receive"].setdefault(index_to_name[src], []).append((time_stamp, seq))
+    return parsed_results
+
+def read_event_log(path):
+    '''
+    Read the records written by simulate(event_log=path) without loading them.
+    \param str path: the event file.
+    return numpy.ndarray: a read-only structured array with the EVENT_RECORD_DTYPE fields, memory mapped from the file.
+    '''
+    if os.path.getsize(path) == 0:
+        return np.empty(0, dtype=EVENT_RECORD_DTYPE)
+    return np.memmap(path, dtype=EVENT_RECORD_DTYPE, mode="r")
+
+def _vector_to_array(vector, dtype):
+    # Copy a std::vector of numbers into a numpy array through its buffer, before ns-3 frees it.
+    n = vector.size()
+    if n == 0:
+        return np.empty(0, dtype=dtype)
+    try:
+        view = vector.data()
+        view.reshape((n,))
+        return np.frombuffer(view, dtype=dtype, count=n).copy()
+    except (AttributeError, TypeError, ValueError):
+        return np.fromiter(vector, dtype=dtype, count=n)
+
 def save_results(folder, result, filename):
     os.makedirs(folder, exist_ok=True)
-    with open(os.path.join(folder, filename), 'w+') as fp:
-        json.dump(result, fp)
+    json_backend.dump(result, os.path.join(folder, filename))
     # print(f"Saved result to {os.path.join(folder, filename)}")
 
-def _run_exp(root, total_size, packet_size, maxtime, folder, ns, skip = False):
+def _part_path(folder, first_stamp, filename):
+    # The part of a results file written by the work unit that starts at first_stamp.
+    return os.path.join(folder, PARTS_DIRNAME, f"{first_stamp}_{filename}")
+
+def _part_paths(folder, filename):
+    # The part files of a results file of a scenario, in any order.
+    parts_dir = os.path.join(folder, PARTS_DIRNAME)
+    if not os.path.isdir(parts_dir):
+        return []
+    return [os.path.join(parts_dir, name) for name in os.listdir(parts_dir) if name.endswith(f"_{filename}")]
+
+def save_part(folder, first_stamp, result, filename):
+    '''
+    Save the results of a work unit as a part file of its scenario, which merge_parts adds to the results file of the scenario.
+    The part is written to a temporary file first, so a part file is always complete.
+    \param str folder: the scenario folder.
+           int first_stamp: the first time stamp of the work unit, which names the part.
+           dict result: a dictionary with the time stamps as keys.
+           str filename: the name of the results file, e.g., comm_sim.json.
+    '''
+    path = _part_path(folder, first_stamp, filename)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    json_backend.dump(result, path + ".tmp")
+    os.replace(path + ".tmp", path)
+
+def merge_parts(folder, filenames = (COMM_SIM_FILENAME, STATS_FILENAME)):
+    '''
+    Add the part files of a scenario to its results files and remove them, so a results file is read and rewritten once per
+    scenario rather than once per work unit. The time stamps are kept in increasing order, and the new file replaces the old
+    one atomically, so readers never see a partial file. Only one process may merge a scenario at a time.
+    The consolidated captures of the work units are appended to the CONSOLIDATED_FILENAME capture of the scenario in the order
+    of their first time stamps.
+    \param str folder: the scenario folder.
+           tuple filenames: the names of the results files.
+    return int: the number of part files merged.
+    '''
+    n_parts = 0
+    for filename in filenames:
+        part_paths = _part_paths(folder, filename)
+        if not part_paths:
+            continue
+        path = os.path.join(folder, filename)
+        merged = json_backend.load(path) if os.path.exists(path) else {}
+        for part_path in part_paths:
+            merged.update(json_backend.load(part_path))
+        merged = dict(sorted(merged.items(), key=lambda item: int(item[0])))
+        json_backend.dump(merged, path + ".tmp")
+        os.replace(path + ".tmp", path)
+        for part_path in part_paths:
+            os.remove(part_path)
+        n_parts += len(part_paths)
+    part_paths = sorted(_part_paths(folder, CONSOLIDATED_FILENAME), key=lambda path: int(os.path.basename(path).split("_")[0]))
+    if part_paths:
+        path = os.path.join(folder, CONSOLIDATED_FILENAME)
+        merge_consolidated(([path] if os.path.exists(path) else []) + part_paths, path)
+        for part_path in part_paths:
+            os.remove(part_path)
+        n_parts += len(part_paths)
+    parts_dir = os.path.join(folder, PARTS_DIRNAME)
+    if os.path.isdir(parts_dir) and not os.listdir(parts_dir):
+        os.rmdir(parts_dir)
+    return n_parts
+
+def _load_scenario(index, scenario, max_waypoint_error = None, write = print):
+    # The agent names, waypoints and integer time stamps of a scenario, with the waypoints simplified if max_waypoint_error is given.
+    payloads, stamps = _read_payloads_waypoints(index, scenario)
+    int_stamps = [int(ele) for ele in stamps]
+    nodes_names = list(payloads.keys())
+    waypoints = [payloads[nodes_name] for nodes_name in nodes_names]
+    if max_waypoint_error is not None:
+        n_original = sum(len(ele) for ele in waypoints)
+        simplified = [simplify_waypoints(ele, max_waypoint_error) for ele in waypoints]
+        waypoints = [ele for ele, _ in simplified]
+        n_simplified = sum(len(ele) for ele in waypoints)
+        # Installing the waypoints costs one AddWaypoint call per waypoint and node.
+        write(f"{scenario}: {n_original} -> {n_simplified} waypoints "
+              f"({n_original/max(n_simplified, 1):.1f}x fewer AddWaypoint calls), "
+              f"max position error {max((error for _, error in simplified), default=0.):.3f} m")
+    return nodes_names, waypoints, int_stamps
+
+def _simulate_stamps(ns, nodes_names, waypoints, int_stamps, origin, total_size, packet_size, maxtime, folder, trace_policy,
+                     event_log = None, reuse_topology = False, batch_size = 1, pbar = None, part = None, all_stamps = None):
+    '''
+    Simulate the given time stamps of one scenario, as _run_exp does for all of them.
+    \param list int_stamps: the time stamps to simulate.
+           int origin: the first time stamp of the scenario, simulated at time 0.
+           str folder: the output folder of the scenario, given to trace_policy.
+           str event_log: if given, the events are appended to this file (which is emptied first) and parsed once all
+                          time stamps are simulated.
+           tqdm pbar: if given, its postfix shows the run statistics of the last time stamp.
+           int part: if given, the time stamps are the work unit of the scenario starting at this time stamp, and the
+                     consolidated capture of trace_policy is saved as its part file (see merge_parts).
+           list all_stamps: all the time stamps of the scenario in order, whose positions are given to trace_policy.begin_stamp.
+                            Defaults to int_stamps.
+    return: the parsed results and the run statistics, in dictionaries with the time stamps as keys.
+    '''
+    nNodes = len(nodes_names)
+    index_to_name = {key:value for key, value in zip(range(nNodes), nodes_names)}
+    # The records of a batch keep the node ids of their copy, nNodes per copy
+    record_index_to_name = {node_id:nodes_names[node_id % nNodes] for node_id in range(nNodes*batch_size)}
+    packets, rate, total_attempt = _create_payloads_config(total_size, packet_size, maxtime, nNodes)
+    stamp_indices = {stamp:i for i, stamp in enumerate(all_stamps if all_stamps is not None else int_stamps)}
+    final_result = {}
+    final_stats = {}
+    trace_policy.begin_scenario(folder, consolidated_path=_part_path(folder, part, CONSOLIDATED_FILENAME) if part is not None else None)
+    if event_log is not None:
+        os.makedirs(os.path.dirname(event_log), exist_ok=True)
+        open(event_log, "wb").close()
+    session = None
+    if reuse_topology:
+        session = SimulationSession(ns, nNodes, packets, waypoints, rate, total_attempt, drain_time=DRAIN_TIME, event_log=event_log)
+    for first in range(0, len(int_stamps), batch_size):
+        batch = int_stamps[first:first+batch_size]
+        start_times = [(stamp - origin)*DELTA_TIME for stamp in batch]
+        run_stats = {}
+        trace_policy.begin_stamp(stamp_indices[batch[0]])
+        if session is not None:
+            results = [session.run(start_times[0], run_stats=run_stats, run_id=batch[0])]
+        elif batch_size > 1:
+            results = simulate(nNodes = nNodes, payloads = packets, waypoints = waypoints, rate = rate, total_attempt=total_attempt, ns=ns, drain_time=DRAIN_TIME, run_stats=run_stats, tracer=trace_policy, binary_header=True, return_events=True,
+                               event_log=event_log, start_times=start_times, run_ids=batch)
+            # The wall time of the batch is shared by its time stamps
+            run_stats["wall_time"] /= len(batch)
+            run_stats["batch_size"] = len(batch)
+        else:
+            results = [simulate(nNodes = nNodes, payloads = packets, waypoints = waypoints, rate = rate, total_attempt=total_attempt, start_time = start_times[0], ns=ns, experiment_title=f"{total_size}_{packet_size}_{batch[0]}", drain_time=DRAIN_TIME, run_stats=run_stats, tracer=trace_policy, binary_header=True, return_events=True,
+                                event_log=event_log, run_id=batch[0], fixed_streams=True)]
+        for i, stamp in enumerate(batch):
+            if event_log is None:
+                parsed_result = parse_events(results[i], index_to_name)
+                final_result[stamp] = parsed_result
+            else:
+                parsed_result = None
+            trace_policy.end_stamp(stamp, parsed_result, run_stats)
+            final_stats[stamp] = dict(run_stats)
+        if pbar is not None:
+            pbar.set_postfix(wall=f"{run_stats['wall_time']:.2f}s", sim_end=f"{run_stats['sim_end_time']:.2f}s")
+    if session is not None:
+        session.close()
+    trace_policy.end_scenario()
+    if event_log is not None:
+        records = read_event_log(event_log)
+        records = records[np.argsort(records["run"], kind="stable")]
+        for stamp in int_stamps:
+            begin, end = np.searchsorted(records["run"], [stamp, stamp + 1])
+            final_result[stamp] = parse_events(records[begin:end], record_index_to_name)
+    return final_result, final_stats
+
+def _check_run_options(trace_policy, reuse_topology, batch_size):
+    if reuse_topology and trace_policy.mode != "none":
+        raise ValueError(f"A reused topology writes no packet capture, but the trace mode is {trace_policy.mode}.")
+    if batch_size > 1 and (reuse_topology or trace_policy.mode != "none"):
+        raise ValueError("The batched mode writes no packet capture and can't reuse a topology.")
+
+def _run_exp(root, total_size, packet_size, maxtime, folder, ns, skip = False, index = None, max_waypoint_error = None,
+             trace_policy = None, stream_events = False, reuse_topology = False, batch_size = 1):
+    '''
+    Simulate every time stamp of every scenario under root and save the results as comm_sim.json files.
+    \param float max_waypoint_error: if given, the waypoints of each vehicle are simplified with simplify_waypoints
+                                     before they are installed, with this max position error in metres.
+           TracePolicy trace_policy: decides which packet captures are written, defaults to a pcap per device and time stamp.
+           bool stream_events: if True, the events of every time stamp are appended to an EVENTS_FILENAME file of the
+                               scenario while they are simulated, and comm_sim.json is built from it once the scenario is done.
+           bool reuse_topology: if True, the topology of each scenario is built once and all its time stamps are simulated
+                                one after the other on it with a SimulationSession, instead of one simulate() call each.
+                                No packet capture is written, so trace_policy must be in the "none" mode.
+           int batch_size: if greater than 1, this many time stamps are simulated side by side in each Simulator run, on
+                           independent copies of the vehicles (see the batched mode of simulate). The random streams of
+                           every time stamp are fixed by its number, also when batch_size is 1, so the results don't depend
+                           on the batch size.
+                           No packet capture is written, and reuse_topology must be False.
+    '''
 
     filename = "comm_sim.json"
-    pbar = tqdm.tqdm(os.listdir(root))
+    if index is None:
+        index = DatasetIndex(root)
+    if trace_policy is None:
+        trace_policy = TracePolicy()
+    _check_run_options(trace_policy, reuse_topology, batch_size)
+    pbar = tqdm.tqdm(index.scenarios())
     for sub_dir_name in pbar:
         pbar.set_description(sub_dir_name)
-        sub_dir_path = os.path.join(root, sub_dir_name)
-        if os.path.isdir(sub_dir_path):
-            if skip and os.path.exists(os.path.join(folder, sub_dir_name, filename)):
-                continue
-            payloads, stamps = _read_payloads_waypoints(sub_dir_path)
-            int_stamps = [int(ele) for ele in stamps]
-            origin = min(int_stamps)
-
-            nodes_names = list(payloads.keys())
-            waypoints = [payloads[nodes_name] for nodes_name in nodes_names]
-
-            nNodes = len(nodes_names)
-            index_to_name = {key:value for key, value in zip(range(nNodes), nodes_names)}
-            packets, rate, total_attempt = _create_payloads_config(total_size, packet_size, maxtime, nNodes)
-            final_result = {}
-            for stamp in int_stamps:
-                start_time = (stamp - origin)*DELTA_TIME
-                result = simulate(nNodes = nNodes, payloads = packets, waypoints = waypoints, rate = rate, total_attempt=total_attempt, start_time = start_time, ns=ns, experiment_title=f"{total_size}_{packet_size}_{stamp}")
-                parsed_result = parse_results(result, index_to_name)
-                final_result[stamp] = parsed_result
+        if skip and os.path.exists(os.path.join(folder, sub_dir_name, filename)):
+            continue
+        nodes_names, waypoints, int_stamps = _load_scenario(index, sub_dir_name, max_waypoint_error, write=pbar.write)
+        event_log = os.path.join(folder, sub_dir_name, EVENTS_FILENAME) if stream_events else None
+        final_result, final_stats = _simulate_stamps(ns, nodes_names, waypoints, int_stamps, min(int_stamps), total_size, packet_size,
+                                                     maxtime, os.path.join(folder, sub_dir_name), trace_policy, event_log=event_log,
+                                                     reuse_topology=reuse_topology, batch_size=batch_size, pbar=pbar)
 
-            save_results(os.path.join(folder, sub_dir_name), final_result, filename)
+        save_results(os.path.join(folder, sub_dir_name), final_result, filename)
+        save_results(os.path.join(folder, sub_dir_name), final_stats, STATS_FILENAME)
 
 
-def simulate(nNodes = 5,
-    simStop = 100.,
-    payloads = ["Data 1","Data 2","Data 3","Data 4","Data 5"],
-    phymode = "OfdmRate6MbpsBW10MHz", verbose = False, waypoints=[], rate = 1, total_attempt = 10, start_time = 0., parsing_fn = None, ns=None, experiment_title="Experiement"):
-    '''
-    This is the method that construct scenarios based on given arguments, and return the information of interest.
-    \param int nNodes: nNodes decides how many node will be created in the simulation.
-           float simStop: simStop decides the max time that the simulator will simulate the experiment. Unit in seconds.
-           list payloads: paylodas is a list of strings. The strings will be sent to other node. The length of payloads should be the same as the nNodes.
-           list waypoints:  locations is a list of 3 floating point tuple (x,y,z). The x, y, and z defines the locations of the created nodes,
-                            the assignment of the (x,y,z) tuples will be in the same order of their appearance in the location list.
-    return dict: A dictionary with node ids as keys and their recieved message as values.
-    '''
-    assert len(payloads) == nNodes
+def _install_waypoint_mob(ns, node):
+    # Give the node a WaypointMobilityModel and return it.
+    mobility = ns.mobility.MobilityHelper()
+    mobility.SetMobilityModel("ns3::WaypointMobilityModel")
+    mobility.Install(node)
+    return node.GetObject["MobilityModel"]()
 
-    SUPPORTED_DATA_TYPE = {"Address":ns.core.AddressValue, "Boolean":ns.core.BooleanValue, "Box":ns.core.BoxValue, "Callback":ns.core.CallbackValue,\
-                        "DataRate":ns.core.DataRateValue, "Double":ns.core.DoubleValue,\
-                            "Empty":ns.core.EmptyAttributeValue, "Enum":ns.core.EnumValue, \
-                            "Integer":ns.core.IntegerValue,\
-                            "Ipv4Address":ns.core.Ipv4AddressValue, "Ipv4Mask":ns.core.Ipv4MaskValue, "Ipv6Address":ns.core.Ipv6AddressValue,\
-                            "Ipv6Prefix":ns.core.Ipv6PrefixValue, "Mac16Address":ns.core.Mac16AddressValue, "Mac48Address":ns.core.Mac48AddressValue,\
-                            "Mac64Address":ns.core.Mac64AddressValue, "ObjectFactory":ns.core.ObjectFactoryValue, "ObjectPtrContainer":ns.core.ObjectPtrContainerValue,\
-                            "OrganizationIdentifier":ns.core.OrganizationIdentifierValue, "Pointer":ns.core.PointerValue, "Rectangle":ns.core.RectangleValue,\
-                            "Ssid":ns.core.SsidValue, "String":ns.core.StringValue, "Time":ns.core.TimeValue, "TypeId":ns.core.TypeIdValue,\
-                            "UanModesList":ns.core.UanModesListValue, "Uinteger":ns.core.UintegerValue, "Vector2DValue":ns.core.Vector2DValue, "Vector3DValue":ns.core.Vector3DValue,\
-                            "WaypointValue":ns.core.WaypointValue, "WifiMode":ns.core.WifiModeValue, "Vector3D":ns.core.Vector3D, "Vector2D":ns.core.Vector2D,
-                            "Waypoint":ns.mobility.Waypoint, "Seconds":ns.core.Seconds}
-
-    def _install_waypoint_mob(node, waypoints_list:list):
-        mobility = ns.mobility.MobilityHelper()
-        mobility.SetMobilityModel("ns3::WaypointMobilityModel")
-        mobility.Install(node)
-        node_mob = node.GetObject["MobilityModel"]()
-
-        for time_stamp, waypoints in waypoints_list:
-            waypoint_vector = SUPPORTED_DATA_TYPE['Vector3D'](*waypoints)
-            time_stamp = SUPPORTED_DATA_TYPE['Seconds'](time_stamp)
-            # print(time_stamp, waypoint_vector)
-            waypoint_value = SUPPORTED_DATA_TYPE['Waypoint'](time_stamp, waypoint_vector)
-            node_mob.AddWaypoint(waypoint_value)
-
-    # Create nodes
-    nodes = ns.network.NodeContainer()
-    nodes.Create(nNodes)
-
-
-
-    # Create V2V topology
+def _add_waypoints(ns, node_mob, waypoints_list, offset = 0.):
+    # Add [time, [x, y, z]] rows or trajectory array rows to a WaypointMobilityModel, delayed by offset seconds.
+    for waypoint in waypoints_list:
+        if len(waypoint) == 2:
+            time_stamp, waypoints = waypoint # [time, [x, y, z]]
+        else:
+            time_stamp, waypoints = float(waypoint[0]), [float(ele) for ele in waypoint[1:4]] # row of a trajectory array
+        waypoint_vector = ns.core.Vector3D(*waypoints)
+        time_stamp = ns.core.Seconds(time_stamp + offset)
+        waypoint_value = ns.mobility.Waypoint(time_stamp, waypoint_vector)
+        node_mob.AddWaypoint(waypoint_value)
+
+def _create_v2v_devices(ns, nodes, phymode, verbose):
+    # Install 802.11p devices sharing one YansWifiChannel on the nodes.
     wifiPhy = ns.wifi.YansWifiPhyHelper()
     wifiChannel = ns.wifi.YansWifiChannelHelper.Default()
     channel = wifiChannel.Create()
@@ -177,40 +455,186 @@ def simulate(nNodes = 5,
 
     wifi80211p.SetRemoteStationManager("ns3::ConstantRateWifiManager","DataMode", ns.core.StringValue(phymode), "ControlMode", ns.core.StringValue(phymode))
     devices = wifi80211p.Install(wifiPhy, wifi80211pMac, nodes)
-    wifiPhy.EnablePcap ("wave-simple-80211p", devices)
-
-    for node_id in range(nNodes):
-        _install_waypoint_mob(nodes.Get(node_id), waypoints[node_id])
+    return wifiPhy, devices
 
+def _install_internet(ns, nodes, devices, ipAddrs = None):
     internet = ns.internet.InternetStackHelper()
     internet.Install (nodes)
 
-    ipAddrs = ns.internet.Ipv4AddressHelper()
-    ipAddrs.SetBase("192.168.0.0", "255.255.255.0")
-    cInterfaces=ipAddrs.Assign(devices)
+    if ipAddrs is None:
+        ipAddrs = ns.internet.Ipv4AddressHelper()
+        ipAddrs.SetBase("192.168.0.0", "255.255.255.0")
+    return ipAddrs.Assign(devices)
 
-    m_peerPort = 100
-    remote_address = ns.network.InetSocketAddress(ns.network.Ipv4Address.GetBroadcast(), m_peerPort)
+def _create_broadcast_helper(ns, payloads, rate, total_attempt, binary_header, max_off_time = MAX_OFF_TIME, port = 100):
+    # The helper of the UdpBroadCastApplications, one per payload, which wait up to max_off_time more than 1/rate between attempts.
+    remote_address = ns.network.InetSocketAddress(ns.network.Ipv4Address.GetBroadcast(), port)
     app = ns.applications.UdpBroadcastHelper(remote_address.ConvertTo())
     for i, payload in enumerate(payloads):
+        if binary_header:
+            app.SetData(payload) # Only the size of the payload is sent
+            continue
         string_i = str(i)
         if len(string_i) > len(payload):
             raise ValueError("Payload size is too small.")
         buffer = string_i + " " + payload[len(string_i)+1:]
         assert len(buffer) == len(payload)
         app.SetData(buffer)
+    app.SetAttribute("EnableBroadcastHeader", ns.core.BooleanValue(binary_header))
 
     app.SetAttribute("TotalAttempt", ns.core.UintegerValue(total_attempt))
     app.SetAttribute("SendRate", ns.core.DoubleValue(rate))
-    app.SetAttribute("Port", ns.core.UintegerValue(m_peerPort))
-    apps = app.Install(nodes)
-    apps.Start(ns.core.Seconds(start_time))
-    apps.Stop(ns.core.Seconds(simStop))
+    app.SetAttribute("OffTime", ns.core.StringValue(f"ns3::UniformRandomVariable[Min=0.0|Max={max_off_time}]"))
+    app.SetAttribute("Port", ns.core.UintegerValue(port))
+    return app
 
-    wifiPhy.EnablePcapAll(experiment_title)
+def _assign_streams(ns, app, nodes, devices, stream):
+    # Fix the random streams of the 802.11p devices, internet stacks and UdpBroadCastApplications of the nodes, from stream on.
+    # The default YansWifiChannel (log distance loss, constant speed delay) draws no random numbers.
+    first = stream
+    stream += ns.wifi.Wifi80211pHelper().AssignStreams(devices, stream)
+    stream += ns.internet.InternetStackHelper().AssignStreams(nodes, stream)
+    stream += app.AssignStreams(nodes, stream)
+    assert stream - first <= STREAMS_PER_RUN
+    return stream - first
+
+def _to_local_ids(events, first_id):
+    # Map the node ids of the events of a copy built from node first_id on back to 0..nNodes-1.
+    events["src"] = events["src"] - first_id
+    events["dst"] = np.where(events["dst"] == BROADCAST, events["dst"], events["dst"] - first_id).astype(events["dst"].dtype)
+    return events
+
+def simulate(nNodes = 5,
+    simStop = 100.,
+    payloads = ["Data 1","Data 2","Data 3","Data 4","Data 5"],
+    phymode = "OfdmRate6MbpsBW10MHz", verbose = False, waypoints=[], rate = 1, total_attempt = 10, start_time = 0., parsing_fn = None, ns=None, experiment_title="Experiement",
+    drain_time = None, run_stats = None, tracer = None, binary_header = False, return_events = False,
+    event_log = None, run_id = 0, start_times = None, run_ids = None, fixed_streams = False, max_off_time = MAX_OFF_TIME):
+    '''
+    This is the method that construct scenarios based on given arguments, and return the information of interest.
+    \param int nNodes: nNodes decides how many node will be created in the simulation.
+           float simStop: simStop decides the max time that the simulator will simulate the experiment. Unit in seconds.
+           list payloads: paylodas is a list of strings. The strings will be sent to other node. The length of payloads should be the same as the nNodes.
+           list waypoints:  locations is a list of 3 floating point tuple (x,y,z). The x, y, and z defines the locations of the created nodes,
+                            the assignment of the (x,y,z) tuples will be in the same order of their appearance in the location list.
+                            The waypoints of a node are either [time, [x, y, z]] rows or an (n, 4) array with columns time, x, y, z.
+           float drain_time: if given, only the waypoints that bracket start_time through the last possible transmission
+                             plus drain_time are installed. The results are the same as with the full trajectories as long
+                             as every frame is delivered or dropped within drain_time after the last transmission.
+                             The simulator also stops on its own once every application sent all its attempts and no
+                             packet was sent or received for drain_time, instead of running until simStop.
+                             The last possible transmission allows for SEND_MARGIN seconds of failed sends. Once past the
+                             installed waypoints, the vehicles stay at their last one.
+           dict run_stats: if given, it is filled with the wall time of the run ("wall_time"), the simulated end time
+                           ("sim_end_time") and whether the simulator stopped before simStop ("stopped_early").
+           TracePolicy tracer: decides which packet captures are written, defaults to a pcap per device in the working
+                               directory. The consolidated and ring modes are collected by tracer.end_stamp after this returns.
+           bool binary_header: if True, the packets carry a binary header with the sender node id, attempt number and tx time
+                               followed by a zero-filled payload of the same total size, instead of the payload text.
+                               The results are the same, but no payload string is built for each transmission.
+           bool return_events: if True, the applications keep no text records, and the typed records of all nodes are
+                               returned instead as a dictionary with the EVENT_FIELDS names as keys and numpy arrays as
+                               values (see parse_events). parsing_fn is not applied.
+           str event_log: if given, the applications keep no records, and the events are appended to this file as
+                          fixed-size EVENT_RECORD_DTYPE records while the simulation runs (see read_event_log).
+                          The number of records written is returned instead of the results.
+           int run_id: the run id written in the records of event_log, to tell the runs sharing a file apart.
+           list start_times: if given, the batched mode: one copy of the nodes is built for each of these start times, each on
+                             its own YansWifiChannel and subnet, and all of them are simulated in a single Simulator run.
+                             start_time is ignored, no packet capture is written, and return_events or event_log must be set.
+                             A list with the events of each start time is returned with return_events, with the node ids of
+                             the copy mapped back to 0..nNodes-1. The records of event_log keep the global node ids of the
+                             copies, whose node id modulo nNodes is the index of the vehicle.
+           list run_ids: the run ids of the start times in the batched mode, written in the records of event_log.
+                         The random streams of each copy are assigned from its run id (see fixed_streams). Defaults to 0..K-1.
+           bool fixed_streams: if True, the random streams of the devices, stacks and applications are assigned from
+                               run_id*STREAMS_PER_RUN, as in the batched mode, so a time stamp gives the same results whether
+                               it is simulated alone or in a batch. Always done in the batched mode.
+           float max_off_time: the Max of the uniform OffTime of the applications, the random delay they add to 1/rate
+                               before each attempt.
+    return dict: A dictionary with node ids as keys and their recieved message as values.
+    '''
+    assert len(payloads) == nNodes
+
+    batched = start_times is not None
+    if batched:
+        if not return_events and event_log is None:
+            raise ValueError("The batched mode returns events, set return_events or event_log.")
+        if tracer is not None and tracer.mode != "none":
+            raise ValueError(f"The batched mode writes no packet capture, but the trace mode is {tracer.mode}.")
+        if run_ids is None:
+            run_ids = list(range(len(start_times)))
+        assert len(run_ids) == len(start_times)
+    else:
+        start_times, run_ids = [start_time], [run_id]
+
+    app = _create_broadcast_helper(ns, payloads, rate, total_attempt, binary_header, max_off_time)
+    app.SetAttribute("LogResultStrings", ns.core.BooleanValue(not return_events and event_log is None))
+    app.SetAttribute("KeepEvents", ns.core.BooleanValue(event_log is None))
+    ipAddrs = ns.internet.Ipv4AddressHelper()
+    ipAddrs.SetBase("192.168.0.0", "255.255.255.0")
+    all_apps = ns.network.ApplicationContainer()
+    copies = []
+    # One copy of the vehicles per start time, each on its own channel and subnet
+    for copy_start, copy_run_id in zip(start_times, run_ids):
+        # Create nodes
+        nodes = ns.network.NodeContainer()
+        nodes.Create(nNodes)
+
+        # Create V2V topology
+        wifiPhy, devices = _create_v2v_devices(ns, nodes, phymode, verbose)
+
+        for node_id in range(nNodes):
+            node_waypoints = waypoints[node_id]
+            if drain_time is not None:
+                node_waypoints = _window_waypoints(node_waypoints, *_active_window(copy_start, rate, total_attempt, drain_time,
+                                                                                       max_off_time))
+            _add_waypoints(ns, _install_waypoint_mob(ns, nodes.Get(node_id)), node_waypoints)
+
+        _install_internet(ns, nodes, devices, ipAddrs)
+        ipAddrs.NewNetwork()
+
+        apps = app.Install(nodes)
+        apps.Start(ns.core.Seconds(copy_start))
+        apps.Stop(ns.core.Seconds(simStop))
+        if fixed_streams or batched:
+            _assign_streams(ns, app, nodes, devices, copy_run_id*STREAMS_PER_RUN)
+        all_apps.Add(apps)
+        copies.append((nodes.Get(0).GetId(), apps))
+
+    if not batched:
+        if tracer is None:
+            tracer = TracePolicy()
+        tracer.enable(wifiPhy, devices, experiment_title)
+
+    if drain_time is not None:
+        auto_stop = app.EnableAutoStop(all_apps, ns.core.Seconds(drain_time))
+    if event_log is not None:
+        event_sink = app.EnableEventSink(copies[0][1], event_log, run_ids[0])
+        for (_, apps), copy_run_id in zip(copies[1:], run_ids[1:]):
+            app.EnableEventSink(apps, event_sink, copy_run_id)
 
     ns.core.Simulator.Stop(ns.core.Seconds(simStop))
+    wall_start = time.perf_counter()
     ns.core.Simulator.Run()
+    if run_stats is not None:
+        run_stats["wall_time"] = time.perf_counter() - wall_start
+        run_stats["sim_end_time"] = ns.core.Simulator.Now().GetSeconds()
+        run_stats["stopped_early"] = drain_time is not None and bool(auto_stop.IsStopped())
+    if event_log is not None:
+        event_sink.Close()
+        n_records = int(event_sink.GetNRecords())
+        ns.core.Simulator.Destroy()
+        return n_records
+    if return_events:
+        results = []
+        for first_id, apps in copies:
+            logs = [apps.Get(i).GetEvents() for i in range(nNodes)]
+            events = {name: np.concatenate([_vector_to_array(getattr(log, getter)(), dtype) for log in logs])
+                      for name, getter, dtype in EVENT_FIELDS}
+            results.append(_to_local_ids(events, first_id))
+        ns.core.Simulator.Destroy()
+        return results if batched else results[0]
     result = {}
     for i in range(nNodes):
         app = apps.Get(i)
@@ -225,6 +649,101 @@ def simulate(nNodes = 5,
         parsed_result = parsing_fn(parsed_result)
     return parsed_result
 
+class SimulationSession():
+    '''
+    The nodes, 802.11p devices, internet stacks and applications of one scenario, built once and reused for all its time stamps.
+    Each run restarts the applications on the same simulator timeline after the previous run stopped. The waypoints of the active
+    window of a time stamp are appended to the mobility models, delayed by the time offset of the run, and the applications report
+    their records relative to that offset, so the results have the same format and time origin as those of simulate.
+    The random draws of the applications and the MAC continue from one run to the next, so the results are statistically equivalent to
+    simulate() rather than identical to it. No packet capture is written.
+    \param int nNodes, list payloads, list waypoints, float rate, int total_attempt, str phymode, bool verbose, bool binary_header,
+           float simStop, float max_off_time: as in simulate, with simStop relative to the start time of each run.
+           float drain_time: the time in seconds without any packet before a run is stopped.
+           str event_log: if given, the events of every run are appended to this file with the run id given to run
+                          (see simulate and read_event_log).
+    '''
+    GAP = 1. # The time in second between the end of a run and the first waypoint of the next one
+
+    def __init__(self, ns, nNodes, payloads, waypoints, rate, total_attempt, phymode = "OfdmRate6MbpsBW10MHz", verbose = False,
+                 binary_header = True, simStop = 100., drain_time = DRAIN_TIME, event_log = None, max_off_time = MAX_OFF_TIME) -> None:
+        assert len(payloads) == nNodes
+        self.ns = ns
+        self.nNodes = nNodes
+        self.waypoints = waypoints
+        self.rate = rate
+        self.total_attempt = total_attempt
+        self.simStop = simStop
+        self.drain_time = drain_time
+        self.event_log = event_log
+        self.max_off_time = max_off_time
+
+        self.nodes = ns.network.NodeContainer()
+        self.nodes.Create(nNodes)
+        self.wifiPhy, self.devices = _create_v2v_devices(ns, self.nodes, phymode, verbose)
+        self.mobility = [_install_waypoint_mob(ns, self.nodes.Get(node_id)) for node_id in range(nNodes)]
+        _install_internet(ns, self.nodes, self.devices)
+
+        app = _create_broadcast_helper(ns, payloads, rate, total_attempt, binary_header, max_off_time)
+        app.SetAttribute("LogResultStrings", ns.core.BooleanValue(False))
+        app.SetAttribute("KeepEvents", ns.core.BooleanValue(event_log is None))
+        self.apps = app.Install(self.nodes)
+        self.auto_stop = app.EnableAutoStop(self.apps, ns.core.Seconds(drain_time))
+        self.event_sink = app.EnableEventSink(self.apps, event_log, 0) if event_log is not None else None
+        self._last_waypoint = 0. # The time of the last waypoint installed, on the simulator timeline
+        self._started = False
+
+    def run(self, start_time, run_stats = None, run_id = 0):
+        '''
+        Simulate the broadcasts of one time stamp.
+        \param float start_time: the start time of the applications in the trajectories, as given to simulate.
+               dict run_stats: if given, it is filled as by simulate, with the simulated end time relative to the run.
+               int run_id: the run id written in the records of event_log.
+        return: the events as returned by simulate with return_events, or the number of records written to event_log.
+        '''
+        ns = self.ns
+        begin, end = _active_window(start_time, self.rate, self.total_attempt, self.drain_time, self.max_off_time)
+        windows = [_window_waypoints(node_waypoints, begin, end) for node_waypoints in self.waypoints]
+        first = min((float(window[0][0]) for window in windows if len(window)), default=start_time)
+        now = ns.core.Simulator.Now().GetSeconds()
+        earliest = max(now, self._last_waypoint) + self.GAP if self._started else now
+        offset = max(earliest - first, 0.) # The waypoints and applications of the run are delayed by offset
+        for node_mob, window in zip(self.mobility, windows):
+            _add_waypoints(ns, node_mob, window, offset)
+            if len(window):
+                self._last_waypoint = max(self._last_waypoint, float(window[-1][0]) + offset)
+
+        delay = ns.core.Seconds(start_time + offset - now)
+        for i in range(self.nNodes):
+            app = self.apps.Get(i)
+            app.SetAttribute("TimeOffset", ns.core.TimeValue(ns.core.Seconds(offset)))
+            if self._started:
+                app.Restart(delay)
+        if not self._started:
+            self.apps.Start(delay)
+            self._started = True
+        self.auto_stop.Reset(ns.core.Seconds(self.simStop + offset - now))
+        if self.event_sink is not None:
+            self.event_sink.SetRunId(run_id)
+            n_records = int(self.event_sink.GetNRecords())
+
+        wall_start = time.perf_counter()
+        ns.core.Simulator.Run()
+        if run_stats is not None:
+            run_stats["wall_time"] = time.perf_counter() - wall_start
+            run_stats["sim_end_time"] = ns.core.Simulator.Now().GetSeconds() - offset
+            run_stats["stopped_early"] = bool(self.auto_stop.IsStopped())
+        if self.event_sink is not None:
+            return int(self.event_sink.GetNRecords()) - n_records
+        logs = [self.apps.Get(i).GetEvents() for i in range(self.nNodes)]
+        return {name: np.concatenate([_vector_to_array(getattr(log, getter)(), dtype) for log in logs])
+                for name, getter, dtype in EVENT_FIELDS}
+
+    def close(self):
+        if self.event_sink is not None:
+            self.event_sink.Close()
+        self.ns.core.Simulator.Destroy()
+
 def reading_dummy_data(filename, n_row = 5, select_index = [1,2,3,10], toString=True):
     import csv
     import json
@@ -246,58 +765,411 @@ def reading_dummy_data(filename, n_row = 5, select_index = [1,2,3,10], toString=
         result = [json.dumps(ele) for ele in result]
     return result
 
-import time
+import resource
 import multiprocessing
+import multiprocessing.connection
+
+def _run_job(method, args, usage_writer):
+    # The body of a job process: run the job, then send its peak resident memory to the queue before exiting.
+    try:
+        method(*args)
+    finally:
+        usage_writer.send(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)
+        usage_writer.close()
 
 class ProcessQueue():
-    def __init__(self, max_alive = 8, sleep_time = 10) -> None:
-        self.processes = []
-        self.jobs = []
+    '''
+    Run jobs in at most max_alive processes at a time, in the order they were appended.
+    The queue waits on the sentinels of its processes, so a job is reaped and the next one started as soon as a process exits.
+    The exit code, wall time and peak resident memory of every attempt are recorded. The peak memory is sent by the process
+    when the job returns or raises, and is None if the process was killed or crashed before. A job that exits with a non-zero code
+    (e.g., after an NS_FATAL_ERROR) is started again after backoff*2**(failures-1) seconds, at most max_backoff seconds, where
+    failures counts its consecutive failed attempts, at most max_retries times.
+    \param int max_alive: the max number of processes running at the same time.
+           int max_retries: the max number of times a failed job is started again.
+           float backoff: the delay in seconds before the first retry of a job, doubled on each further consecutive failure.
+           float max_backoff: the max delay in seconds before a retry.
+           callable on_exit: if given, called with the record of each attempt when its process exits.
+    '''
+    def __init__(self, max_alive = 8, max_retries = 2, backoff = 5., max_backoff = 300., on_exit = None) -> None:
+        self.jobs = collections.deque()
+        self.running = {} # sentinel -> (process, usage reader, record, job)
+        self.delayed = [] # (start time, job) of the jobs waiting for a retry
+        self.records = []
         self.max_num_process = max_alive
-        self.sleep_time = sleep_time
-        self.alive = -1
-
-    def append_job(self, method, args):
-        self.jobs.append((method, args))
-
-    def _start_job(self):
-        if self.jobs:
-            target, args = self.jobs.pop()
-            process_instance = multiprocessing.Process(target=target, args=args)
-            process_instance.start()
-            self.processes.append(process_instance)
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.on_exit = on_exit
+        self.readers = {}
 
+    def append_job(self, method, args, name = None):
+        self.jobs.append({"name": name if name is not None else f"{method.__name__} {len(self.jobs) + len(self.records)}",
+                          "method": method, "args": args, "attempt": 0, "failures": 0})
 
+    def add_reader(self, connection, callback):
+        '''Call callback with every object received on connection while the queue runs.'''
+        self.readers[connection] = callback
 
-    def _monitor(self):
-        new_process_list = []
-        for process_instance in self.processes:
-            if process_instance.is_alive():
-                new_process_list.append(process_instance)
+    def retry_delay(self, failures):
+        '''The delay in seconds before the retry that follows the given number of consecutive failures.'''
+        return min(self.backoff*2**(failures - 1), self.max_backoff)
 
-        new_process_pids = [ele.pid for ele in new_process_list]
-        for process_instance in self.processes:
-            process_pid = process_instance.pid
-            if process_pid not in new_process_pids:
-                process_instance.join()
-                process_instance.close()
+    def reset_failures(self, pid):
+        '''Forget the past failures of the job running in process pid, e.g., when it made progress, so its next retry is not delayed longer.'''
+        for process_instance, _, _, job in self.running.values():
+            if process_instance.pid == pid:
+                job["failures"] = 0
 
-        self.processes = new_process_list
+    def _start_job(self, job):
+        job["attempt"] += 1
+        usage_reader, usage_writer = multiprocessing.Pipe(duplex=False)
+        process_instance = multiprocessing.Process(target=_run_job, args=(job["method"], job["args"], usage_writer))
+        process_instance.start()
+        usage_writer.close()
+        record = {"name": job["name"], "attempt": job["attempt"], "pid": process_instance.pid, "exit_code": None,
+                  "wall_time": None, "max_rss_mb": None, "start": time.perf_counter()}
+        self.running[process_instance.sentinel] = (process_instance, usage_reader, record, job)
 
-        while self.jobs and len(new_process_list) < self.max_num_process:
-            self._start_job()
+    def _reap(self, sentinel):
+        process_instance, usage_reader, record, job = self.running.pop(sentinel)
+        # The process may already have been reaped by multiprocessing itself, e.g., when the next process is started,
+        # which join handles, so the exit code is never read from the pid.
+        process_instance.join()
+        exit_code = process_instance.exitcode
+        process_instance.close()
+        try:
+            max_rss = usage_reader.recv() if usage_reader.poll() else None
+        except EOFError: # the process died without sending it
+            max_rss = None
+        usage_reader.close()
+        record["exit_code"] = exit_code
+        record["wall_time"] = time.perf_counter() - record.pop("start")
+        record["max_rss_mb"] = max_rss/1024 if max_rss is not None else None # ru_maxrss is in kB on Linux
+        self.records.append(record)
+        job["failures"] = job["failures"] + 1 if exit_code != 0 else 0
+        if exit_code != 0 and job["attempt"] <= self.max_retries:
+            delay = self.retry_delay(job["failures"])
+            print(f"{job['name']} exited with code {exit_code}, retrying in {delay:.0f}s")
+            self.delayed.append((time.perf_counter() + delay, job))
+        if self.on_exit is not None:
+            self.on_exit(record)
 
-        self.alive = len(self.processes)
-        print(f"Currently {self.alive} process alive, {len(self.jobs)} jobs remaining", end='\r')
-        time.sleep(self.sleep_time)
+    def _fill(self):
+        now = time.perf_counter()
+        ready = [job for start, job in self.delayed if start <= now]
+        self.delayed = [(start, job) for start, job in self.delayed if start > now]
+        self.jobs.extendleft(reversed(ready))
+        while self.jobs and len(self.running) < self.max_num_process:
+            self._start_job(self.jobs.popleft())
 
     def start(self):
+        '''Run the jobs until all of them succeeded or ran out of retries, print a summary and return the records.'''
         print("started")
-        while self.alive != 0:
-            self._monitor()
+        self._fill()
+        while self.running or self.delayed:
+            timeout = max(min(start for start, _ in self.delayed) - time.perf_counter(), 0.) if self.delayed else None
+            ready = multiprocessing.connection.wait(list(self.running) + list(self.readers), timeout)
+            # Read the messages first, as those sent by a process before it exited are ready with its sentinel
+            for connection in [ele for ele in ready if ele in self.readers]:
+                while connection.poll():
+                    self.readers[connection](connection.recv())
+            exited = [ele for ele in ready if ele in self.running]
+            for sentinel in exited:
+                self._reap(sentinel)
+            self._fill()
+            if exited:
+                print(f"Currently {len(self.running)} process alive, {len(self.jobs) + len(self.delayed)} jobs remaining", end='\r')
+        self.print_summary()
+        return self.records
+
+    def print_summary(self):
+        print(f"\n{'job':<40} {'attempt':>7} {'exit':>5} {'wall (s)':>10} {'peak RSS (MB)':>14}")
+        for record in self.records:
+            max_rss = f"{record['max_rss_mb']:.1f}" if record["max_rss_mb"] is not None else "-"
+            print(f"{record['name']:<40} {record['attempt']:>7} {record['exit_code']:>5} {record['wall_time']:>10.1f} {max_rss:>14}")
+        failed = {record["name"] for record in self.records if record["exit_code"] != 0} - \
+                 {record["name"] for record in self.records if record["exit_code"] == 0}
+        if failed:
+            print(f"{len(failed)} jobs failed after {self.max_retries} retries: {', '.join(sorted(failed))}")
+
+
+WorkUnit = collections.namedtuple("WorkUnit", ["root", "total_size", "packet_size", "maxtime", "save_dir", "scenario", "stamps", "origin",
+                                               "n_nodes"])
+
+def make_work_units(root, total_size, packet_size, maxtime, save_dir, chunk_size = 50, skip = False):
+    '''
+    Split the simulation of a dataset split under one configuration into work units of at most chunk_size time stamps.
+    \param int chunk_size: the max number of time stamps of a work unit.
+           bool skip: if True, the time stamps already saved in the comm_sim.json file of a scenario, or in its part files,
+                      are left out.
+    return list: the WorkUnits, scenario by scenario.
+    '''
+    units = []
+    with DatasetIndex(root) as index:
+        for scenario in index.scenarios():
+            agents = index.agents(scenario)
+            if not agents:
+                continue
+            stamps = sorted(int(ele) for ele in index.stamps(scenario, agents[-1]))
+            if not stamps:
+                continue
+            origin = stamps[0]
+            if skip:
+                folder = os.path.join(save_dir, scenario)
+                done_paths = [os.path.join(folder, COMM_SIM_FILENAME)] + _part_paths(folder, COMM_SIM_FILENAME)
+                done = set(int(key) for path in done_paths if os.path.exists(path) for key, _ in json_backend.iter_items(path))
+                stamps = [stamp for stamp in stamps if stamp not in done]
+            for first in range(0, len(stamps), chunk_size):
+                units.append(WorkUnit(root, total_size, packet_size, maxtime, save_dir, scenario, stamps[first:first+chunk_size], origin,
+                                      len(agents)))
+    return units
+
+class CostModel():
+    '''
+    Estimate the wall time of work units from cheap metadata: the number of vehicles n, the number of time stamps and the
+    total_attempt of _create_payloads_config. The wall time of a time stamp is modelled as
+    c0 + c1*total_attempt*n + c2*total_attempt*n**2, i.e., a fixed cost, the transmissions and their receptions.
+    \param list coefficients: c0, c1 and c2. The defaults only rank the units, until the model is calibrated.
+    '''
+    DEFAULT_COEFFICIENTS = [1., 0., 1e-3]
+
+    def __init__(self, coefficients = None) -> None:
+        self.coefficients = np.array(coefficients if coefficients is not None else self.DEFAULT_COEFFICIENTS, dtype=float)
+        self.n_samples = 0
+
+    @staticmethod
+    def _features(n_nodes, total_attempt):
+        n_nodes = np.asarray(n_nodes, dtype=float)
+        total_attempt = np.asarray(total_attempt, dtype=float)
+        return np.stack([np.ones_like(n_nodes), total_attempt*n_nodes, total_attempt*n_nodes**2], axis=-1)
+
+    def fit(self, n_nodes, total_attempt, wall_time):
+        '''
+        Fit the coefficients to measured wall times per time stamp by non-negative least squares.
+        \param n_nodes, total_attempt, wall_time: arrays with one entry per sample.
+        return CostModel: this model.
+        '''
+        features = self._features(n_nodes, total_attempt)
+        wall_time = np.asarray(wall_time, dtype=float)
+        if len(wall_time) == 0:
+            return self
+        active = list(range(features.shape[1]))
+        while active:
+            solution, *_ = np.linalg.lstsq(features[:, active], wall_time, rcond=None)
+            if (solution >= 0).all():
+                break
+            active.pop(int(np.argmin(solution))) # drop the most negative term and fit again
+        self.coefficients = np.zeros(features.shape[1])
+        self.coefficients[active] = solution if active else 0.
+        self.n_samples = len(wall_time)
+        return self
+
+    @classmethod
+    def calibrate(cls, units):
+        '''
+        Build a model fitted to the STATS_FILENAME files that past runs left in the scenario folders of the units.
+        The median wall time of each (vehicle count, total_attempt) pair is used as one sample.
+        return CostModel: the fitted model, or the default one if no past run was found.
+        '''
+        samples = collections.defaultdict(list)
+        for save_dir, scenario, total_size, packet_size, maxtime, n_nodes in \
+                {(unit.save_dir, unit.scenario, unit.total_size, unit.packet_size, unit.maxtime, unit.n_nodes) for unit in units}:
+            path = os.path.join(save_dir, scenario, STATS_FILENAME)
+            if not os.path.exists(path):
+                continue
+            with open(path, "r") as fp:
+                stats = json.load(fp)
+            _, _, total_attempt = _create_payloads_config(total_size, packet_size, maxtime, n_nodes)
+            samples[(n_nodes, total_attempt)] += [ele["wall_time"] for ele in stats.values()]
+        keys = list(samples)
+        model = cls()
+        return model.fit([key[0] for key in keys], [key[1] for key in keys], [np.median(samples[key]) for key in keys])
+
+    def estimate(self, unit):
+        '''return float: the estimated wall time in seconds of a WorkUnit.'''
+        _, _, total_attempt = _create_payloads_config(unit.total_size, unit.packet_size, unit.maxtime, unit.n_nodes)
+        return len(unit.stamps)*float(self._features(unit.n_nodes, total_attempt) @ self.coefficients)
+
+def order_units(units, cost_model = None, n_workers = 6):
+    '''
+    Order work units longest first (LPT), which keeps the makespan of n_workers greedy workers within 4/3 of the optimum.
+    \param CostModel cost_model: defaults to a model calibrated on the past runs of the units.
+    return: the ordered units, and the makespan in seconds predicted for n_workers workers taking them in this order.
+    '''
+    if cost_model is None:
+        cost_model = CostModel.calibrate(units)
+    costs = [cost_model.estimate(unit) for unit in units]
+    order = sorted(range(len(units)), key=lambda i: costs[i], reverse=True)
+    loads = [0.]*n_workers
+    for i in order:
+        heapq.heapreplace(loads, loads[0] + costs[i]) # the least loaded worker takes the next unit
+    return [units[i] for i in order], max(loads)
+
+def run_work_unit(ns, unit, index = None, max_waypoint_error = None, trace_policy = None, stream_events = False,
+                  reuse_topology = False, batch_size = 1):
+    '''
+    Simulate the time stamps of a work unit and save the results as part files of its scenario (see save_part), which
+    merge_parts adds to the comm_sim.json and STATS_FILENAME files of the scenario once all its units are done.
+    The options are those of _run_exp. With stream_events, the events are written to a file of the unit in the scenario folder,
+    which is removed once its results are saved. In the consolidated trace mode, the capture of the unit is saved as a part file
+    as well, and in the ring mode, the ring of the unit starts empty.
+    return int: the number of time stamps simulated.
+    '''
+    if trace_policy is None:
+        trace_policy = TracePolicy()
+    _check_run_options(trace_policy, reuse_topology, batch_size)
+    if index is None:
+        index = DatasetIndex(unit.root, refresh=False)
+    nodes_names, waypoints, int_stamps = _load_scenario(index, unit.scenario, max_waypoint_error)
+    folder = os.path.join(unit.save_dir, unit.scenario)
+    event_log = os.path.join(folder, f"{unit.stamps[0]}_{EVENTS_FILENAME}") if stream_events else None
+    final_result, final_stats = _simulate_stamps(ns, nodes_names, waypoints, unit.stamps, unit.origin, unit.total_size, unit.packet_size,
+                                                 unit.maxtime, folder, trace_policy, event_log=event_log,
+                                                 reuse_topology=reuse_topology, batch_size=batch_size, part=unit.stamps[0],
+                                                 all_stamps=sorted(int_stamps))
+    save_part(folder, unit.stamps[0], final_result, COMM_SIM_FILENAME)
+    save_part(folder, unit.stamps[0], final_stats, STATS_FILENAME)
+    if event_log is not None:
+        os.remove(event_log)
+    return len(unit.stamps)
+
+def _work_unit_worker(unit_queue, messages, lock, options):
+    # Import ns-3 once, then pull work units until the None sentinel, and report on messages when each unit starts and ends.
+    import_start = time.perf_counter()
+    from ns import ns
+    import_time = time.perf_counter() - import_start
+    indexes = {}
+    pid = os.getpid()
+    with lock:
+        messages.send(("ready", pid, import_time))
+    while True:
+        wait_start = time.perf_counter()
+        item = unit_queue.get()
+        dispatch_time = time.perf_counter() - wait_start
+        if item is None:
+            break
+        unit_id, unit = item
+        if unit.root not in indexes:
+            indexes[unit.root] = DatasetIndex(unit.root, refresh=False)
+        with lock:
+            messages.send(("start", pid, unit_id, dispatch_time))
+        wall_start = time.perf_counter()
+        try:
+            n_stamps = run_work_unit(ns, unit, index=indexes[unit.root], **options)
+        except Exception as error:
+            with lock:
+                messages.send(("failed", pid, unit_id, repr(error)))
+            continue
+        with lock:
+            messages.send(("done", pid, unit_id, n_stamps, time.perf_counter() - wall_start))
+
+def run_work_units(units, n_workers = 6, max_retries = 2, backoff = 5., max_backoff = 300., preload = False, **options):
+    '''
+    Simulate work units with n_workers processes that pull them one by one from a shared queue, so a process that is done
+    with a short unit takes the next one while the others are still busy, until the last unit.
+    The workers are supervised by a ProcessQueue: a worker that dies (e.g., on an NS_FATAL_ERROR) is started again. The unit it
+    was simulating, or a unit that raised an exception, is put back in the queue after the same backoff as a ProcessQueue job,
+    at most max_retries times per unit.
+    Each worker imports ns-3 once and then serves units until the end of the sweep, so a unit only costs a message on the queue.
+    The part files of a scenario are merged into its results files by this process, once its last unit is done.
+    The import time of each worker and the time it waited for its units are printed at the end.
+    \param list units: the WorkUnits, e.g., from make_work_units, in the order they are taken.
+           int max_retries, float backoff, float max_backoff: as in ProcessQueue.
+           bool preload: if True, ns-3 is imported in this process before the workers are forked, so they start with the
+                         bindings already loaded, including the workers started again after a crash.
+           options: the options of run_work_unit.
+    return list: the units that failed max_retries + 1 times.
+    '''
+    unit_queue = multiprocessing.Queue()
+    reader, writer = multiprocessing.Pipe(duplex=False)
+    lock = multiprocessing.Lock()
+    for unit_id, unit in enumerate(units):
+        unit_queue.put((unit_id, unit))
+    in_flight = {} # worker pid -> unit id
+    worker_stats = {} # worker pid -> import time, units, busy and dispatch times
+    attempts = collections.Counter()
+    remaining = collections.Counter(os.path.join(unit.save_dir, unit.scenario) for unit in units) # units not done per scenario
+    finished = set()
+    failed = set()
+    pbar = tqdm.tqdm(total=sum(len(unit.stamps) for unit in units), unit="stamp")
+    timers = [] # the retries of units waiting for their backoff
+    # Every crash of a worker is charged to the retries of its unit, so the workers themselves are always restarted
+    supervisor = ProcessQueue(max_alive=n_workers, max_retries=len(units)*(max_retries + 1), backoff=backoff, max_backoff=max_backoff)
+
+    def _unit_over(unit_id):
+        # Merge the parts of a scenario once, when its last unit succeeded or ran out of retries
+        folder = os.path.join(units[unit_id].save_dir, units[unit_id].scenario)
+        remaining[folder] -= 1
+        if remaining[folder] == 0:
+            merge_parts(folder)
+
+    def _close_if_done():
+        if len(finished) + len(failed) == len(units):
+            for _ in range(n_workers):
+                unit_queue.put(None)
+
+    def _retry(unit_id, reason):
+        unit = units[unit_id]
+        if attempts[unit_id] <= max_retries:
+            timer = threading.Timer(supervisor.retry_delay(attempts[unit_id]), unit_queue.put, args=((unit_id, unit),))
+            timer.daemon = True
+            timer.start()
+            timers.append(timer)
+            return
+        failed.add(unit_id)
+        _unit_over(unit_id)
+        pbar.write(f"Gave up on {unit.scenario} stamps {unit.stamps[0]}-{unit.stamps[-1]} of {unit.save_dir}: {reason}")
+        _close_if_done()
 
+    def _on_message(message):
+        if message[0] == "ready":
+            _, pid, import_time = message
+            worker_stats[pid] = {"import": import_time, "units": 0, "busy": 0., "dispatch": 0.}
+        elif message[0] == "start":
+            _, pid, unit_id, dispatch_time = message
+            in_flight[pid] = unit_id
+            attempts[unit_id] += 1
+            worker_stats[pid]["dispatch"] += dispatch_time
+        elif message[0] == "failed":
+            _, pid, unit_id, error = message
+            in_flight.pop(pid, None)
+            _retry(unit_id, error)
+        else:
+            _, pid, unit_id, n_stamps, wall_time = message
+            in_flight.pop(pid, None)
+            finished.add(unit_id)
+            supervisor.reset_failures(pid)
+            _unit_over(unit_id)
+            worker_stats[pid]["units"] += 1
+            worker_stats[pid]["busy"] += wall_time
+            pbar.update(n_stamps)
+            pbar.set_postfix(scenario=units[unit_id].scenario, unit_wall=f"{wall_time:.1f}s")
+            _close_if_done()
 
+    def _on_exit(record):
+        unit_id = in_flight.pop(record["pid"], None)
+        if unit_id is not None:
+            _retry(unit_id, f"the worker exited with code {record['exit_code']}")
 
+    _close_if_done() # nothing to do
+    supervisor.on_exit = _on_exit
+    supervisor.add_reader(reader, _on_message)
+    for i in range(n_workers):
+        supervisor.append_job(_work_unit_worker, (unit_queue, writer, lock, options), name=f"worker {i}")
+    if preload:
+        from ns import ns # the forked workers find the bindings in sys.modules
+    supervisor.start()
+    for timer in timers:
+        timer.cancel()
+    for folder in remaining: # the scenarios whose units did not all report back, e.g., when the workers gave up
+        merge_parts(folder)
+    pbar.close()
+    print(f"{'worker pid':>10} {'import (s)':>10} {'units':>6} {'busy (s)':>10} {'dispatch (ms/unit)':>19}")
+    for pid, stats in worker_stats.items():
+        print(f"{pid:>10} {stats['import']:>10.2f} {stats['units']:>6} {stats['busy']:>10.1f} "
+              f"{1e3*stats['dispatch']/max(stats['units'], 1):>19.2f}")
+    return [units[unit_id] for unit_id in sorted(failed)]
 
 
 if __name__ == "__main__":
@@ -307,9 +1179,15 @@ if __name__ == "__main__":
     valid_root = "/home/cps-tingcong/Downloads/opencood_validate/validate"
 
     maxtime = 0.1 # max retry time
+    max_waypoint_error = None # max position error in metres when simplifying waypoints, None installs every waypoint
+    trace_policy = TracePolicy("none") # no packet capture, see TracePolicy for the sampled, consolidated and ring modes, which work per unit
+    stream_events = True # append the events to a file of each scenario while simulating, instead of keeping them in memory
+    reuse_topology = True # build the topology once per scenario and simulate its time stamps one after the other on it
+    batch_size = 1 # the number of time stamps simulated side by side in one Simulator run, when reuse_topology is False
     roots = [train_root, test_root, valid_root]
 
-    process_queue = ProcessQueue(max_alive=6, sleep_time=0.1)
+    chunk_size = 50 # the max number of time stamps of a work unit
+    units = []
 
     # total_size unit in bytes
     # packet_size unit in bytes
@@ -327,6 +1205,10 @@ if __name__ == "__main__":
                 save_dir_valid = f"/home/cps-tingcong/Downloads/opencood_validate/comm_sim/{format(total_size, '.0e')}_{format(packet_size, '.0e')}_{format(maxtime, '.0e')}"
                 save_roots = [save_dir_train, save_dir_test, save_dir_valid]
                 for root, save_dir in zip(roots, save_roots):
-                    process_queue.append_job(main, (root, total_size, packet_size, maxtime, save_dir))
+                    units += make_work_units(root, total_size, packet_size, maxtime, save_dir, chunk_size=chunk_size)
 
-    process_queue.start()
\ No newline at end of file
+    # The longest units first, with the costs calibrated on the comm_sim_stats.json files of past runs
+    units, makespan = order_units(units, n_workers=6)
+    print(f"{len(units)} work units, predicted makespan {makespan/3600:.1f} h")
+    run_work_units(units, n_workers=6, max_waypoint_error=max_waypoint_error, trace_policy=trace_policy, stream_events=stream_events,
+                   reuse_topology=reuse_topology, batch_size=batch_size)
\ No newline at end of file
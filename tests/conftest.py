@@ -0,0 +1,55 @@
+import os
+import sys
+import json
+import yaml
+import numpy as np
+import pytest
+
+# The modules are scripts at the root of the repository.
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture
+def config_folder(tmp_path):
+    # A comm_sim config folder of 1000-element features sent in 300-element packets, with two scenarios of two time stamps.
+    # CAV 30 of the second time stamp neither sent nor received anything.
+    folder = tmp_path / "1e+03_3e+02_1e-01"
+    rng = np.random.default_rng(0)
+    for scenario in ("2021_08_16_22_26_54", "2021_08_18_09_02_56"):
+        result = {}
+        for stamp in ("000068", "000070"):
+            result[stamp] = {}
+            for cav in ("10", "20", "30"):
+                if cav == "30" and stamp == "000070":
+                    result[stamp][cav] = {"sent": [], "receive": {}}
+                    continue
+                sent = [[f"{0.01*(i + 1):g}", i] for i in range(4)]
+                receive = {peer: [[f"{0.015*(i + 1):g}", int(i)] for i in np.flatnonzero(rng.random(4) < 0.6)]
+                           for peer in ("10", "20", "30") if peer != cav}
+                result[stamp][cav] = {"sent": sent, "receive": receive}
+        os.makedirs(folder / scenario)
+        with open(folder / scenario / "comm_sim.json", "w") as fp:
+            json.dump(result, fp)
+    return str(folder)
+
+
+def write_agent_yaml(path, true_ego_pos, speed = 10.):
+    # An OPV2V-like frame yaml, whose true_ego_pos sits among larger camera, trajectory and vehicle blocks.
+    content = {"camera0": {"cords": list(true_ego_pos), "extrinsic": [[0.5, 0.25], [0.125, 1.]]}, "ego_speed": speed,
+               "lidar_pose": list(true_ego_pos), "plan_trajectory": [[0.1*i, 0.2*i, 0.001] for i in range(5)],
+               "true_ego_pos": list(true_ego_pos), "vehicles": {1520: {"angle": [0., 90., 0.], "location": [1., 2., 3.]}}}
+    with open(path, "w") as fp:
+        fp.write(yaml.safe_dump(content, default_flow_style=False))
+
+@pytest.fixture
+def dataset_root(tmp_path):
+    # A dataset split of two scenarios of three agents, each with a .pcd and a .yaml file for four time stamps.
+    root = tmp_path / "train"
+    for i, scenario in enumerate(("2021_08_16_22_26_54", "2021_08_18_09_02_56")):
+        for j, agent in enumerate(("641", "650", "659")):
+            os.makedirs(root / scenario / agent)
+            for k, stamp in enumerate(("000068", "000070", "000072", "000074")):
+                open(root / scenario / agent / f"{stamp}.pcd", "wb").close()
+                pose = [100.*i + 10.*j + 0.5*k, -2.5*j, 0.3, 0., 90. + k, 0.]
+                write_agent_yaml(root / scenario / agent / f"{stamp}.yaml", pose)
+    return str(root)
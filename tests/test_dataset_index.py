@@ -0,0 +1,64 @@
+import os
+import time
+from dataset_index import DatasetIndex
+
+SCENARIO = "2021_08_16_22_26_54"
+STAMPS = ["000068", "000070", "000072", "000074"]
+
+
+def _set_mtime(path, mtime_ns):
+    os.utime(path, ns=(mtime_ns, mtime_ns))
+
+def _open_aged(root, mtime_ns):
+    # Open the index once its files exist, with the mtime of every folder moved out of the refresh slack.
+    DatasetIndex(root).close()
+    for folder, _, _ in os.walk(root):
+        _set_mtime(folder, mtime_ns)
+    return DatasetIndex(root)
+
+
+def test_folders_changed_within_the_slack_are_listed_again(dataset_root):
+    old = time.time_ns() - 100*10**9
+    agent_path = os.path.join(dataset_root, SCENARIO, "641")
+    with _open_aged(dataset_root, old) as index:
+        assert index.stamps(SCENARIO, "641") == STAMPS
+        assert index.refresh() == 0
+
+        # A new stamp whose folder mtime did not move, e.g., within the mtime granularity, is not seen
+        open(os.path.join(agent_path, "000076.pcd"), "wb").close()
+        _set_mtime(agent_path, old)
+        assert index.refresh() == 0
+        assert index.stamps(SCENARIO, "641") == STAMPS
+
+        # Once touched, the folder is listed, and listed again while its mtime is within the slack
+        now = time.time_ns()
+        _set_mtime(agent_path, now)
+        assert index.refresh() == 1
+        assert index.stamps(SCENARIO, "641") == STAMPS + ["000076"]
+        open(os.path.join(agent_path, "000078.pcd"), "wb").close()
+        _set_mtime(agent_path, now)
+        assert index.refresh() == 1
+        assert index.stamps(SCENARIO, "641") == STAMPS + ["000076", "000078"]
+
+        # Out of the slack, the folder is listed once more and then left alone
+        _set_mtime(agent_path, old)
+        assert index.refresh() == 1
+        assert index.refresh() == 0
+
+    with DatasetIndex(dataset_root, refresh=False) as index:
+        assert index.stamps(SCENARIO, "641") == STAMPS + ["000076", "000078"]
+
+def test_a_touched_scenario_folder_lists_its_new_agents(dataset_root):
+    old = time.time_ns() - 100*10**9
+    with _open_aged(dataset_root, old) as index:
+        assert index.agents(SCENARIO) == ["641", "650", "659"]
+        agent_path = os.path.join(dataset_root, SCENARIO, "700")
+        os.makedirs(agent_path)
+        for stamp in STAMPS[:2]:
+            open(os.path.join(agent_path, f"{stamp}.pcd"), "wb").close()
+        os.remove(os.path.join(dataset_root, SCENARIO, "650", f"{STAMPS[-1]}.pcd"))
+        _set_mtime(os.path.join(dataset_root, SCENARIO, "650"), time.time_ns())
+        assert index.refresh() == 3 # the scenario, the new agent and the touched agent
+        assert index.agents(SCENARIO) == ["641", "650", "659", "700"]
+        assert index.stamps(SCENARIO, "700") == STAMPS[:2]
+        assert index.stamps(SCENARIO, "650") == STAMPS[:-1]
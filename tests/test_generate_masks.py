@@ -0,0 +1,89 @@
+import os
+import numpy as np
+import pytest
+from generate_masks import MaskStore, generate_mask, mask_from_received_packet_num, _mask_from_received_packet_num_loop, \
+    read_scenario_packets
+
+SCENARIOS = ["2021_08_16_22_26_54", "2021_08_18_09_02_56"]
+EGO_BYTES = 2*1000*8 # the two float64 masks of 1000 elements of an ego of the config_folder fixture
+DTYPES = [bool, np.uint8, np.float32, np.float64]
+
+
+def _assert_same_masks(received_packet_num, feature_size, payload_size, dtype):
+    loop_masks = _mask_from_received_packet_num_loop(received_packet_num, feature_size, payload_size, dtype)
+    masks = mask_from_received_packet_num(received_packet_num, feature_size, payload_size, dtype)
+    assert list(masks) == list(loop_masks)
+    for peer, mask in masks.items():
+        assert mask.dtype == loop_masks[peer].dtype == dtype
+        np.testing.assert_array_equal(mask, loop_masks[peer])
+
+
+@pytest.mark.parametrize("dtype", DTYPES)
+@pytest.mark.parametrize("feature_size, payload_size", [(1000, 300), (900, 300), (10, 1), (5, 8)])
+def test_vectorized_masks_match_the_loop(dtype, feature_size, payload_size):
+    n_packets = -(-feature_size//payload_size)
+    rng = np.random.default_rng(feature_size)
+    received_packet_num = {"1": list(range(n_packets)), "2": [], "3": rng.integers(0, n_packets, size=n_packets).tolist(),
+                           "4": [n_packets - 1, 0, n_packets - 1, n_packets]} # duplicates and one past the last packet
+    _assert_same_masks(received_packet_num, feature_size, payload_size, dtype)
+    _assert_same_masks({}, feature_size, payload_size, dtype) # an ego without any peer
+
+@pytest.mark.parametrize("dtype", DTYPES)
+def test_vectorized_masks_match_the_loop_on_a_scenario(config_folder, dtype):
+    packets = read_scenario_packets(os.path.join(config_folder, SCENARIOS[0], "comm_sim.json"))
+    assert packets["000070"]["30"] == (None, {}) # the CAV without any event
+    for stamp in packets:
+        for _, received_packet_num in packets[stamp].values():
+            _assert_same_masks(received_packet_num, 1000, 300, dtype)
+
+
+def test_mask_store_evicts_the_least_recently_used_egos(config_folder):
+    store = MaskStore(config_folder, max_bytes=2*EGO_BYTES + EGO_BYTES//2)
+    stamps = store[SCENARIOS[0]]["000068"]
+    expected = generate_mask(config_folder)[SCENARIOS[0]]["000068"]
+
+    def lookup(ego):
+        duration, masks = stamps[ego]
+        assert duration == expected[ego][0]
+        for peer, mask in masks.items():
+            np.testing.assert_array_equal(mask, expected[ego][peer][1])
+
+    lookup("10")
+    lookup("20")
+    assert store.stats() == {"hits": 0, "misses": 2, "evictions": 0, "parses": 1, "nbytes": 2*EGO_BYTES, "entries": 2}
+    lookup("10") # now more recent than 20
+    assert (store.hits, store.misses) == (1, 2)
+    lookup("30") # over the budget, 20 is evicted
+    assert store.stats() == {"hits": 1, "misses": 3, "evictions": 1, "parses": 1, "nbytes": 2*EGO_BYTES, "entries": 2}
+    lookup("10")
+    lookup("30")
+    assert (store.hits, store.misses, store.evictions) == (3, 3, 1)
+    lookup("20") # built again, evicting 10, the least recently used
+    assert (store.hits, store.misses, store.evictions) == (3, 4, 2)
+    lookup("30")
+    lookup("10")
+    assert (store.hits, store.misses, store.evictions) == (4, 5, 3)
+    assert store.nbytes == 2*EGO_BYTES <= store.max_bytes
+
+
+def test_mask_store_keeps_an_ego_larger_than_the_budget(config_folder):
+    store = MaskStore(config_folder, max_bytes=EGO_BYTES//2)
+    stamps = store[SCENARIOS[0]]["000068"]
+    stamps["10"]
+    stamps["10"]
+    assert store.stats() == {"hits": 1, "misses": 1, "evictions": 0, "parses": 1, "nbytes": EGO_BYTES, "entries": 1}
+    stamps["20"]
+    assert store.stats() == {"hits": 1, "misses": 2, "evictions": 1, "parses": 1, "nbytes": EGO_BYTES, "entries": 1}
+
+
+def test_mask_store_parses_each_scenario_once_while_it_is_kept(config_folder):
+    for max_scenarios, parses in ((1, 3), (2, 2)):
+        store = MaskStore(config_folder, max_scenarios=max_scenarios)
+        store[SCENARIOS[0]]["000068"]["10"]
+        store[SCENARIOS[0]]["000070"]["30"]
+        assert store.parses == 1
+        store[SCENARIOS[1]]["000068"]["10"]
+        store[SCENARIOS[0]]["000068"]["20"]
+        assert store.parses == parses
+        store.clear()
+        assert store.stats()["entries"] == store.nbytes == 0
@@ -0,0 +1,156 @@
+import os
+import shutil
+import yaml
+import numpy as np
+import pytest
+import generate_vehicle_traj
+import trajectory_store
+from conftest import write_agent_yaml
+
+SCENARIOS = ["2021_08_16_22_26_54", "2021_08_18_09_02_56"]
+AGENTS = ["641", "650", "659"]
+
+
+def _copy(root, name):
+    # A copy of the dataset split, made before any index or output is written into it.
+    copy = os.path.join(os.path.dirname(root), name)
+    shutil.copytree(root, copy)
+    return copy
+
+
+def test_pool_results_match_a_single_process(dataset_root):
+    roots = {num_workers: _copy(dataset_root, f"train_{num_workers}") for num_workers in (1, 4)}
+    for num_workers, root in roots.items():
+        assert generate_vehicle_traj.main(root, num_workers=num_workers) == {}
+    for scenario in SCENARIOS:
+        single = trajectory_store.load_trajectories(os.path.join(roots[1], scenario), mmap=False)
+        pooled = trajectory_store.load_trajectories(os.path.join(roots[4], scenario), mmap=False)
+        assert list(single) == list(pooled) == AGENTS
+        for agent in AGENTS:
+            assert single[agent].shape == (4, len(trajectory_store.COLUMNS))
+            np.testing.assert_array_equal(single[agent], pooled[agent])
+    np.testing.assert_array_equal(single["650"][:, 0], np.array([0, 2, 4, 6])*generate_vehicle_traj.DELTA_TIME)
+    np.testing.assert_array_equal(single["650"][:, 1:3], [[110., -2.5], [110.5, -2.5], [111., -2.5], [111.5, -2.5]])
+
+def test_a_bad_yaml_only_fails_its_agent(dataset_root):
+    bad_agent = os.path.join(dataset_root, SCENARIOS[1], "650")
+    with open(os.path.join(bad_agent, "000070.yaml"), "w") as fp:
+        fp.write("true_ego_pos: [1., 2.\n")
+    for num_workers in (1, 4):
+        failures = generate_vehicle_traj.main(dataset_root, num_workers=num_workers, save_json=True)
+        assert list(failures) == [bad_agent]
+        # The other agents of the scenario were parsed, but its store waits for a complete vehicle set
+        for agent in ("641", "659"):
+            assert os.path.exists(os.path.join(dataset_root, SCENARIOS[1], agent, f"{agent}.json"))
+            os.remove(os.path.join(dataset_root, SCENARIOS[1], agent, f"{agent}.json"))
+        assert not os.path.exists(trajectory_store.store_path(os.path.join(dataset_root, SCENARIOS[1])))
+        assert list(trajectory_store.load_trajectories(os.path.join(dataset_root, SCENARIOS[0]))) == AGENTS
+
+
+FIELDS = ["camera0", "ego_speed", "lidar_pose", "plan_trajectory", "true_ego_pos", "vehicles"]
+DOCUMENTS = {
+    # Sliced by lines and loaded with LibYAML when it is available
+    "block": None, # written by write_agent_yaml
+    # A directive line and flow collections, which the line slicer does not handle, so the events are scanned
+    "flow": "%YAML 1.1\n---\ncamera0: {cords: [1, 2]}\nego_speed: 1e-3\nlidar_pose: [1.5, -2.5]\n"
+            "plan_trajectory: [[0.1, 1e-3], [0.2, .5]]\ntrue_ego_pos: [1., 2., 3., 0., 90., 0.]\nvehicles: {}\n",
+    # An alias into a block that is not requested, which only a full load resolves
+    "alias": "camera0: &pose [1., 2., 3., 0., 90., 0.]\nego_speed: 2\nlidar_pose: *pose\nplan_trajectory: []\n"
+             "true_ego_pos: *pose\nvehicles: {1: *pose}\n",
+    # A yaml_parser, which only a full load applies
+    "parser": "yaml_parser: dict\ncamera0: 1\nego_speed: 1e-3\nlidar_pose: 2\nplan_trajectory: []\n"
+              "true_ego_pos: [1e-3, 2., 3., 0., 90., 0.]\nvehicles: 3\n",
+}
+
+
+@pytest.mark.parametrize("name", list(DOCUMENTS))
+def test_extracted_fields_match_the_full_load(tmp_path, name):
+    path = str(tmp_path / "000068.yaml")
+    if DOCUMENTS[name] is None:
+        write_agent_yaml(path, [1., 2., 3., 0., 90., 0.])
+    else:
+        with open(path, "w") as fp:
+            fp.write(DOCUMENTS[name])
+    full = generate_vehicle_traj._load_yaml_file(path)
+    with open(path, "r") as fp:
+        text = fp.read()
+    for field in FIELDS:
+        expected = {field: full[field]}
+        assert generate_vehicle_traj._extract_yaml_fields(path, [field]) == expected
+        assert generate_vehicle_traj._extract_yaml_fields(path, [field], text) == expected
+        if name == "parser":
+            assert generate_vehicle_traj._scan_top_level_fields(text, [field]) is None
+        elif name == "alias" and field in ("lidar_pose", "true_ego_pos", "vehicles"):
+            with pytest.raises(yaml.YAMLError):
+                generate_vehicle_traj._scan_top_level_fields(text, [field])
+        else:
+            assert generate_vehicle_traj._scan_top_level_fields(text, [field]) == expected
+    assert generate_vehicle_traj._extract_yaml_fields(path, FIELDS) == {field: full[field] for field in FIELDS}
+    assert generate_vehicle_traj._read_yaml_files(str(tmp_path), ["000068"], FIELDS) == \
+        generate_vehicle_traj._read_yaml_files(str(tmp_path), ["000068"], FIELDS, full_load=True)
+
+def test_scientific_floats_are_floats(tmp_path):
+    path = str(tmp_path / "000068.yaml")
+    with open(path, "w") as fp:
+        fp.write(DOCUMENTS["flow"])
+    extracted = generate_vehicle_traj._extract_yaml_fields(path, ["ego_speed", "plan_trajectory"])
+    assert extracted == {"ego_speed": 1e-3, "plan_trajectory": [[0.1, 1e-3], [0.2, 0.5]]}
+    assert isinstance(extracted["ego_speed"], float)
+
+
+def test_incremental_rerun_only_parses_the_changed_agents(dataset_root, monkeypatch):
+    parsed, hashed = [], []
+    parse_one_agent, hash_file = generate_vehicle_traj.parse_one_agent, generate_vehicle_traj._hash_file
+    monkeypatch.setattr(generate_vehicle_traj, "parse_one_agent", lambda path, *args: parsed.append(path) or parse_one_agent(path, *args))
+    monkeypatch.setattr(generate_vehicle_traj, "_hash_file", lambda path: hashed.append(path) or hash_file(path))
+    agent_path = os.path.join(dataset_root, SCENARIOS[0], "641")
+    yaml_path = os.path.join(agent_path, "000070.yaml")
+
+    def rerun():
+        parsed.clear()
+        hashed.clear()
+        assert generate_vehicle_traj.main(dataset_root, incremental=True) == {}
+        return trajectory_store.load_trajectories(os.path.join(dataset_root, SCENARIOS[0]), mmap=False)
+
+    rerun()
+    assert len(parsed) == 6
+    before = rerun()
+    assert parsed == [] and hashed == []
+
+    # The mtime moved, but the content is the same: the file is hashed once, and its new mtime is kept
+    stat = os.stat(yaml_path)
+    os.utime(yaml_path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+    rerun()
+    assert parsed == [] and hashed == [yaml_path]
+    rerun()
+    assert parsed == [] and hashed == []
+
+    def replace(old, new):
+        with open(yaml_path, "r") as fp:
+            text = fp.read()
+        with open(yaml_path, "w") as fp:
+            fp.write(text.replace(old, new))
+
+    # The same size, but another content and mtime
+    replace("- 0.5\n", "- 0.7\n")
+    assert os.path.getsize(yaml_path) == stat.st_size
+    os.utime(yaml_path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 2*10**9))
+    after = rerun()
+    assert parsed == [agent_path]
+    assert after["641"][1, 1] == 0.7
+    np.testing.assert_array_equal(after["650"], before["650"])
+
+    # Another size, with the mtime put back, still rebuilds the agent
+    stat = os.stat(yaml_path)
+    replace("- 0.7\n", "- 0.625\n")
+    os.utime(yaml_path, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+    after = rerun()
+    assert parsed == [agent_path]
+    assert after["641"][1, 1] == 0.625
+
+    # An added time stamp rebuilds the agent
+    open(os.path.join(agent_path, "000076.pcd"), "wb").close()
+    write_agent_yaml(os.path.join(agent_path, "000076.yaml"), [2., 0., 0.3, 0., 93., 0.])
+    after = rerun()
+    assert parsed == [agent_path]
+    assert after["641"].shape == (5, len(trajectory_store.COLUMNS))
@@ -0,0 +1,35 @@
+import json
+import pytest
+import json_backend
+
+DOCUMENTS = [
+    '{"a": 1.5, "b": [1,2], "c": "x"}',
+    '{}',
+    ' { "68" : {"1": {"sent": [[0.0125, 0], [1e-05, 1]], "receive": {"2": [[-2.5E+3, 7]]}}} , "70":{} }\n',
+    '{"k": "a,:}]\\"{", "n": null, "t": true, "f": false, "e": -0.0, "big": 123456789012345678901234567890}',
+]
+
+
+@pytest.mark.parametrize("document", DOCUMENTS)
+@pytest.mark.parametrize("chunk_size", [1, 2, 3, 4, 7, 1 << 20])
+def test_iter_items_matches_json(tmp_path, document, chunk_size):
+    path = tmp_path / "data.json"
+    path.write_text(document)
+    assert dict(json_backend.iter_items(str(path), chunk_size)) == json.loads(document)
+
+
+@pytest.mark.parametrize("document", ['{,,"a":1 "b":2}', '{"a":1 "b":2}', '{"a":1,,"b":2}', '{"a":1,}', '{"a": {"b": 1}', '[1]'])
+@pytest.mark.parametrize("chunk_size", [1, 4, 1 << 20])
+def test_iter_items_rejects_malformed_objects(tmp_path, document, chunk_size):
+    path = tmp_path / "data.json"
+    path.write_text(document)
+    with pytest.raises(ValueError):
+        dict(json_backend.iter_items(str(path), chunk_size))
+
+
+@pytest.mark.parametrize("backend", json_backend.available_backends())
+def test_backends_round_trip(tmp_path, backend):
+    data = {"68": {"1": {"sent": [[0.5, 0]], "receive": {"2": [[0.75, 0]]}}}, "70": {}}
+    path = str(tmp_path / "comm_sim.json")
+    json_backend.dump(data, path, backend if backend != "stream" else None)
+    assert json_backend.load(path, backend) == data
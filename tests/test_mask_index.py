@@ -0,0 +1,65 @@
+import os
+import sys
+import json
+import pickle
+import subprocess
+import numpy as np
+import pytest
+from generate_masks import MaskStore, generate_mask
+from mask_index import MaskIndex, compile_mask_index, index_path
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def _lookups(masks):
+    # Every (scenario, time stamp, ego) of a generate_mask result.
+    return [(scenario, stamp, ego) for scenario in masks for stamp in masks[scenario] for ego in masks[scenario][stamp]]
+
+
+def test_lookups_match_generate_mask_and_mask_store(config_folder):
+    assert compile_mask_index(config_folder) == index_path(config_folder)
+    index = MaskIndex(config_folder)
+    compact = generate_mask(config_folder, compact=True)
+    dense = generate_mask(config_folder, dtype=np.float32)
+    store = MaskStore(config_folder, dtype=np.float32)
+    lookups = _lookups(compact)
+    assert len(lookups) == len(index) == 2*2*3
+    assert index.scenarios() == sorted(compact)
+    for scenario, stamp, ego in lookups:
+        duration, masks = index.get(scenario, stamp, ego)
+        assert duration == compact[scenario][stamp][ego][0] == store[scenario][stamp][ego][0]
+        assert masks == compact[scenario][stamp][ego][1]
+        dense_masks = index.get(scenario, stamp, ego, dtype=np.float32)[1]
+        assert dense_masks.keys() == dense[scenario][stamp][ego][1].keys() == store[scenario][stamp][ego][1].keys()
+        for peer, mask in dense_masks.items():
+            assert mask.dtype == np.float32
+            np.testing.assert_array_equal(mask, dense[scenario][stamp][ego][peer][1])
+            np.testing.assert_array_equal(mask, store[scenario][stamp][ego][peer][1])
+    assert index.duration("2021_08_16_22_26_54", "000070", "30") is None
+    with pytest.raises(KeyError):
+        index.get("2021_08_16_22_26_54", "000072", "10")
+    with pytest.raises(KeyError):
+        index.get("2021_08_16_22_26_54", "000068", "40")
+
+
+def test_pickled_index_reopens_by_path_in_a_subprocess(config_folder, tmp_path):
+    compile_mask_index(config_folder)
+    index = MaskIndex(config_folder)
+    pickle_path = tmp_path / "index.pickle"
+    with open(pickle_path, "wb") as fp:
+        pickle.dump(index, fp)
+    assert os.path.getsize(pickle_path) < 512 # the path, not the mapped tables
+
+    code = ("import sys, json, pickle\n"
+            "index = pickle.load(open(sys.argv[1], 'rb'))\n"
+            "print(json.dumps({'path': index.path, 'egos': [[scenario, stamp, ego, index.duration(scenario, stamp, ego),\n"
+            "    {peer: bits.tolist() for peer, bits in index.packbits(scenario, stamp, ego).items()}]\n"
+            "    for scenario, stamp, ego in json.loads(sys.argv[2])]}))\n")
+    lookups = _lookups(generate_mask(config_folder, compact=True))
+    output = subprocess.run([sys.executable, "-c", code, str(pickle_path), json.dumps(lookups)], check=True, capture_output=True,
+                            text=True, env={**os.environ, "PYTHONPATH": REPO_ROOT}).stdout
+    result = json.loads(output)
+    assert result["path"] == index.path
+    for scenario, stamp, ego, duration, bits in result["egos"]:
+        assert duration == index.duration(scenario, stamp, ego)
+        assert bits == {peer: value.tolist() for peer, value in index.packbits(scenario, stamp, ego).items()}
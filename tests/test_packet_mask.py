@@ -0,0 +1,91 @@
+import numpy as np
+import pytest
+from generate_masks import mask_from_received_packet_num
+from packet_mask import PacketMask
+
+SIZES = [(12, 3), (10, 3), (7, 7), (5, 8)] # feature_size, payload_size, with and without a cut last packet
+
+
+def _received_cases(n_packets):
+    # Empty, all received, alternating and random packet numbers, the last with duplicates and numbers out of range.
+    random = np.random.default_rng(n_packets).integers(-2, n_packets + 2, size=2*n_packets)
+    return {"empty": [], "all": list(range(n_packets)), "even": list(range(0, n_packets, 2)),
+            "odd": list(range(1, n_packets, 2)), "random": random.tolist()}
+
+def _cases():
+    for feature_size, payload_size in SIZES:
+        n_packets = -(-feature_size//payload_size)
+        for name, received in _received_cases(n_packets).items():
+            yield pytest.param(received, feature_size, payload_size, id=f"{feature_size}_{payload_size}_{name}")
+
+def _dense(received, feature_size, payload_size, dtype=bool):
+    return mask_from_received_packet_num({0: received}, feature_size, payload_size, dtype)[0]
+
+def _runs(dense):
+    # The [start, stop) runs of the nonzero elements of a dense mask.
+    edges = np.flatnonzero(np.diff(np.concatenate(([0], dense.astype(np.int8), [0]))))
+    return edges.reshape(-1, 2)
+
+
+@pytest.mark.parametrize("received, feature_size, payload_size", _cases())
+def test_to_dense_matches_the_dense_mask(received, feature_size, payload_size):
+    mask = PacketMask(received, feature_size, payload_size)
+    for dtype in (bool, np.uint8, np.float32, np.float64):
+        dense = mask.to_dense(dtype)
+        assert dense.dtype == dtype
+        np.testing.assert_array_equal(dense, _dense(received, feature_size, payload_size, dtype))
+    np.testing.assert_array_equal(np.asarray(mask), _dense(received, feature_size, payload_size, np.float64))
+    assert len(mask) == feature_size
+
+@pytest.mark.parametrize("received, feature_size, payload_size", _cases())
+def test_packbits_round_trip(received, feature_size, payload_size):
+    mask = PacketMask(received, feature_size, payload_size)
+    bits = mask.to_packbits()
+    assert len(bits) == -(-mask.n_packets//8)
+    restored = PacketMask.from_packbits(bits, feature_size, payload_size)
+    assert restored == mask
+    np.testing.assert_array_equal(restored.to_dense(), _dense(received, feature_size, payload_size))
+
+@pytest.mark.parametrize("received, feature_size, payload_size", _cases())
+def test_intervals_match_the_runs_of_the_dense_mask(received, feature_size, payload_size):
+    mask = PacketMask(received, feature_size, payload_size)
+    dense = _dense(received, feature_size, payload_size)
+    np.testing.assert_array_equal(mask.intervals(), _runs(dense))
+    np.testing.assert_array_equal(mask.lost_intervals(), _runs(~dense))
+
+def test_intervals_of_empty_and_full_masks():
+    empty = PacketMask([], 10, 3)
+    full = PacketMask(range(4), 10, 3)
+    assert empty.intervals().shape == (0, 2)
+    np.testing.assert_array_equal(empty.lost_intervals(), [[0, 10]])
+    np.testing.assert_array_equal(full.intervals(), [[0, 10]])
+    assert full.lost_intervals().shape == (0, 2)
+    np.testing.assert_array_equal(PacketMask([0, 2], 10, 3).intervals(), [[0, 3], [6, 9]])
+
+@pytest.mark.parametrize("received, feature_size, payload_size", _cases())
+def test_apply_zeroes_the_lost_elements_in_place(received, feature_size, payload_size):
+    mask = PacketMask(received, feature_size, payload_size)
+    dense = _dense(received, feature_size, payload_size, np.float32)
+    features = np.arange(1, 3*2*feature_size + 1, dtype=np.float32).reshape(3, 2, feature_size)
+    expected = features*dense
+    assert mask.apply(features) is features
+    np.testing.assert_array_equal(features, expected)
+
+    # A slice of a batch is a view whose last axis is the feature, the rest of the batch is left alone
+    batch = np.ones((4, feature_size), dtype=np.float32)
+    mask.apply(batch[1:3])
+    np.testing.assert_array_equal(batch[1:3], np.broadcast_to(dense, (2, feature_size)))
+    np.testing.assert_array_equal(batch[[0, 3]], 1)
+
+    # A C-contiguous feature of another shape is masked through its flat view
+    flat = np.arange(1, feature_size + 1, dtype=np.float64)
+    shaped = flat.copy().reshape(feature_size, 1)
+    mask.apply(shaped)
+    np.testing.assert_array_equal(shaped.reshape(-1), flat*dense)
+
+def test_apply_rejects_mismatched_arrays():
+    mask = PacketMask([0], 12, 3)
+    with pytest.raises(ValueError):
+        mask.apply(np.ones(11))
+    with pytest.raises(ValueError):
+        mask.apply(np.ones((4, 3)).T) # 12 elements, but neither along the last axis nor C-contiguous
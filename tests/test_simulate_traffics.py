@@ -0,0 +1,181 @@
+import os
+import sys
+import time
+import pytest
+import numpy as np
+import simulate_traffics
+from trace_policy import TracePolicy
+
+try:
+    from ns import ns
+except ImportError:
+    ns = None
+
+needs_ns = pytest.mark.skipif(ns is None, reason="the ns-3 python bindings are not available")
+
+
+def _waypoints(n_nodes = 3, duration = 4., speed = 10.):
+    # Vehicles driving side by side along x, with one waypoint every 0.1 s.
+    times = np.arange(0., duration, 0.1)
+    return [[[float(t), [speed*t, 5.*i, 0.]] for t in times] for i in range(n_nodes)]
+
+
+@needs_ns
+def test_batched_stamps_match_single_stamps(tmp_path):
+    waypoints = _waypoints()
+    nodes_names = [str(i) for i in range(len(waypoints))]
+    int_stamps = [68, 69, 70]
+    results = {}
+    for batch_size in (1, len(int_stamps)):
+        results[batch_size], _ = simulate_traffics._simulate_stamps(
+            ns, nodes_names, waypoints, int_stamps, 68, 1e3, 1e2, 0.1, str(tmp_path / str(batch_size)), TracePolicy("none"),
+            batch_size=batch_size)
+    assert results[1] == results[len(int_stamps)]
+
+
+@pytest.mark.parametrize("as_array", [False, True])
+@pytest.mark.parametrize("begin, end", [(0., 0.5), (0.25, 1.05), (1.3, 2.), (3.5, 10.), (-1., 0.2)])
+def test_window_waypoints_keep_the_positions_within_the_window(as_array, begin, end):
+    full_rows = np.array([[time, *position] for time, position in _waypoints(n_nodes=1)[0]])
+    waypoints = full_rows if as_array else [[row[0], list(row[1:])] for row in full_rows]
+    window = simulate_traffics._window_waypoints(waypoints, begin, end)
+    window_rows = np.array([[row[0], *row[1]] for row in window]) if not as_array else window
+    assert len(window_rows) < len(full_rows)
+    times = np.linspace(max(begin, full_rows[0, 0]), min(end, full_rows[-1, 0]), 50)
+    for column in range(1, 4):
+        np.testing.assert_array_equal(np.interp(times, window_rows[:, 0], window_rows[:, column]),
+                                      np.interp(times, full_rows[:, 0], full_rows[:, column]))
+
+
+@needs_ns
+@pytest.mark.parametrize("start_time", [0., 0.5, 1.])
+def test_window_mobility_matches_full_trajectories(start_time):
+    waypoints = _waypoints()
+    packets, rate, total_attempt = simulate_traffics._create_payloads_config(1e3, 1e2, 0.1, len(waypoints))
+    results = [simulate_traffics.simulate(nNodes=len(waypoints), payloads=packets, waypoints=waypoints, rate=rate,
+                                          total_attempt=total_attempt, start_time=start_time, ns=ns, drain_time=drain_time,
+                                          tracer=TracePolicy("none"), fixed_streams=True)
+               for drain_time in (None, simulate_traffics.DRAIN_TIME)]
+    assert results[0] == results[1]
+
+
+@needs_ns
+def test_window_covers_the_receptions_with_a_long_off_time():
+    # The second vehicle leaves the range of the first one at 2 s, after the window of the default OffTime has ended.
+    times = np.arange(0., 4., 0.1)
+    waypoints = [[[float(t), [0., 0., 0.]] for t in times], [[float(t), [5. if t < 2. else 1e5, 0., 0.]] for t in times]]
+    packets, rate, total_attempt = simulate_traffics._create_payloads_config(1e3, 1e2, 0.1, len(waypoints))
+    drain_time = 0.1
+    results = [simulate_traffics.simulate(nNodes=len(waypoints), payloads=packets, waypoints=waypoints, rate=rate,
+                                          total_attempt=total_attempt, ns=ns, drain_time=window_drain_time, tracer=TracePolicy("none"),
+                                          binary_header=True, return_events=True, fixed_streams=True, max_off_time=0.5)
+               for window_drain_time in (None, drain_time)]
+    rx_times = results[1]["time_ns"][results[1]["type"] != simulate_traffics.EVENT_SENT]/1e9
+    assert rx_times.max() > total_attempt*(1/rate + simulate_traffics.MAX_OFF_TIME) + drain_time # the window of the default OffTime
+    assert rx_times.max() < simulate_traffics._active_window(0., rate, total_attempt, drain_time, 0.5)[1]
+    for name, _, _ in simulate_traffics.EVENT_FIELDS:
+        np.testing.assert_array_equal(results[0][name], results[1][name])
+
+
+def _exit_at(deadline, exit_code):
+    # Sleep until a deadline shared by the jobs, so they all exit at the same moment.
+    time.sleep(max(deadline - time.time(), 0.))
+    sys.exit(exit_code)
+
+def _crash_at(deadline):
+    time.sleep(max(deadline - time.time(), 0.))
+    os._exit(0)
+
+
+def test_process_queue_reaps_jobs_exiting_together():
+    queue = simulate_traffics.ProcessQueue(max_alive=4, max_retries=1, backoff=0.01)
+    for round_start in (0.3, 0.6, 0.9):
+        deadline = time.time() + round_start
+        for i in range(3):
+            queue.append_job(_exit_at, (deadline, 0), name=f"ok {round_start} {i}")
+        queue.append_job(_crash_at, (deadline,), name=f"crash {round_start}")
+    queue.append_job(_exit_at, (time.time() + 0.3, 3), name="failed")
+    records = queue.start()
+
+    by_name = {}
+    for record in records:
+        by_name.setdefault(record["name"], []).append(record)
+    assert len(by_name) == 13
+    assert [record["exit_code"] for record in by_name["failed"]] == [3, 3]
+    for name, name_records in by_name.items():
+        if name.startswith("ok"):
+            assert [record["exit_code"] for record in name_records] == [0]
+            assert name_records[0]["max_rss_mb"] > 0
+        elif name.startswith("crash"):
+            assert [record["exit_code"] for record in name_records] == [0]
+            assert name_records[0]["max_rss_mb"] is None
+
+
+@pytest.mark.parametrize("coefficients", [[0.5, 2e-3, 4e-4], [2., 0., 1e-3], [0., 1e-2, 0.]])
+def test_cost_model_fit_recovers_non_negative_coefficients(coefficients):
+    n_nodes, total_attempt = np.meshgrid(np.arange(2, 12), [1, 5, 10, 50, 100])
+    n_nodes, total_attempt = n_nodes.ravel(), total_attempt.ravel()
+    wall_time = simulate_traffics.CostModel._features(n_nodes, total_attempt) @ np.array(coefficients)
+    model = simulate_traffics.CostModel().fit(n_nodes, total_attempt, wall_time)
+    np.testing.assert_allclose(model.coefficients, coefficients, rtol=1e-6, atol=1e-9)
+    assert model.n_samples == len(wall_time)
+
+    # Noise that pulls a zero coefficient below zero is fitted without it
+    noisy = wall_time + np.random.default_rng(0).normal(0., 1e-3, size=len(wall_time))
+    noisy_model = simulate_traffics.CostModel().fit(n_nodes, total_attempt, noisy)
+    assert (noisy_model.coefficients >= 0).all()
+    np.testing.assert_allclose(noisy_model.coefficients, coefficients, rtol=0.05, atol=2e-3)
+
+def test_order_units_puts_the_longest_unit_first():
+    def unit(scenario, n_stamps, n_nodes, total_size = 1e3):
+        return simulate_traffics.WorkUnit("root", total_size, 1e2, 0.1, "save", scenario, list(range(n_stamps)), 0, n_nodes)
+
+    units = [unit("a", 10, 2), unit("b", 50, 2), unit("c", 10, 8), unit("d", 5, 8, total_size=1e4), unit("e", 1, 3)]
+    model = simulate_traffics.CostModel([1., 1e-3, 1e-3])
+    costs = {ele.scenario: model.estimate(ele) for ele in units}
+    ordered, makespan = simulate_traffics.order_units(units, cost_model=model, n_workers=2)
+    assert [ele.scenario for ele in ordered] == sorted(costs, key=costs.get, reverse=True)
+    assert ordered[0].scenario == max(costs, key=costs.get)
+    assert max(costs.values()) <= makespan <= sum(costs.values())
+    _, single_makespan = simulate_traffics.order_units(units, cost_model=model, n_workers=1)
+    assert single_makespan == pytest.approx(sum(costs.values()))
+
+
+def _interpolation_error(waypoints, kept):
+    # The max distance between the waypoints and the positions interpolated at their times between the kept ones.
+    waypoints, kept = simulate_traffics._waypoints_to_array(waypoints), simulate_traffics._waypoints_to_array(kept)
+    interpolated = np.stack([np.interp(waypoints[:, 0], kept[:, 0], kept[:, axis]) for axis in (1, 2, 3)], axis=1)
+    return float(np.linalg.norm(waypoints[:, 1:4] - interpolated, axis=1).max())
+
+@pytest.mark.parametrize("max_error", [0., 0.05, 0.5, 2., 50.])
+def test_simplified_waypoints_stay_within_the_max_error(max_error):
+    rng = np.random.default_rng(0)
+    times = np.arange(0., 20., 0.05)
+    velocity = np.cumsum(rng.normal(0., 0.5, size=(len(times), 3)), axis=0)*[1., 1., 0.01]
+    waypoints = np.column_stack([times, np.cumsum(velocity, axis=0)*0.05])
+    kept, error = simulate_traffics.simplify_waypoints(waypoints, max_error)
+    assert error <= max_error
+    assert _interpolation_error(waypoints, kept) == pytest.approx(error, abs=1e-9)
+    assert kept[0].tolist() == waypoints[0].tolist() and kept[-1].tolist() == waypoints[-1].tolist()
+    assert set(map(tuple, kept)) <= set(map(tuple, waypoints))
+    if max_error > 0.:
+        assert len(kept) < len(waypoints)
+
+    rows = [[float(row[0]), row[1:].tolist()] for row in waypoints]
+    kept_rows, rows_error = simulate_traffics.simplify_waypoints(rows, max_error)
+    assert kept_rows == [[float(row[0]), row[1:].tolist()] for row in kept]
+    assert rows_error == error
+
+@pytest.mark.parametrize("as_array", [False, True])
+def test_collinear_waypoints_collapse_to_their_endpoints(as_array):
+    waypoints = _waypoints(n_nodes=1, duration=10.)[0]
+    waypoints = simulate_traffics._waypoints_to_array(waypoints) if as_array else waypoints
+    kept, error = simulate_traffics.simplify_waypoints(waypoints, 1e-6)
+    assert len(kept) == 2
+    assert error < 1e-9
+    if as_array:
+        np.testing.assert_array_equal(kept, waypoints[[0, -1]])
+    else:
+        assert kept == [waypoints[0], waypoints[-1]]
+    short, short_error = simulate_traffics.simplify_waypoints(waypoints[:2], 1.)
+    assert len(short) == 2 and short_error == 0.
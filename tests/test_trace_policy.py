@@ -0,0 +1,72 @@
+import os
+import gzip
+import struct
+import numpy as np
+import simulate_traffics
+import trace_policy
+from trace_policy import TracePolicy
+
+
+class _FakePhyHelper():
+    # The pcap files of two devices, with one record each holding the stamp, which only reach the disk once they are closed.
+    def __init__(self, stamp = 0) -> None:
+        self.prefixes = []
+        self.stamp = stamp
+
+    def EnablePcapAll(self, prefix):
+        self.prefixes.append(prefix)
+
+    def ClosePcapFiles(self):
+        for prefix in self.prefixes:
+            for device in range(2):
+                with open(f"{prefix}-{device}-0.pcap", "wb") as fp:
+                    fp.write(struct.pack("<IHHiIII", 0xa1b2c3d4, 2, 4, 0, 0, 65535, 105))
+                    fp.write(struct.pack("<IIII", device, 0, 1, 1) + bytes([self.stamp]))
+        self.prefixes = []
+
+
+def test_end_stamp_closes_the_pcap_files_before_merging(tmp_path):
+    tracer = TracePolicy("consolidated")
+    tracer.begin_scenario(str(tmp_path))
+    for stamp in range(2):
+        wifi_phy = _FakePhyHelper()
+        tracer.enable(wifi_phy, None, "title")
+        tracer.end_stamp(stamp, None)
+        assert wifi_phy.prefixes == []
+    tracer.end_scenario()
+    with gzip.open(tmp_path / trace_policy.CONSOLIDATED_FILENAME, "rb") as fp:
+        data = fp.read()
+    assert len(data) == 24 + 4*17
+
+
+def test_merge_parts_concatenates_the_consolidated_captures_of_the_units(tmp_path):
+    folder = str(tmp_path)
+    tracer = TracePolicy("consolidated")
+    for unit in ([2, 3], [0, 1]):
+        tracer.begin_scenario(folder, consolidated_path=simulate_traffics._part_path(folder, unit[0], trace_policy.CONSOLIDATED_FILENAME))
+        for stamp in unit:
+            tracer.enable(_FakePhyHelper(stamp), None, "title")
+            tracer.end_stamp(stamp, None)
+        tracer.end_scenario()
+    assert simulate_traffics.merge_parts(folder) == 2
+    assert sorted(os.listdir(folder)) == [trace_policy.CONSOLIDATED_FILENAME]
+    with gzip.open(tmp_path / trace_policy.CONSOLIDATED_FILENAME, "rb") as fp:
+        data = fp.read()
+    assert data[:4] == struct.pack("<I", 0xa1b2c3d4)
+    assert [data[24 + 17*i + 16] for i in range(8)] == [0, 0, 1, 1, 2, 2, 3, 3]
+
+
+def test_sampled_mode_keeps_the_stamps_of_the_scenario_across_work_units(tmp_path, monkeypatch):
+    def fake_simulate(tracer, experiment_title, run_stats, **kwargs):
+        tracer.enable(_FakePhyHelper(), None, experiment_title)
+        run_stats.update(wall_time=0., sim_end_time=0.)
+        return {name: np.zeros(0, dtype) for name, _, dtype in simulate_traffics.EVENT_FIELDS}
+
+    monkeypatch.setattr(simulate_traffics, "simulate", fake_simulate)
+    all_stamps = list(range(68, 88, 2))
+    tracer = TracePolicy("sampled", sample_every=3)
+    for first in range(0, len(all_stamps), 4):
+        simulate_traffics._simulate_stamps(None, ["a", "b"], [[], []], all_stamps[first:first+4], all_stamps[0], 1e3, 1e2, 0.1,
+                                           str(tmp_path), tracer, part=all_stamps[first], all_stamps=all_stamps)
+    titles = {name.split("-")[0] for name in os.listdir(tmp_path / "pcap")}
+    assert titles == {f"1000.0_100.0_{all_stamps[i]}" for i in (0, 3, 6, 9)}
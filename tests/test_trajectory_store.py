@@ -0,0 +1,42 @@
+import numpy as np
+import pytest
+import trajectory_store
+
+
+def _trajectories():
+    rng = np.random.default_rng(0)
+    return {"641": rng.normal(size=(40, 7)), "1520": rng.normal(size=(3, 7)), "agent_with_a_long_name": rng.normal(size=(1, 7)),
+            "empty": np.empty((0, 7))}
+
+
+@pytest.mark.parametrize("dtype", [np.float64, np.float32])
+def test_round_trip_through_the_memory_map(tmp_path, dtype):
+    trajectories = _trajectories()
+    trajectory_store.save_trajectories(str(tmp_path), trajectories, dtype=dtype)
+    mapped = trajectory_store.load_trajectories(str(tmp_path))
+    loaded = trajectory_store.load_trajectories(str(tmp_path), mmap=False)
+    assert sorted(mapped) == sorted(loaded) == sorted(trajectories)
+    for agent_id, trajectory in trajectories.items():
+        assert mapped[agent_id].dtype == loaded[agent_id].dtype == dtype
+        assert mapped[agent_id].shape == trajectory.shape
+        assert isinstance(mapped[agent_id].base, np.memmap) or mapped[agent_id].size == 0
+        assert not mapped[agent_id].flags.writeable
+        np.testing.assert_array_equal(mapped[agent_id], trajectory.astype(dtype))
+        np.testing.assert_array_equal(loaded[agent_id], trajectory.astype(dtype))
+
+def test_rows_are_stored_as_arrays(tmp_path):
+    rows = [[0., [1., 2., 3., 0., 90., 0.]], [0.1, [1.5, 2., 3., 0., 91., 0.]]]
+    trajectory_store.save_trajectories(str(tmp_path), {"641": rows, "650": trajectory_store.rows_to_array(rows)})
+    mapped = trajectory_store.load_trajectories(str(tmp_path))
+    expected = [[0., 1., 2., 3., 0., 90., 0.], [0.1, 1.5, 2., 3., 0., 91., 0.]]
+    np.testing.assert_array_equal(mapped["641"], expected)
+    np.testing.assert_array_equal(mapped["650"], expected)
+
+def test_a_compressed_store_is_not_memory_mapped(tmp_path):
+    trajectories = _trajectories()
+    np.savez_compressed(trajectory_store.store_path(str(tmp_path)), **trajectories)
+    with pytest.raises(ValueError):
+        trajectory_store.load_trajectories(str(tmp_path))
+    loaded = trajectory_store.load_trajectories(str(tmp_path), mmap=False)
+    for agent_id, trajectory in trajectories.items():
+        np.testing.assert_array_equal(loaded[agent_id], trajectory)
@@ -0,0 +1,231 @@
+import os
+import glob
+import gzip
+import heapq
+import shutil
+import struct
+import tempfile
+import collections
+
+TRACE_MODES = ["all", "none", "sampled", "consolidated", "ring"]
+CONSOLIDATED_FILENAME = "comm_sim.pcap.gz" # The consolidated capture of a scenario, saved next to comm_sim.json
+_PCAP_HEADER_SIZE = 24
+_RECORD_HEADER_SIZE = 16
+
+
+def _read_pcap(path):
+    # Split a pcap file into its global header and its records, keyed by their capture time.
+    with open(path, "rb") as fp:
+        data = fp.read()
+    if len(data) < _PCAP_HEADER_SIZE:
+        return None, []
+    endian = "<" if data[:4] in (b"\xd4\xc3\xb2\xa1", b"\x4d\x3c\xb2\xa1") else ">"
+    records = []
+    offset = _PCAP_HEADER_SIZE
+    while offset + _RECORD_HEADER_SIZE <= len(data):
+        ts_sec, ts_frac, incl_len, _ = struct.unpack(endian + "IIII", data[offset:offset + _RECORD_HEADER_SIZE])
+        end = offset + _RECORD_HEADER_SIZE + incl_len
+        records.append(((ts_sec, ts_frac), data[offset:end]))
+        offset = end
+    return data[:_PCAP_HEADER_SIZE], records
+
+def merge_pcaps(paths):
+    """
+    Merge the per-device pcap files of one simulation into a single capture ordered by time.
+
+    Parameters
+        ----------
+        paths : list
+            Paths to pcap files written with the same link type (e.g., by YansWifiPhyHelper.EnablePcapAll).
+
+        Returns
+        -------
+        header : bytes
+            The pcap global header, or None if no file holds one.
+        records : bytes
+            The records of all files, ordered by capture time.
+    """
+    header = None
+    streams = []
+    for path in sorted(paths):
+        file_header, records = _read_pcap(path)
+        if file_header is not None and header is None:
+            header = file_header
+        streams.append(records)
+    merged = heapq.merge(*streams, key=lambda record: record[0])
+    return header, b"".join(record for _, record in merged)
+
+def merge_consolidated(paths, path):
+    """
+    Concatenate consolidated captures, e.g., those of the work units of a scenario, into one.
+
+    Parameters
+        ----------
+        paths : list
+            The gzip-compressed captures, in the order their time stamps are kept. Files without any record are skipped.
+        path : str
+            The merged capture, which may be one of paths. It is replaced atomically once complete.
+    """
+    header = None
+    with gzip.open(path + ".tmp", "wb", compresslevel=6) as out:
+        for part_path in paths:
+            with gzip.open(part_path, "rb") as fp:
+                part_header = fp.read(_PCAP_HEADER_SIZE)
+                if len(part_header) < _PCAP_HEADER_SIZE:
+                    continue
+                if header is None:
+                    header = part_header
+                    out.write(header)
+                shutil.copyfileobj(fp, out)
+    os.replace(path + ".tmp", path)
+
+def _default_anomaly(result, run_stats):
+    # The run was cut by simStop before the applications finished, or nothing was received at all.
+    if run_stats is not None and run_stats.get("stopped_early") is False:
+        return True
+    return result is not None and not any(ele["receive"] for ele in result.values())
+
+
+class TracePolicy():
+    """
+    Decide which packet captures simulate() writes.
+
+    Modes
+        ----------
+        all : one pcap per device and time stamp in the working directory, as simulate() always did.
+        none : no capture at all.
+        sampled : the per-device pcaps of every sample_every-th time stamp of a scenario, in a pcap folder of the scenario.
+                  The time stamps are counted from begin_scenario, unless begin_stamp gives their index in the scenario.
+        consolidated : one gzip-compressed pcap per scenario (CONSOLIDATED_FILENAME), holding the captures
+                       of all time stamps one after the other, each ordered by time.
+        ring : the merged captures of the last ring_size time stamps are kept in memory, and are written as
+               anomaly_<stamp>.pcap.gz only when is_anomaly(result, run_stats) holds for a time stamp.
+               The result is None when the events are streamed to a file.
+
+    The consolidated and ring modes let ns-3 write into a temporary folder (in /dev/shm when available),
+    which is merged and emptied after every time stamp. A scenario split into work units writes the consolidated
+    capture of each unit to its own file, which merge_consolidated concatenates, and the ring of each unit starts empty.
+
+    Parameters
+        ----------
+        mode : str
+            One of TRACE_MODES.
+        sample_every : int
+            The sampling period in time stamps of the sampled mode.
+        ring_size : int
+            The number of time stamps kept by the ring mode.
+        is_anomaly : callable
+            Called with the parsed result and the run statistics of a time stamp in the ring mode.
+            Defaults to a run cut by simStop or without any received packet.
+    """
+    def __init__(self, mode = "all", sample_every = 100, ring_size = 8, is_anomaly = None) -> None:
+        if mode not in TRACE_MODES:
+            raise ValueError(f"Unknown trace mode {mode}, expected one of {TRACE_MODES}.")
+        self.mode = mode
+        self.sample_every = sample_every
+        self.ring_size = ring_size
+        self.is_anomaly = is_anomaly if is_anomaly is not None else _default_anomaly
+        self._folder = None
+        self._stamp_idx = 0 # The index in its scenario of the next time stamp
+        self._tmp_dir = None
+        self._consolidated = None
+        self._consolidated_path = None
+        self._ring = collections.deque(maxlen=ring_size)
+        self._header = None
+        self._wifi_phy = None # The PHY helper whose pcap files end_stamp closes
+
+    def begin_scenario(self, folder, consolidated_path = None):
+        """
+        Start a scenario whose outputs are saved in folder.
+
+        Parameters
+            ----------
+            folder : str
+                The output folder of the scenario.
+            consolidated_path : str
+                The consolidated capture, defaults to CONSOLIDATED_FILENAME in folder.
+        """
+        self.end_scenario()
+        self._folder = folder
+        self._stamp_idx = 0
+        self._ring.clear()
+        if self.mode in ("consolidated", "ring"):
+            os.makedirs(folder, exist_ok=True)
+            self._tmp_dir = tempfile.mkdtemp(prefix="comm_sim_pcap_", dir="/dev/shm" if os.path.isdir("/dev/shm") else None)
+        if self.mode == "consolidated":
+            self._consolidated_path = consolidated_path if consolidated_path is not None else os.path.join(folder, CONSOLIDATED_FILENAME)
+            os.makedirs(os.path.dirname(self._consolidated_path), exist_ok=True)
+            self._consolidated = gzip.open(self._consolidated_path + ".tmp", "wb", compresslevel=6)
+            self._header = None
+
+    def begin_stamp(self, stamp_idx):
+        """Set the index in its scenario of the next time stamp, e.g., when a work unit simulates a part of the scenario."""
+        self._stamp_idx = stamp_idx
+
+    def enable(self, wifiPhy, devices, experiment_title):
+        """Enable the captures of the next time stamp on the wifi PHY helper of simulate()."""
+        if self.mode != "none":
+            self._wifi_phy = wifiPhy
+        if self.mode == "all":
+            wifiPhy.EnablePcap("wave-simple-80211p", devices)
+            wifiPhy.EnablePcapAll(experiment_title)
+        elif self.mode == "sampled":
+            if self._stamp_idx % self.sample_every == 0:
+                pcap_folder = os.path.join(self._folder, "pcap") if self._folder is not None else "pcap"
+                os.makedirs(pcap_folder, exist_ok=True)
+                wifiPhy.EnablePcapAll(os.path.join(pcap_folder, experiment_title))
+        elif self.mode in ("consolidated", "ring"):
+            if self._tmp_dir is None:
+                raise RuntimeError(f"begin_scenario must be called before enabling the {self.mode} mode.")
+            wifiPhy.EnablePcapAll(os.path.join(self._tmp_dir, "stamp"))
+
+    def end_stamp(self, stamp, result, run_stats = None):
+        """
+        Collect the captures of a time stamp. Call it after simulate() returned, so the simulation is over.
+        The pcap files of the time stamp are closed first, so they are complete on disk.
+
+        Parameters
+            ----------
+            stamp : int
+                The time stamp that was simulated.
+            result : dict
+                The parsed result of the time stamp.
+            run_stats : dict
+                The run statistics filled by simulate().
+        """
+        self._stamp_idx += 1
+        if self._wifi_phy is not None:
+            self._wifi_phy.ClosePcapFiles()
+            self._wifi_phy = None
+        if self.mode not in ("consolidated", "ring"):
+            return
+        paths = glob.glob(os.path.join(self._tmp_dir, "stamp-*.pcap"))
+        header, records = merge_pcaps(paths)
+        for path in paths:
+            os.remove(path)
+        if header is None:
+            return
+
+        if self.mode == "consolidated":
+            if self._header is None:
+                self._header = header
+                self._consolidated.write(header)
+            self._consolidated.write(records)
+        else:
+            self._ring.append((stamp, header, records))
+            if self.is_anomaly(result, run_stats):
+                with gzip.open(os.path.join(self._folder, f"anomaly_{stamp}.pcap.gz"), "wb") as fp:
+                    fp.write(header)
+                    for _, _, ring_records in self._ring:
+                        fp.write(ring_records)
+
+    def end_scenario(self):
+        """Finish the outputs of the current scenario and remove the temporary folder."""
+        if self._consolidated is not None:
+            self._consolidated.close()
+            os.replace(self._consolidated_path + ".tmp", self._consolidated_path)
+            self._consolidated = None
+        if self._tmp_dir is not None:
+            shutil.rmtree(self._tmp_dir, ignore_errors=True)
+            self._tmp_dir = None
+        self._ring.clear()
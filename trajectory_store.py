@@ -0,0 +1,120 @@
+import os
+import struct
+import zipfile
+import numpy as np
+
+STORE_FILENAME = "trajectories.npz" # The per-scenario trajectory store, saved in the scenario folder
+COLUMNS = ["time", "x", "y", "z", "roll", "yaw", "pitch"]
+
+
+def store_path(scenario_path):
+    """
+    A util function to get the path of the trajectory store of a scenario.
+
+    Parameters
+        ----------
+        scenario_path : str
+            Path to the scenario folder.
+
+        Returns
+        -------
+        path : str
+            Path to the trajectory store.
+    """
+    return os.path.join(scenario_path, STORE_FILENAME)
+
+def rows_to_array(rows, dtype=np.float64):
+    """
+    Convert the [time, [x, y, z, roll, yaw, pitch]] rows of one agent into a 2D array.
+
+    Parameters
+        ----------
+        rows : list
+            The waypoints of one agent, as produced by generate_vehicle_traj.
+        dtype : numpy.dtype
+            The dtype of the stored array.
+
+        Returns
+        -------
+        trajectory : numpy.ndarray
+            An array of shape (n_stamps, 7) with the columns listed in COLUMNS.
+    """
+    trajectory = np.empty((len(rows), len(COLUMNS)), dtype=dtype)
+    for i, (time, pose) in enumerate(rows):
+        trajectory[i, 0] = time
+        trajectory[i, 1:] = pose
+    return trajectory
+
+def save_trajectories(scenario_path, trajectories, dtype=np.float64):
+    """
+    Write the trajectories of all agents of a scenario into one uncompressed npz file.
+
+    Parameters
+        ----------
+        scenario_path : str
+            Path to the scenario folder.
+        trajectories : dict
+            A dictionary with agent ids as keys and their rows or (n_stamps, 7) arrays as values.
+        dtype : numpy.dtype
+            The dtype of the stored arrays.
+    """
+    arrays = {}
+    for agent_id in sorted(trajectories):
+        trajectory = trajectories[agent_id]
+        if isinstance(trajectory, np.ndarray):
+            arrays[agent_id] = np.ascontiguousarray(trajectory, dtype=dtype)
+        else:
+            arrays[agent_id] = rows_to_array(trajectory, dtype)
+
+    path = store_path(scenario_path)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as fp:
+        np.savez(fp, **arrays)
+    os.replace(tmp_path, path)
+
+def _member_offset(fp, info):
+    # Skip the local file header of the zip member and the header of the npy file inside it.
+    fp.seek(info.header_offset)
+    local_header = fp.read(30)
+    name_length, extra_length = struct.unpack("<HH", local_header[26:30])
+    fp.seek(info.header_offset + 30 + name_length + extra_length)
+    version = np.lib.format.read_magic(fp)
+    if version == (1, 0):
+        shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(fp)
+    else:
+        shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(fp)
+    return fp.tell(), shape, fortran_order, dtype
+
+def load_trajectories(scenario_path, mmap=True):
+    """
+    Read the trajectories of all agents of a scenario.
+
+    Parameters
+        ----------
+        scenario_path : str
+            Path to the scenario folder.
+        mmap : bool
+            If True, the returned arrays are read-only views of a memory map of the store,
+            so nothing is parsed or copied and processes share the pages of the file.
+
+        Returns
+        -------
+        trajectories : dict
+            A dictionary with agent ids as keys and (n_stamps, 7) arrays as values.
+    """
+    path = store_path(scenario_path)
+    if not mmap:
+        with np.load(path) as archive:
+            return {name: archive[name] for name in archive.files}
+
+    trajectories = {}
+    buffer = np.memmap(path, dtype=np.uint8, mode="r")
+    with open(path, "rb") as fp, zipfile.ZipFile(fp) as archive:
+        for info in archive.infolist():
+            if info.compress_type != zipfile.ZIP_STORED:
+                raise ValueError(f"{path} is compressed and cannot be memory mapped.")
+            offset, shape, fortran_order, dtype = _member_offset(fp, info)
+            order = "F" if fortran_order else "C"
+            agent_id = info.filename[:-len(".npy")]
+            trajectories[agent_id] = np.ndarray(shape, dtype=dtype, buffer=buffer, offset=offset, order=order)
+    return trajectories